@@ -0,0 +1,134 @@
+import io
+import os
+import json
+import fnmatch
+import tarfile
+import zipfile
+import collections
+from PIL import Image
+
+'''
+Random-access reads of the members of zip and (uncompressed) tar archives, so frames can be read straight from the
+downloaded KITTI odometry / Robotcar archives instead of extracted copies.
+
+A member is addressed as '{archive}!{member}' (e.g. '/data/data_odometry_color.zip!dataset/sequences/00/image_2/000000.png').
+open_image() accepts these paths as well as plain file paths, so they can be used wherever a frame path is expected
+(e.g. in the cam_02/cam_03 lists of a .mat file).
+
+Archives are indexed once: zip archives by their central directory, tar archives by a scan of their headers that is
+stored next to the archive ('{archive}.members.json') and reused while it is newer than the archive.  File handles are
+opened lazily in each process, so readers can be shared with DataLoader workers and process pools.  Recently read
+members can be kept in a bounded per-process LRU cache (hot frames, e.g. of the val and test sequences).
+'''
+
+ARCHIVE_SEPARATOR = '!'
+ARCHIVE_EXTENSIONS = ('.zip', '.tar')
+
+archives = {} #opened once per process, by filename
+cache_bytes = 0 #byte budget of the member cache of each archive (set_cache_size)
+
+def set_cache_size(megabytes):
+    global cache_bytes
+    cache_bytes = int(megabytes*2**20)
+    for archive in archives.values():
+        archive.cache_bytes = cache_bytes
+
+def is_archive_path(path):
+    path = str(path)
+    return ARCHIVE_SEPARATOR in path and path.split(ARCHIVE_SEPARATOR, 1)[0].endswith(ARCHIVE_EXTENSIONS)
+
+def archive_path(archive, member):
+    return '{}{}{}'.format(archive, ARCHIVE_SEPARATOR, member)
+
+def split_archive_path(path):
+    archive, member = str(path).split(ARCHIVE_SEPARATOR, 1)
+    return archive, member
+
+class ArchiveReader(object):
+    """Member index and random-access reads of one zip or uncompressed tar archive"""
+    def __init__(self, filename, cache_bytes=0):
+        self.filename = filename
+        self.cache_bytes = cache_bytes
+        self.cache = collections.OrderedDict()
+        self.cached_bytes = 0
+        self.pid, self.handle = None, None
+        self.is_zip = zipfile.is_zipfile(filename)
+        if self.is_zip:
+            with zipfile.ZipFile(filename) as f:
+                self.members = {info.filename: None for info in f.infolist() if not info.is_dir()}
+        else:
+            self.members = self.tar_index()
+
+    def tar_index(self):
+        """{member: (data offset, size)} of the regular files of a tar archive"""
+        index_file = self.filename + '.members.json'
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(self.filename):
+            with open(index_file) as f:
+                return {name: tuple(entry) for name, entry in json.load(f).items()}
+        try:
+            with tarfile.open(self.filename, 'r:') as f:
+                members = {m.name: (m.offset_data, m.size) for m in f if m.isfile()}
+        except tarfile.ReadError:
+            raise ValueError('{} is not a zip or uncompressed tar archive (compressed tar archives cannot be read randomly)'.format(self.filename))
+        try:
+            with open(index_file, 'w') as f:
+                json.dump(members, f)
+        except OSError: #read-only dataset directory
+            pass
+        return members
+
+    def open(self):
+        """File handle of this process (handles are not shared with forked workers)"""
+        if self.pid != os.getpid():
+            self.handle = zipfile.ZipFile(self.filename) if self.is_zip else open(self.filename, 'rb')
+            self.pid = os.getpid()
+        return self.handle
+
+    def names(self):
+        return sorted(self.members)
+
+    def read(self, member):
+        if member in self.cache:
+            self.cache.move_to_end(member)
+            return self.cache[member]
+        if member not in self.members:
+            raise FileNotFoundError('{} is not in {}'.format(member, self.filename))
+        handle = self.open()
+        if self.is_zip:
+            data = handle.read(member)
+        else:
+            offset, size = self.members[member]
+            data = os.pread(handle.fileno(), size, offset)
+        if len(data) <= self.cache_bytes:
+            self.cache[member] = data
+            self.cached_bytes += len(data)
+            while self.cached_bytes > self.cache_bytes:
+                self.cached_bytes -= len(self.cache.popitem(last=False)[1])
+        return data
+
+def open_archive(filename):
+    if filename not in archives:
+        archives[filename] = ArchiveReader(filename, cache_bytes)
+    return archives[filename]
+
+def read_file(path):
+    """Bytes of a file or of an archive member"""
+    if is_archive_path(path):
+        archive, member = split_archive_path(path)
+        return open_archive(archive).read(member)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def open_image(path):
+    """PIL image of a file or of an archive member (opened lazily, like Image.open, so e.g. Image.draft still applies)"""
+    if is_archive_path(path):
+        return Image.open(io.BytesIO(read_file(path)))
+    return Image.open(path)
+
+def glob_archives(filenames, pattern):
+    """Sorted archive paths of the members of the given archives whose names match a shell pattern"""
+    paths = []
+    for filename in filenames:
+        archive = open_archive(filename)
+        paths += [(member, archive_path(filename, member)) for member in archive.names() if fnmatch.fnmatch(member, pattern)]
+    return [path for member, path in sorted(paths)]
@@ -0,0 +1,85 @@
+import numpy as np
+import scipy.io as sio
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+sys.path.insert(0,'..')
+from data.frame_codec import frame_params, write_frame, load_frame
+
+'''
+Compares the storage formats of the preprocessed frames (create_* scripts, --output_format and --pack_frames) on frames
+of one preprocessed sequence: the frames are re-encoded in every format into --tmp_dir (put it on the storage used for
+training, e.g. the NFS share, to include its reads), then read back.
+
+Reported per format: bytes per frame, read + decode throughput of a single process (as in one loader worker; the files
+were just written, so they are usually in the page cache and this is mostly the decode cost), the read bandwidth that
+throughput needs from the storage, and the PSNR against the frames as they are stored now (lossless formats are inf;
+if the frames are jpgs, the lossy rows are relative to those).
+'''
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument("--data_dir", type=str, default='/media/m2-drive/datasets/KITTI-odometry-downsized/med_res')
+parser.add_argument('--seq', type=str, default='2011_09_30_drive_0018_sync', help='sequence directory')
+parser.add_argument('--estimator', type=str, default='orbslam')
+parser.add_argument('--estimator_type', type=str, default='mono')
+parser.add_argument('--num_frames', type=int, default=200)
+parser.add_argument('--jpeg_quality', nargs='+', type=int, default=[75, 90, 95])
+parser.add_argument('--png_compression', nargs='+', type=int, default=[1, 6])
+parser.add_argument('--repeats', type=int, default=3, help='read passes per format (the fastest is reported)')
+parser.add_argument('--tmp_dir', type=str, default=None)
+args = parser.parse_args()
+
+mat_name = '{}_data_{}'.format(args.estimator_type, args.estimator)
+data = sio.loadmat(os.path.join(args.data_dir, args.seq, '{}.mat'.format(mat_name)))
+filenames = [f.strip() for f in data['cam_02'].reshape((-1))]
+frames = np.linspace(0, len(filenames)-1, min(args.num_frames, len(filenames))).astype(np.int64)
+imgs = [load_frame(filenames[f]) for f in frames]
+print('{}: {} frames ({}x{}, stored as {})'.format(args.seq, len(imgs), imgs[0].shape[1], imgs[0].shape[0], os.path.splitext(filenames[0])[1]))
+
+def psnr(decoded):
+    mse = np.mean([np.mean((d.astype(np.float64) - img)**2) for d, img in zip(decoded, imgs)])
+    return 10*np.log10(255.**2/mse) if mse > 0 else np.inf
+
+def timed_reads(read):
+    """Fastest of --repeats passes of read(i) over all frames, and the frames of the last pass"""
+    times = []
+    for _ in range(0, args.repeats):
+        start = time.time()
+        decoded = [read(i) for i in range(0, len(imgs))]
+        times.append(time.time() - start)
+    return min(times), decoded
+
+def report(name, num_bytes, read_time, decoded):
+    frames_per_s = len(imgs)/read_time
+    print('{:10s} {:10.1f} {:12.1f} {:10.1f} {:8.2f}'.format(name, num_bytes/len(imgs)/1024, frames_per_s, \
+        frames_per_s*num_bytes/len(imgs)/2**20, psnr(decoded)))
+
+tmp_dir = tempfile.mkdtemp(dir=args.tmp_dir)
+try:
+    print('{:10s} {:>10s} {:>12s} {:>10s} {:>8s}'.format('format', 'KiB/frame', 'frames/s', 'MiB/s', 'PSNR'))
+    codecs = [('jpg q{}'.format(q), frame_params('jpg', jpeg_quality=q)) for q in args.jpeg_quality] + \
+        [('png z{}'.format(z), frame_params('png', png_compression=z)) for z in args.png_compression] + [('npy', frame_params('npy'))]
+    for name, params in codecs:
+        files = [os.path.join(tmp_dir, '{:06d}.{}'.format(i, params['format'])) for i in range(0, len(imgs))]
+        for f, img in zip(files, imgs):
+            write_frame(f, img, params)
+        read_time, decoded = timed_reads(lambda i: load_frame(files[i]))
+        report(name, sum(os.path.getsize(f) for f in files), read_time, decoded)
+        for f in files:
+            os.remove(f)
+
+        ### packed per-sequence array (--frame_store): frames are copied out of the memory-mapped array
+    packed_file = os.path.join(tmp_dir, 'frames.npy')
+    packed = np.lib.format.open_memmap(packed_file, mode='w+', dtype=np.uint8, shape=(len(imgs),) + imgs[0].shape)
+    packed[:] = np.stack(imgs)
+    packed.flush()
+    del packed
+    packed = np.load(packed_file, mmap_mode='c')
+    read_time, decoded = timed_reads(lambda i: np.array(packed[i]))
+    report('packed', os.path.getsize(packed_file), read_time, decoded)
+    del packed
+finally:
+    shutil.rmtree(tmp_dir)
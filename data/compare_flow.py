@@ -0,0 +1,86 @@
+import numpy as np
+import scipy.io as sio
+import os
+import sys
+import time
+import argparse
+import torch
+sys.path.insert(0,'..')
+from data.kitti_loader import farneback_flow, to_gray
+from data.frame_codec import load_frame
+from utils.dense_flow import lucas_kanade_flow, warp
+
+'''
+Compares the on-device Lucas-Kanade flow (--flow_type device) with the Farneback flow the loader workers compute on the
+CPU (--flow_type classical), on frame pairs of one preprocessed sequence.
+
+Throughput: Farneback pairs/s of a single process (as in one loader worker), and Lucas-Kanade pairs/s of batched calls on
+--device.  Image decoding is excluded from both.  Accuracy: KITTI odometry has no ground truth flow, so each flow is scored
+by the photometric error of warping the second image back to the first (mean absolute gray-level difference, compared
+with zero flow), and the Lucas-Kanade flow by its mean endpoint difference to Farneback.
+'''
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument("--data_dir", type=str, default='/media/m2-drive/datasets/KITTI-odometry-downsized/med_res')
+parser.add_argument('--seq', type=str, default='2011_09_30_drive_0018_sync', help='sequence directory')
+parser.add_argument('--estimator', type=str, default='orbslam')
+parser.add_argument('--estimator_type', type=str, default='mono')
+parser.add_argument('--offsets', nargs='+', type=int, default=[1,2], help='frame offsets of the compared pairs')
+parser.add_argument('--num_pairs', type=int, default=128, help='pairs per offset')
+parser.add_argument('--batch_size', type=int, default=32, help='pairs per Lucas-Kanade call')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+parser.add_argument('--num_levels', type=int, default=4)
+parser.add_argument('--window', type=int, default=15)
+parser.add_argument('--iterations', type=int, default=3)
+parser.add_argument('--smooth', type=int, default=5)
+args = parser.parse_args()
+
+mat_name = '{}_data_{}'.format(args.estimator_type, args.estimator)
+data = sio.loadmat(os.path.join(args.data_dir, args.seq, '{}.mat'.format(mat_name)))
+filenames = [f.strip() for f in data['cam_02'].reshape((-1))]
+device = torch.device(args.device)
+torch.set_num_threads(1) if device.type == 'cpu' else None #compare with one loader worker
+
+def synchronize():
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+def photometric_error(img_1, img_2, flow):
+    """Mean absolute difference between img_1 and img_2 warped back by flow, over the pixels that stay in the image"""
+    h, w = img_1.shape[2:]
+    y, x = torch.meshgrid(torch.arange(h, device=flow.device), torch.arange(w, device=flow.device), indexing='ij')
+    inside = (x + flow[:,0] >= 0) & (x + flow[:,0] <= w-1) & (y + flow[:,1] >= 0) & (y + flow[:,1] <= h-1)
+    diff = (warp(img_2, flow) - img_1).abs()[:,0]
+    return (diff*inside).sum().item()/max(inside.sum().item(), 1)
+
+for offset in args.offsets:
+    frames = np.linspace(0, len(filenames)-1-offset, min(args.num_pairs, len(filenames)-offset)).astype(np.int64)
+    gray = {f: to_gray(load_frame(filenames[f])) for f in np.unique(np.concatenate((frames, frames+offset)))}
+    print('{}: {} pairs at offset {} ({}x{})'.format(args.seq, frames.shape[0], offset, *gray[frames[0]].shape))
+
+    start = time.time()
+    farneback = np.stack([farneback_flow(gray[f], gray[f+offset]) for f in frames])
+    farneback_time = time.time() - start
+
+    imgs_1 = torch.from_numpy(np.stack([gray[f] for f in frames])).float().unsqueeze(1)
+    imgs_2 = torch.from_numpy(np.stack([gray[f+offset] for f in frames])).float().unsqueeze(1)
+    batches = [(imgs_1[i:i+args.batch_size].to(device), imgs_2[i:i+args.batch_size].to(device)) for i in range(0, frames.shape[0], args.batch_size)]
+    kwargs = {'num_levels': args.num_levels, 'window': args.window, 'iterations': args.iterations, 'smooth': args.smooth}
+    with torch.no_grad():
+        lucas_kanade_flow(*batches[0], **kwargs) #warm up (cudnn, allocator)
+        synchronize()
+        start = time.time()
+        lk = torch.cat([lucas_kanade_flow(img_1, img_2, **kwargs) for img_1, img_2 in batches])
+        synchronize()
+        lk_time = time.time() - start
+
+        imgs_1, imgs_2, farneback = imgs_1.to(device), imgs_2.to(device), torch.from_numpy(farneback).to(device)
+        errors = {name: photometric_error(imgs_1, imgs_2, flow) for name, flow in [('zero flow', torch.zeros_like(lk)), ('farneback', farneback), ('lucas-kanade', lk)]}
+        endpoint_diff = (lk - farneback).norm(dim=1).mean().item()
+
+    print('  farneback (cpu, 1 process): {:8.1f} pairs/s'.format(frames.shape[0]/farneback_time))
+    print('  lucas-kanade ({}):        {:8.1f} pairs/s'.format(device, frames.shape[0]/lk_time))
+    for name, error in errors.items():
+        print('  photometric error, {:12s}: {:6.2f}'.format(name, error))
+    print('  mean endpoint difference lucas-kanade vs farneback: {:.3f} px (mean farneback magnitude {:.3f} px)'.format(\
+        endpoint_diff, farneback.norm(dim=1).mean().item()))
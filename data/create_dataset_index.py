@@ -0,0 +1,38 @@
+import numpy as np
+import scipy.io as sio
+import os
+import sys
+import glob
+import argparse
+sys.path.insert(0,'..')
+from data.dataset_index import PathTable, write_dataset_index, dataset_index_filename
+
+'''
+Writes the single-file index of a preprocessed data directory (poses, vo, timestamps, intrinsics and frame paths of every
+sequence), which KittiLoaderPytorch memory-maps instead of parsing each sequence's .mat file.  Rerun it whenever the
+.mat files are regenerated (sequences whose .mat file is newer than the index are loaded from the .mat file).
+'''
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument("--data_dir", type=str, default='/media/m2-drive/datasets/KITTI-odometry-downsized/med_res')
+parser.add_argument('--estimator', type=str, default='orbslam')
+parser.add_argument('--estimator_type', type=str, default='mono')
+args = parser.parse_args()
+
+mat_name = '{}_data_{}'.format(args.estimator_type, args.estimator)
+keys = ['sparse_gt_pose', 'sparse_vo', 'intrinsics_left', 'intrinsics_right']
+
+sequences = {}
+for mat_file in sorted(glob.glob('{}/*/{}.mat'.format(args.data_dir, mat_name))):
+    name = os.path.basename(os.path.dirname(mat_file))
+    data = sio.loadmat(mat_file)
+    sequences[name] = {k: data[k] for k in keys}
+    sequences[name]['ts'] = data['ts'].reshape((-1))
+    for cam in ['cam_02', 'cam_03']:
+        sequences[name][cam] = PathTable()
+        sequences[name][cam].extend(data[cam].reshape((-1)))
+    print('{}: {} frames'.format(name, sequences[name]['ts'].shape[0]))
+
+filename = dataset_index_filename(args.data_dir, mat_name)
+write_dataset_index(filename, sequences)
+print('wrote {} ({} sequences, {:.1f} MB)'.format(filename, len(sequences), os.path.getsize(filename)/2.**20))
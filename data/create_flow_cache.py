@@ -0,0 +1,70 @@
+import numpy as np
+import scipy.io as sio
+import os
+import sys
+import glob
+import concurrent.futures
+import argparse
+sys.path.insert(0,'..')
+from data.kitti_loader import farneback_flow, flow_cache_filename, to_gray
+from data.frame_codec import load_frame
+
+'''
+Precomputes the classical (Farneback) optical flow used with --flow_type cached.
+
+For every frame f of a sequence's .mat file, the flow from f to f+offset is stored (float16, channels first) in one
+memory-mapped .npy per offset, which covers the forward and backward flow of every (target, source) pair the loader
+can draw. Run this on the preprocessed data directory of the resolution being trained on.
+'''
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument("--data_dir", type=str, default='/media/m2-drive/datasets/KITTI-odometry-downsized/med_res')
+parser.add_argument('--seq', nargs='+', type=str, default=['all'], help='sequence directories to process (default: all)')
+parser.add_argument('--estimator', type=str, default='orbslam')
+parser.add_argument('--estimator_type', type=str, default='mono')
+parser.add_argument('--img_per_sample', type=int, default=3)
+parser.add_argument('--strides', nargs='+', type=int, default=[1], help='frame strides used in training (correction_rate times each of --frame_strides with --augment_motion)')
+args = parser.parse_args()
+
+mat_name = '{}_data_{}'.format(args.estimator_type, args.estimator)
+target_idx = int(args.img_per_sample/2)
+offsets = sorted(set([sign*(i-target_idx)*stride for i in range(0,args.img_per_sample) if i != target_idx \
+    for stride in args.strides for sign in [-1,1]]))
+print('offsets: {}'.format(offsets))
+
+def load_gray(img_file):
+    return to_gray(load_frame(img_file)) #any frame format, from a file or a member of a zip/tar archive
+
+def compute_flows(frame_files):
+    img_file, offset_files = frame_files
+    img = load_gray(img_file)
+    return [farneback_flow(img, load_gray(f)).astype(np.float16) for f in offset_files]
+
+if args.seq == ['all']:
+    seq_dirs = sorted([os.path.dirname(f) for f in glob.glob('{}/*/{}.mat'.format(args.data_dir, mat_name))])
+else:
+    seq_dirs = [os.path.join(args.data_dir, s) for s in args.seq]
+
+for seq_dir in seq_dirs:
+    data = sio.loadmat(os.path.join(seq_dir, '{}.mat'.format(mat_name)))
+    filenames = [f.strip() for f in data['cam_02'].reshape((-1))]
+    num_frames = len(filenames)
+    h, w = load_gray(filenames[0]).shape
+    print('{}: {} frames ({}x{})'.format(seq_dir, num_frames, h, w))
+
+    os.makedirs(os.path.join(seq_dir, 'flow'), exist_ok=True)
+    caches = [np.lib.format.open_memmap(flow_cache_filename(seq_dir, mat_name, offset), mode='w+', dtype=np.float16, \
+        shape=(num_frames, 2, h, w)) for offset in offsets]
+
+        ###frames without a partner at some offset get zero flow there (no window ever uses it)
+    valid = [[0 <= f+offset < num_frames for offset in offsets] for f in range(0,num_frames)]
+    frame_files = [(filenames[f], [filenames[f+offset] for offset, v in zip(offsets, valid[f]) if v]) for f in range(0,num_frames)]
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        for f, flows in enumerate(executor.map(compute_flows, frame_files, chunksize=16)):
+            flows = iter(flows)
+            for cache, v in zip(caches, valid[f]):
+                cache[f] = next(flows) if v else 0
+
+    for cache in caches:
+        cache.flush()
+    del caches
@@ -0,0 +1,44 @@
+import numpy as np
+import scipy.io as sio
+import os
+import sys
+import glob
+import concurrent.futures
+import argparse
+sys.path.insert(0,'..')
+from data.kitti_loader import frame_store_filename
+from data.frame_codec import load_frame, pack_frames
+
+'''
+Packs the preprocessed images of each sequence into one uint8 (N,H,W,3) memory-mapped .npy per camera (used with --frame_store).
+
+Frames are stored in the order of the cam_02/cam_03 lists of the sequence's .mat file, so the loader indexes them directly
+instead of decoding a jpg for every frame of every sample. Run this on the preprocessed data directory of the resolution
+being trained on (or preprocess with --pack_frames, which does the same).  The frames can be in any of the formats of
+frame_codec.py.
+'''
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument("--data_dir", type=str, default='/media/m2-drive/datasets/KITTI-odometry-downsized/med_res')
+parser.add_argument('--seq', nargs='+', type=str, default=['all'], help='sequence directories to process (default: all)')
+parser.add_argument('--estimator', type=str, default='orbslam')
+parser.add_argument('--estimator_type', type=str, default='mono')
+parser.add_argument('--cams', nargs='+', type=str, default=['cam_02', 'cam_03'])
+args = parser.parse_args()
+
+mat_name = '{}_data_{}'.format(args.estimator_type, args.estimator)
+
+if args.seq == ['all']:
+    seq_dirs = sorted([os.path.dirname(f) for f in glob.glob('{}/*/{}.mat'.format(args.data_dir, mat_name))])
+else:
+    seq_dirs = [os.path.join(args.data_dir, s) for s in args.seq]
+
+for seq_dir in seq_dirs:
+    data = sio.loadmat(os.path.join(seq_dir, '{}.mat'.format(mat_name)))
+    os.makedirs(os.path.join(seq_dir, 'frames'), exist_ok=True)
+    for cam in args.cams:
+        filenames = [f.strip() for f in data[cam].reshape((-1))]
+        h, w, _ = load_frame(filenames[0]).shape
+        print('{} ({}): {} frames ({}x{})'.format(seq_dir, cam, len(filenames), h, w))
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            pack_frames(filenames, frame_store_filename(seq_dir, mat_name, cam), executor)
@@ -1,170 +1,165 @@
 import pykitti
 import numpy as np
 import scipy.io as sio
-import imageio
 import os
 import concurrent.futures
 from PIL import Image
 import argparse
-from liegroups import SE3
+import sys
+sys.path.insert(0,'..')
+from data.archive_reader import open_image, glob_archives, is_archive_path, split_archive_path
+from data.preprocess_manifest import Manifest
+from data.static_frames import remove_static_frames
+from data.frame_codec import output_formats, frame_params, frame_filename, write_frame, pack_frames
+from data.kitti_loader import frame_store_filename
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument("--source_dir", type=str, default='/media/m2-drive/datasets/KITTI-odometry/')
 parser.add_argument("--target_dir", type=str, default='/media/m2-drive/datasets/KITTI-odometry-downsized')
 parser.add_argument("--remove_static", action='store_true', default=False)
+parser.add_argument("--source_archive", nargs='+', type=str, default=None, help='read the images from the KITTI zip archive(s) (e.g. data_odometry_color.zip) instead of extracted files (calib and times files are still read from --source_dir)')
+parser.add_argument("--resolutions", nargs='+', type=str, default=['low_res', 'med_res', 'high_res'], help='full_res keeps the original size (a single copy the loader can rescale to any resolution with --source_resolution)')
+parser.add_argument("--sequences", nargs='+', type=str, default=None, help='sequences to process (default: all); runs on different sequences can be started concurrently')
+parser.add_argument("--verify_hash", action='store_true', default=False, help='also record the sha1 of the source images, so that sources with a new mtime but the same content are not reprocessed')
+parser.add_argument("--output_format", type=str, default='jpg', choices=output_formats, help='format of the written frames (see frame_codec.py and compare_codecs.py)')
+parser.add_argument("--jpeg_quality", type=int, default=75)
+parser.add_argument("--png_compression", type=int, default=6, help='zlib level of png frames (0-9)')
+parser.add_argument("--pack_frames", action='store_true', default=False, help='also pack the frames of each sequence into the arrays read with --frame_store')
 args = parser.parse_args()
 
 
-resolutions = {'low_res': {'height':128, 'width': 448}, 'med_res': {'height':192, 'width': 640}, 'high_res': {'height':256,'width':832}}
-
-for resolution in ['low_res', 'med_res', 'high_res']:
-    target_dir = '{}/{}/'.format(args.target_dir,resolution)
-    os.makedirs(target_dir, exist_ok=True)
-    seq_info = {}
-    seq_names= {'00': '2011_10_03_drive_0027_sync',
-        '01': '2011_10_03_drive_0042_sync',
-        '02': '2011_10_03_drive_0034_sync',
-        '04': '2011_09_30_drive_0016_sync',
-        '05': '2011_09_30_drive_0018_sync',
-        '06': '2011_09_30_drive_0020_sync',
-        '07': '2011_09_30_drive_0027_sync',
-        '08': '2011_09_30_drive_0028_sync',
-        '09': '2011_09_30_drive_0033_sync',
-        '10': '2011_09_30_drive_0034_sync',
-        '11': '11',
-        '12': '12',
-        '13': '13',
-        '14': '14',
-        '15': '15',
-        '16': '16',
-        '17': '17',
-        '18': '18',
-        '19': '19',
-        '20': '20',
-        '21': '21',
-    }
-    
-    sequences = ['00', '01', '02', '04', '05', '06', '07', '08', '09', '10', '11', '12', '13', '14', '15', '16', '17', '18', '19' , '20', '21']
-
-    args.height =  resolutions[resolution]['height']
-    args.width =  resolutions[resolution]['width']
-
-        
-    mono_orbslam_dir = 'orbslam-estimates/orbslam_mono_traj_odometry/'
-    print(args.height, args.width)
-          
-    def load_image(img_file):
-        img_height = args.height 
-        img_width = args.width 
-        img = np.array(Image.open(img_file))
-        orig_img_height = img.shape[0]
-        orig_img_width = img.shape[1]
-        zoom_y = img_height/orig_img_height
-        zoom_x = img_width/orig_img_width
-    #    img = np.array(Image.fromarray(img).crop([425, 65, 801, 305]))
-        img = np.array(Image.fromarray(img).resize((img_width, img_height), resample = Image.ANTIALIAS))
-        return img, zoom_x, zoom_y, orig_img_width, orig_img_height
-    
-        ###Iterate through all specified KITTI sequences and extract raw data, and trajectories
-    for seq in sequences:    
+resolutions = {'low_res': {'height':128, 'width': 448}, 'med_res': {'height':192, 'width': 640}, 'high_res': {'height':256,'width':832}, 'full_res': {'height':None, 'width':None}}
+
+seq_names= {'00': '2011_10_03_drive_0027_sync',
+    '01': '2011_10_03_drive_0042_sync',
+    '02': '2011_10_03_drive_0034_sync',
+    '04': '2011_09_30_drive_0016_sync',
+    '05': '2011_09_30_drive_0018_sync',
+    '06': '2011_09_30_drive_0020_sync',
+    '07': '2011_09_30_drive_0027_sync',
+    '08': '2011_09_30_drive_0028_sync',
+    '09': '2011_09_30_drive_0033_sync',
+    '10': '2011_09_30_drive_0034_sync',
+    '11': '11',
+    '12': '12',
+    '13': '13',
+    '14': '14',
+    '15': '15',
+    '16': '16',
+    '17': '17',
+    '18': '18',
+    '19': '19',
+    '20': '20',
+    '21': '21',
+}
+
+sequences = ['00', '01', '02', '04', '05', '06', '07', '08', '09', '10', '11', '12', '13', '14', '15', '16', '17', '18', '19' , '20', '21']
+if args.sequences is not None:
+    sequences = args.sequences
+
+mono_orbslam_dir = 'orbslam-estimates/orbslam_mono_traj_odometry/'
+codec = frame_params(args.output_format, args.jpeg_quality, args.png_compression)
+
+    ### every source image is decoded once and resized from the largest to the smallest requested resolution
+written_resolutions = sorted(args.resolutions, key=lambda r: -(resolutions[r]['height'] or np.inf))
+if 'full_res' in written_resolutions and args.source_archive is not None:
+    written_resolutions.remove('full_res') ## no copies: the full_res .mat files list the archive members, which the loader reads (and rescales with --source_resolution full)
+for resolution in args.resolutions:
+    os.makedirs('{}/{}/'.format(args.target_dir, resolution), exist_ok=True)
+
+def source_relative(filename):
+    """Path of an image relative to --source_dir ('sequences/00/image_2/000000.png'), for files and archive members"""
+    if is_archive_path(filename):
+        return 'sequences/' + split_archive_path(filename)[1].split('sequences/')[1]
+    return filename.split(args.source_dir)[1]
+
+def target_filename(filename, seq, resolution):
+    target_dir = '{}/{}/'.format(args.target_dir, resolution)
+    return frame_filename(os.path.join(target_dir, source_relative(filename)).replace('sequences/','').replace('/'+seq+'/','/'+seq_names[seq]+'/'), args.output_format)
+
+def image_params(resolution):
+    """Preprocessing parameters of the frames of a resolution, recorded in the manifests (frames written with other
+    parameters are reprocessed)"""
+    return {'resolution': resolution, 'width': resolutions[resolution]['width'], 'height': resolutions[resolution]['height'], \
+        'resample': 'lanczos', 'resized_from': written_resolutions[0:written_resolutions.index(resolution)], **codec}
+
+def process_image(job):
+    """Decodes a source image once and writes it at each of the given resolutions (largest first, each resized from the
+    previous one).  Returns the (width, height) of the source image."""
+    img_file, targets = job
+    img = open_image(img_file)
+    orig_size = img.size
+    for resolution, filename in targets:
+        if resolutions[resolution]['height'] is not None:
+            img = img.resize((resolutions[resolution]['width'], resolutions[resolution]['height']), resample=Image.LANCZOS)
+        write_frame(filename, img, codec)
+    return orig_size
+
+    ###Iterate through all specified KITTI sequences and extract raw data, and trajectories
+with concurrent.futures.ProcessPoolExecutor() as executor:
+    for seq in sequences:
         data = pykitti.odometry(args.source_dir, seq)
+        if args.source_archive is not None:
+            data.cam2_files = glob_archives(args.source_archive, '*sequences/{}/image_2/*.png'.format(seq))
+            data.cam3_files = glob_archives(args.source_archive, '*sequences/{}/image_3/*.png'.format(seq))
+        print(seq, len(data.cam2_files))
+
             ###make the new directories
-        seq_dir = os.path.join(target_dir, seq_names[seq])
-        os.makedirs(seq_dir, exist_ok=True)
-        os.makedirs(os.path.join(seq_dir, 'image_2'), exist_ok=True)
-        os.makedirs(os.path.join(seq_dir, 'image_3'), exist_ok=True)
-     
-            ###store filenames of camera data, and intrinsic matrix
-        print(len(data.cam2_files))
-        seq_info['intrinsics_left'] = np.array(data.calib.K_cam2).reshape((-1,3,3)).repeat(len(data.cam2_files),0)
-        seq_info['intrinsics_right'] = np.array(data.calib.K_cam3).reshape((-1,3,3)).repeat(len(data.cam3_files),0)
-        i = 0
-        with concurrent.futures.ProcessPoolExecutor() as executor: 
-            for filename, output in zip(data.cam2_files, executor.map(load_image, data.cam2_files)):
-                img, zoomx, zoomy, orig_img_width, orig_img_height = output
-                new_filename = os.path.join(target_dir, filename.split(args.source_dir)[1]).replace('sequences/','').replace('/'+seq+'/','/'+seq_names[seq]+'/').replace('.png','.jpg')
-                imageio.imwrite(new_filename, img)
-                seq_info['intrinsics_left'][i,0] *= zoomx
-                seq_info['intrinsics_left'][i,1] *= zoomy
-                data.cam2_files[i] = np.array(new_filename)
-                i+=1
-            i = 0
-            for filename, output in zip(data.cam3_files, executor.map(load_image, data.cam3_files)):
-                img, zoomx, zoomy, orig_img_width, orig_img_height = output
-                new_filename = os.path.join(target_dir, filename.split(args.source_dir)[1]).replace('sequences/','').replace('/'+seq+'/','/'+seq_names[seq]+'/').replace('.png','.jpg')
-                imageio.imwrite(new_filename, img)
-                seq_info['intrinsics_right'][i,0] *= zoomx
-                seq_info['intrinsics_right'][i,1] *= zoomy
-                data.cam3_files[i] = np.array(new_filename)
-                i+=1
-    
-        seq_info['cam_02'] = np.array(data.cam2_files)
-        seq_info['cam_03'] = np.array(data.cam3_files)
-         
+        for resolution in args.resolutions:
+            seq_dir = os.path.join(args.target_dir, resolution, seq_names[seq])
+            os.makedirs(os.path.join(seq_dir, 'image_2'), exist_ok=True)
+            os.makedirs(os.path.join(seq_dir, 'image_3'), exist_ok=True)
+
+            ###decode every new or changed image once and write all resolutions (concurrently across images)
+        manifests = {r: Manifest(os.path.join(args.target_dir, r, seq_names[seq]), hash=args.verify_hash) for r in written_resolutions}
+        cam_files, orig_sizes = {}, {}
+        for cam, files in [('cam_02', list(data.cam2_files)), ('cam_03', list(data.cam3_files))]:
+            cam_files[cam] = {r: [target_filename(f, seq, r) if r in written_resolutions else f for f in files] for r in args.resolutions}
+            jobs = [(f, [(r, cam_files[cam][r][i]) for r in written_resolutions]) for i, f in enumerate(files)]
+            stale = [i for i, (f, targets) in enumerate(jobs) if not all(manifests[r].up_to_date(t, f, image_params(r)) for r, t in targets)]
+            print('{}: processing {} of {} images'.format(cam, len(stale), len(files)))
+            for i, orig_size in zip(stale, executor.map(process_image, [jobs[i] for i in stale], chunksize=8)):
+                for r, t in jobs[i][1]:
+                    manifests[r].record(t, jobs[i][0], image_params(r), source_size=orig_size)
+            orig_sizes[cam] = np.ones((len(files),2)) #only used to rescale the intrinsics of written resolutions
+            if len(written_resolutions) > 0:
+                r = written_resolutions[0]
+                orig_sizes[cam] = np.array([manifests[r][t]['source_size'] for t in cam_files[cam][r]], dtype=np.float64).reshape((-1,2))
+        for manifest in manifests.values():
+            manifest.save()
+
             ###Import libviso2 estimate for correcting
         mono_orbslam_data = sio.loadmat(mono_orbslam_dir+seq+'.mat')  #sparse VO
         mono_traj = mono_orbslam_data['poses_est'].transpose(2,0,1)
         keyframe_idx = mono_orbslam_data['keyframe_idx'].reshape((-1))
         keyframe_ts = mono_orbslam_data['keyframe_ts'].reshape((-1))
-        
-            ### store the ground truth pose
-        seq_info['sparse_gt_pose'] = mono_orbslam_data['poses_gt'].transpose(2,0,1)
-    
-        mono_seq_info = seq_info.copy()
-        # stereo_seq_info = seq_info.copy()
-        
-        ### store the VO pose estimates to extract 
-        mono_seq_info['sparse_vo'] = mono_traj
-        # stereo_seq_info['sparse_vo'] = stereo_traj
-        
-            ###Only keep keyframes
-                    
-        mono_seq_info['intrinsics_left'] = mono_seq_info['intrinsics_left'][keyframe_idx]
-        mono_seq_info['intrinsics_right'] = mono_seq_info['intrinsics_right'][keyframe_idx]
-        mono_seq_info['cam_02'] = mono_seq_info['cam_02'][keyframe_idx]
-        mono_seq_info['cam_03'] = mono_seq_info['cam_03'][keyframe_idx]
-        mono_seq_info['sparse_gt_pose'] = mono_seq_info['sparse_gt_pose']
-        mono_seq_info['sparse_vo'] = mono_seq_info['sparse_vo']
-        mono_seq_info['ts'] = keyframe_ts
-        
-        
-                    ###filter out frames with low rotational or translational velocities
-        for seq_info in [mono_seq_info]:
-            if args.remove_static:
-                print("Removing Static frames from {}".format(seq))            
-                deleting = True
-                
-                while deleting:
-                    idx_list = []
-                    sparse_traj = np.copy(seq_info['sparse_gt_pose']) ##using gt for now
-                    for i in range(0,sparse_traj.shape[0]-1,2):
-                        T2 = SE3.from_matrix(sparse_traj[i+1,:,:], normalize=True).inv()
-                        T1 = SE3.from_matrix(sparse_traj[i,:,:], normalize=True)
-                        dT = T2.dot(T1)
-                        pose_vec = dT.log()
-                        trans_norm = np.linalg.norm(pose_vec[0:3])
-                        rot_norm = np.linalg.norm(pose_vec[3:6])
-                        if trans_norm < 0.15 and rot_norm < 0.003: #0.007
-                            idx_list.append(i)
-#                            os.remove(seq_info['cam_02'][i]) # this deletes the actual image, which we don't want
-#                            os.remove(seq_info['cam_03'][i])
-                    if len(idx_list) == 0:
-                        deleting = False
-                    
-                    print('deleting {} frames'.format(len(idx_list)))
-                    print('original length: {}'.format(seq_info['cam_02'].shape))
-                    
-                    seq_info['intrinsics_left'] = np.delete(seq_info['intrinsics_left'],idx_list,axis=0)
-                    seq_info['intrinsics_right'] = np.delete(seq_info['intrinsics_right'],idx_list,axis=0)
-                    seq_info['cam_02'] = np.delete(seq_info['cam_02'],idx_list,axis=0)
-                    seq_info['cam_03'] = np.delete(seq_info['cam_03'],idx_list,axis=0)
-                    seq_info['sparse_gt_pose'] = np.delete(seq_info['sparse_gt_pose'],idx_list,axis=0)
-                    seq_info['sparse_vo'] = np.delete(seq_info['sparse_vo'],idx_list,axis=0)
-                    seq_info['ts'] = np.delete(seq_info['ts'],idx_list,axis=0)
-                    print('final length: {}'.format(seq_info['cam_02'].shape))
-                    
-        mono_seq_info = seq_info
-        sio.savemat(seq_dir + '/mono_data_orbslam.mat', mono_seq_info)
-        
-        
-        
+        sparse_gt_pose = mono_orbslam_data['poses_gt'].transpose(2,0,1) ### store the ground truth pose
+
+            ###filter out frames with low rotational or translational velocities (once per sequence, the same for every resolution)
+        keep = np.arange(0, keyframe_idx.shape[0])
+        if args.remove_static:
+            print("Removing Static frames from {}".format(seq))
+            keep = remove_static_frames(sparse_gt_pose, min_trans=0.15, min_rot=0.003) ##using gt for now
+            print('original length: {}, final length: {}'.format(keyframe_idx.shape[0], keep.shape[0]))
+
+            ###specialise the sequence info to each resolution: only the frame paths and the intrinsics differ
+        for resolution in args.resolutions:
+            height, width = resolutions[resolution]['height'], resolutions[resolution]['width']
+            seq_info = {}
+            for cam, K in [('left', data.calib.K_cam2), ('right', data.calib.K_cam3)]:
+                cam_key = 'cam_02' if cam == 'left' else 'cam_03'
+                intrinsics = np.array(K).reshape((-1,3,3)).repeat(orig_sizes[cam_key].shape[0],0)
+                if height is not None:
+                    intrinsics[:,0] *= (width/orig_sizes[cam_key][:,0]).reshape((-1,1))
+                    intrinsics[:,1] *= (height/orig_sizes[cam_key][:,1]).reshape((-1,1))
+                seq_info['intrinsics_{}'.format(cam)] = intrinsics[keyframe_idx][keep]
+                seq_info[cam_key] = np.array(cam_files[cam_key][resolution])[keyframe_idx][keep]
+            seq_info['sparse_gt_pose'] = sparse_gt_pose[keep]
+            seq_info['sparse_vo'] = mono_traj[keep]
+            seq_info['ts'] = keyframe_ts[keep]
+            seq_dir = os.path.join(args.target_dir, resolution, seq_names[seq])
+            sio.savemat(os.path.join(seq_dir, 'mono_data_orbslam.mat'), seq_info)
+            if args.pack_frames:
+                os.makedirs(os.path.join(seq_dir, 'frames'), exist_ok=True)
+                for cam_key in ['cam_02', 'cam_03']:
+                    pack_frames(list(seq_info[cam_key]), frame_store_filename(seq_dir, 'mono_data_orbslam', cam_key), executor)
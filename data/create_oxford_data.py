@@ -1,32 +1,48 @@
 import pykitti
 import numpy as np
 import scipy.io as sio
-import imageio
 import os
 import concurrent.futures
 from PIL import Image
 import argparse
-from liegroups import SE3
 from oxford.camera_model import CameraModel
 import glob
 import re
-from colour_demosaicing import demosaicing_CFA_Bayer_bilinear as demosaic
+import sys
+sys.path.insert(0,'..')
+from data.archive_reader import open_image, glob_archives, is_archive_path, split_archive_path
+from data.preprocess_manifest import Manifest
+from data.static_frames import remove_static_frames
+from data.oxford.image_remap import RemapTable, load_table, demosaic
+from data.frame_codec import output_formats, frame_params, frame_filename, write_frame, pack_frames
+from data.kitti_loader import frame_store_filename
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument("--source_dir", type=str, default='/media/HDD1/datasets/oxford-robotcar')
 parser.add_argument("--target_dir", type=str, default='/media/m2-drive/datasets/oxford-robotcar-downsized')
 parser.add_argument("--camera_type", type=str, default='stereo')
 parser.add_argument("--remove_static", action='store_true', default=True)
+parser.add_argument("--source_archives", nargs='+', type=str, default=None, help='read the images from the downloaded Robotcar tar archives instead of extracted files')
+parser.add_argument("--sequences", nargs='+', type=str, default=None, help='drives to process (default: all); runs on different drives can be started concurrently')
+parser.add_argument("--verify_hash", action='store_true', default=False, help='also record the sha1 of the source images, so that sources with a new mtime but the same content are not reprocessed')
+parser.add_argument("--output_format", type=str, default='jpg', choices=output_formats, help='format of the written frames (see frame_codec.py and compare_codecs.py)')
+parser.add_argument("--jpeg_quality", type=int, default=75)
+parser.add_argument("--png_compression", type=int, default=6, help='zlib level of png frames (0-9)')
+parser.add_argument("--pack_frames", action='store_true', default=False, help='also pack the frames of each sub-sequence into the arrays read with --frame_store')
 args = parser.parse_args()
 
 args.models_dir = '{}/camera_models'.format(args.source_dir)
 args.source_dir = '{}/data'.format(args.source_dir)
 
 sequences = ['2014-11-18-13-20-12', '2015-07-08-13-37-17', '2015-07-10-10-01-59', '2015-08-12-15-04-18']
+if args.sequences is not None:
+    sequences = args.sequences
 crop = [200,-165, 0, 1280] #top, bottom, left, right
+codec = frame_params(args.output_format, args.jpeg_quality, args.png_compression)
 resolutions = {'low_res': {'height':128, 'width': 448}, 'med_res': {'height':192, 'width': 640}, 'high_res': {'height':256,'width':832}}
 
 target_dir = args.target_dir
+executor = concurrent.futures.ProcessPoolExecutor() ## one pool for the whole run; tasks only carry file names
 for resolution in ['med_res']:
     args.height =  resolutions[resolution]['height']
     args.width =  resolutions[resolution]['width']
@@ -38,25 +54,20 @@ for resolution in ['med_res']:
         
     vo_dir = 'oxford/stereo_vo_traj/'
   
-    def load_image(img_file):
-        img_height = args.height 
-        img_width = args.width 
-        
-        img = Image.open(img_file)
-        img = demosaic(img, 'gbrg')
-        if 'left' in img_file:
-            img = args.left_model.undistort(img)
-        if 'right' in img_file:
-            img = args.right_model.undistort(img)
-        img = np.array(img).astype(np.uint8)
-        img = img[crop[0]:crop[1],crop[2]:crop[3]]
-
-        orig_img_height = img.shape[0]
-        orig_img_width = img.shape[1]
-        zoom_y = img_height/orig_img_height
-        zoom_x = img_width/orig_img_width
-        img = np.array(Image.fromarray(img).resize((img_width, img_height), resample = Image.ANTIALIAS))
-        return img, zoom_x, zoom_y, orig_img_width, orig_img_height
+    def process_image(job):
+        """Demosaics a raw image, undistorts, crops and resizes it with one remap (see oxford/image_remap.py), and writes
+        it in the --output_format.  Returns the zoom factors of the resize."""
+        img_file, table_file, new_filename = job
+        table = load_table(table_file) #memory-mapped once per worker
+        img = table(demosaic(np.asarray(open_image(img_file)), 'gbrg'))
+        write_frame(new_filename, img, codec)
+        return table.zoom_x, table.zoom_y
+
+    def target_filename(filename):
+        """Path of an image (a file, or a member of an archive) below --target_dir"""
+        if is_archive_path(filename):
+            return os.path.join(args.target_dir, split_archive_path(filename)[1])
+        return filename.replace(args.source_dir, args.target_dir)
     
         ###Iterate through all specified KITTI sequences and extract raw data, and trajectories
     for seq in sequences:    
@@ -71,13 +82,28 @@ for resolution in ['med_res']:
         seq_info = {}
         seq_info['cam_02'] = []
         seq_info['cam_03'] = []
-        for img_name in sorted(glob.glob('{}/left/**'.format(source_seq_dir))):
-            seq_info['cam_02'].append(img_name)
-        for img_name in sorted(glob.glob('{}/right/**'.format(source_seq_dir))):
-            seq_info['cam_03'].append(img_name)            
+        if args.source_archives is not None:
+            seq_info['cam_02'] = glob_archives(args.source_archives, '{}/{}/left/*'.format(seq, args.camera_type))
+            seq_info['cam_03'] = glob_archives(args.source_archives, '{}/{}/right/*'.format(seq, args.camera_type))
+        else:
+            for img_name in sorted(glob.glob('{}/left/**'.format(source_seq_dir))):
+                seq_info['cam_02'].append(img_name)
+            for img_name in sorted(glob.glob('{}/right/**'.format(source_seq_dir))):
+                seq_info['cam_03'].append(img_name)            
         seq_info['cam_02'] = np.array(seq_info['cam_02'])
         seq_info['cam_03'] = np.array(seq_info['cam_03'])
 
+            ###per-camera undistort + crop + resize tables, built once and shared (memory-mapped) by the workers
+            ###(kept outside the resolution directories, whose subdirectories the loader reads as sequences)
+        raw_shape = np.asarray(open_image(seq_info['cam_02'][0])).shape[0:2]
+        table_files = {}
+        for cam, model in [('cam_02', args.left_model), ('cam_03', args.right_model)]:
+            table_files[cam] = os.path.join(target_dir, 'remap_tables', '{}_{}_{}x{}_crop_{}_{}x{}'.format(model.camera, model.camera_sensor, \
+                raw_shape[1], raw_shape[0], '_'.join(str(c) for c in crop), args.width, args.height))
+            if not RemapTable.exists(table_files[cam]):
+                os.makedirs(os.path.dirname(table_files[cam]), exist_ok=True)
+                RemapTable(model, raw_shape, crop, (args.width, args.height)).save(table_files[cam])
+
 
         for cam, model, num_imgs in zip(['left', 'right'], [args.left_model, args.right_model], [len(seq_info['cam_02']), len(seq_info['cam_03'])]):
             K = np.zeros((3,3))
@@ -109,7 +135,10 @@ for resolution in ['med_res']:
         seq_info['ts'] = keyframe_ts 
         seq_info['keyframe_seq_idx'] = keyframe_seq_idx  
 
+            ###sub-sequences are index ranges of the keyframes
+        bounds = np.concatenate(([0], seq_changes, [keyframe_ts.shape[0]]))
         for m in range(0,len(seq_changes)):
+            start, end = bounds[m], bounds[m+1]
             sub_seq = '{}_{}'.format(seq, m)
             print(seq, sub_seq)
             target_seq_dir = '{}/{}'.format(target_dir_res, sub_seq)
@@ -117,74 +146,44 @@ for resolution in ['med_res']:
             os.makedirs(os.path.join(target_seq_dir, args.camera_type, 'left'), exist_ok=True)
             os.makedirs(os.path.join(target_seq_dir, args.camera_type, 'right'), exist_ok=True)
             
+                ###filter out frames with low rotational or translational velocities (before preprocessing, so removed frames are never loaded)
+            keep = np.arange(start, end)
+            if args.remove_static:
+                print("Removing Static frames from {}".format(sub_seq))
+                keep = start + remove_static_frames(seq_info['sparse_gt_pose'][start:end], min_trans=0.05, min_rot=0.003) ##using gt for now
+                print('original length: {}, final length: {}'.format(end-start, keep.shape[0]))
+
             sub_seq_info = {}
             for name in ['intrinsics_left', 'intrinsics_right', 'cam_02', 'cam_03', 'sparse_gt_pose', 'sparse_vo', 'ts']:
-                sub_seq_info[name] = np.copy(np.split(seq_info[name],seq_changes)[m])
-            
-
-            ## Load images, preprocess (colour demosaicing, etc.) and place them in new location
-            i = 0
-            cam_02 = list(sub_seq_info['cam_02'])
-            cam_03 = list(sub_seq_info['cam_03'])
-            
-            sub_seq_info['cam_02'] = []
-            sub_seq_info['cam_03'] = []
-            with concurrent.futures.ProcessPoolExecutor() as executor: 
-                for filename, output in zip(cam_02, executor.map(load_image, cam_02)):
-                    img, zoomx, zoomy, orig_img_width, orig_img_height = output
-                    new_filename = np.copy(filename.replace(args.source_dir, args.target_dir).replace(seq,'{}/{}'.format(resolution,sub_seq)).replace('png','jpg'))
-                    imageio.imwrite(str(new_filename), img)
-                    
-                    sub_seq_info['intrinsics_left'][i,0] *= zoomx
-                    sub_seq_info['intrinsics_left'][i,1] *= zoomy
-                    new_filename = np.array(new_filename)
-                    sub_seq_info['cam_02'].append(new_filename)
-
-                    i+=1
-                i = 0
-                for filename, output in zip(cam_03, executor.map(load_image, cam_03)):
-                    img, zoomx, zoomy, orig_img_width, orig_img_height = output
-                    new_filename = filename.replace(args.source_dir, args.target_dir).replace(seq,'{}/{}'.format(resolution,sub_seq)).replace('png','jpg')
-                    imageio.imwrite(str(new_filename), img)
-                    sub_seq_info['intrinsics_right'][i,0] *= zoomx
-                    sub_seq_info['intrinsics_right'][i,1] *= zoomy
-                    new_filename = np.array(new_filename)
-                    sub_seq_info['cam_03'].append(new_filename)
-                    i+=1
-
-            sub_seq_info['cam_02'] = np.array(sub_seq_info['cam_02']).reshape((-1))
-            sub_seq_info['cam_03'] = np.array(sub_seq_info['cam_03']).reshape((-1))
-
-                        ###filter out frames with low rotational or translational velocities
-            if args.remove_static:
-                print("Removing Static frames from {}".format(sub_seq))            
-                deleting = True
-                
-                while deleting:
-                    idx_list = []
-                    sparse_traj = np.copy(sub_seq_info['sparse_gt_pose']) ##using gt for now
-                    for i in range(0,sparse_traj.shape[0]-1,2):
-                        T2 = SE3.from_matrix(sparse_traj[i+1,:,:], normalize=True).inv()
-                        T1 = SE3.from_matrix(sparse_traj[i,:,:], normalize=True)
-                        dT = T2.dot(T1)
-                        pose_vec = dT.log()
-                        trans_norm = np.linalg.norm(pose_vec[0:3])
-                        rot_norm = np.linalg.norm(pose_vec[3:6])
-                        if trans_norm < 0.05 and rot_norm < 0.003: #0.007
-                            idx_list.append(i)
-
-                    if len(idx_list) == 0:
-                        deleting = False
-                    
-                    print('deleting {} frames'.format(len(idx_list)))
-                    print('original length: {}'.format(sub_seq_info['cam_02'].shape))
-                    
-                    for name in ['intrinsics_left', 'intrinsics_right', 'cam_02', 'cam_03', 'sparse_gt_pose', 'sparse_vo', 'ts']:
-                        sub_seq_info[name] = np.delete(sub_seq_info[name],idx_list,axis=0)
-                    print('final length: {}'.format(sub_seq_info['cam_02'].shape))
+                sub_seq_info[name] = seq_info[name][keep]
+
+            ## Load new or changed images, preprocess (colour demosaicing, etc.) and place them in new location
+            manifest = Manifest(target_seq_dir, hash=args.verify_hash)
+            params = {'resolution': resolution, 'width': args.width, 'height': args.height, 'crop': crop, 'demosaic': 'gbrg', \
+                'camera_type': args.camera_type, 'resample': 'remap_area', **codec}
+            for cam, K_name in [('cam_02', 'intrinsics_left'), ('cam_03', 'intrinsics_right')]:
+                filenames = list(sub_seq_info[cam])
+                new_filenames = [target_filename(f).replace(seq,'{}/{}'.format(resolution,sub_seq)) for f in filenames]
+                new_filenames = [frame_filename(f, args.output_format) for f in new_filenames]
+                stale = [i for i in range(0,len(filenames)) if not manifest.up_to_date(new_filenames[i], filenames[i], params)]
+                print('{}: processing {} of {} images'.format(cam, len(stale), len(filenames)))
+                jobs = [(filenames[i], table_files[cam], new_filenames[i]) for i in stale]
+                for i, (zoomx, zoomy) in zip(stale, executor.map(process_image, jobs, chunksize=8)):
+                    manifest.record(new_filenames[i], filenames[i], params, zoom=[zoomx, zoomy])
+
+                for i in range(0,len(filenames)):
+                    zoomx, zoomy = manifest[new_filenames[i]]['zoom']
+                    sub_seq_info[K_name][i,0] *= zoomx
+                    sub_seq_info[K_name][i,1] *= zoomy
+                sub_seq_info[cam] = np.array(new_filenames).reshape((-1))
+            manifest.save()
 
             sio.savemat(target_seq_dir + '/mono_data_stereo.mat'.format(sub_seq), sub_seq_info)
+            if args.pack_frames:
+                os.makedirs(os.path.join(target_seq_dir, 'frames'), exist_ok=True)
+                for cam in ['cam_02', 'cam_03']:
+                    pack_frames(list(sub_seq_info[cam]), frame_store_filename(target_seq_dir, 'mono_data_stereo', cam), executor)
 
         
         
-
+executor.shutdown()
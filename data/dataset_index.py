@@ -0,0 +1,110 @@
+import os
+import json
+import numpy as np
+
+'''
+Single-file index of the preprocessed sequences of a dataset directory (written by data/create_dataset_index.py).
+
+The file is a short json header followed by the raw arrays of every sequence (poses, vo, timestamps, intrinsics and the
+frame paths of both cameras), so opening it only parses the header and memory-maps the rest.  Every dataset split of a
+process shares the same mapping.
+'''
+
+INDEX_MAGIC = b'KITTIIDX'
+ALIGNMENT = 64
+
+dataset_indexes = {} #opened once per process
+
+def dataset_index_filename(data_dir, mat_name):
+    return os.path.join(data_dir, '{}_index.bin'.format(mat_name))
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+class PathTable(object):
+    """Paths stored once as a single utf-8 byte buffer plus int64 offsets.  Unlike arrays or lists of strings, reading a path
+    touches no per-path python objects, so the pages stay shared with forked DataLoader workers."""
+    def __init__(self, buffer=None, offsets=None):
+        self.buffer = np.zeros(0, dtype=np.uint8) if buffer is None else buffer
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i+1]].tobytes().decode()
+
+    def extend(self, paths):
+        """Appends paths (strings, or another PathTable) and returns their ids"""
+        if isinstance(paths, PathTable):
+            buffer, lengths = paths.buffer[paths.offsets[0]:paths.offsets[-1]], np.diff(paths.offsets)
+        else:
+            encoded = [str(p).strip().encode() for p in paths]
+            buffer, lengths = np.frombuffer(b''.join(encoded), dtype=np.uint8), np.array([len(e) for e in encoded], dtype=np.int64)
+        first = len(self)
+        self.buffer = np.concatenate((self.buffer, buffer))
+        self.offsets = np.concatenate((self.offsets, self.offsets[-1] + np.cumsum(lengths, dtype=np.int64)))
+        return np.arange(first, len(self), dtype=np.int64)
+
+def write_dataset_index(filename, sequences):
+    """Writes {sequence name: {key: array}} (the contents of each sequence's .mat file, with the cam_02/cam_03 path
+    lists given as PathTables) to a single index file"""
+    header, arrays, offset = {}, [], 0
+    for name, data in sequences.items():
+        header[name] = {}
+        for key, a in data.items():
+            if isinstance(a, PathTable):
+                entries = [(key+'_buffer', a.buffer), (key+'_offsets', a.offsets)]
+            else:
+                entries = [(key, a)]
+            for k, v in entries:
+                v = np.ascontiguousarray(v)
+                offset = aligned(offset)
+                header[name][k] = [v.dtype.str, list(v.shape), offset]
+                arrays.append((offset, v))
+                offset += v.nbytes
+
+    header = json.dumps(header).encode()
+    data_start = aligned(len(INDEX_MAGIC) + 8 + len(header))
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for offset, a in arrays:
+            f.seek(data_start + offset)
+            f.write(a.tobytes())
+    os.replace(filename + '.tmp', filename)
+
+class DatasetIndex(object):
+    """Read-only, memory-mapped view of an index file"""
+    def __init__(self, filename):
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        with open(filename, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError('{} is not a dataset index'.format(filename))
+            header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(f.read(header_len).decode())
+        self.data_start = aligned(len(INDEX_MAGIC) + 8 + header_len)
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    def __contains__(self, name):
+        return name in self.header
+
+    def sequence(self, name):
+        """Arrays of a sequence, under the same keys as its .mat file (cam_02 and cam_03 are PathTables)"""
+        data = {}
+        for key, (dtype, shape, offset) in self.header[name].items():
+            dtype = np.dtype(dtype)
+            start = self.data_start + offset
+            data[key] = self.data[start:start + dtype.itemsize*int(np.prod(shape))].view(dtype).reshape(shape)
+        for cam in ['cam_02', 'cam_03']:
+            data[cam] = PathTable(data.pop(cam+'_buffer'), data.pop(cam+'_offsets'))
+        return data
+
+def load_dataset_index(data_dir, mat_name):
+    """The index of a data directory, or None if it has not been built"""
+    filename = dataset_index_filename(data_dir, mat_name)
+    if filename not in dataset_indexes:
+        dataset_indexes[filename] = DatasetIndex(filename) if os.path.exists(filename) else None
+    return dataset_indexes[filename]
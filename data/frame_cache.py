@@ -0,0 +1,79 @@
+import zlib
+import multiprocessing
+import numpy as np
+import torch
+
+class SharedFrameCache(object):
+    """Bounded LRU cache of decoded frames that is shared by all DataLoader workers of every dataset it is attached to.
+
+    Frames are stored in fixed-size slots of a shared-memory uint8 tensor (allocated before the workers are started),
+    and the slot keys, last-use clocks and hit/miss counters live in shared tensors as well.  The cache is set-associative:
+    a key hashes directly to one set of `ways` slots, so a lookup only compares the keys of that set, and once the set is
+    full its least recently used frame is evicted.  Each set is guarded by one of `num_locks` striped locks, so workers
+    only wait for each other when they touch sets of the same stripe.
+    Frames are keyed by (sequence directory, .mat frame index, camera), so windows of the train, val and test
+    datasets (and of augmented trials) that contain the same frame share one entry.
+    """
+    def __init__(self, max_bytes, frame_shape, ways=8, num_locks=64):
+        self.frame_shape = tuple(frame_shape)
+        self.frame_bytes = int(np.prod(self.frame_shape))
+        max_slots = max(int(max_bytes // self.frame_bytes), 1)
+        self.ways = min(ways, max_slots)
+        self.num_sets = max_slots // self.ways
+        self.num_slots = self.num_sets*self.ways
+        self.frames = torch.zeros((self.num_slots,) + self.frame_shape, dtype=torch.uint8).share_memory_()
+        self.keys = torch.full((self.num_sets, self.ways), -1, dtype=torch.int64).share_memory_()
+        self.last_used = torch.zeros((self.num_sets, self.ways), dtype=torch.int64).share_memory_()
+        self.counters = torch.zeros((self.num_sets, 3), dtype=torch.int64).share_memory_() #clock, hits, misses of each set
+        self.locks = [multiprocessing.Lock() for _ in range(0, min(num_locks, self.num_sets))]
+        print('frame cache: {} frames of {} ({:.2f} GB)'.format(self.num_slots, self.frame_shape, self.num_slots*self.frame_bytes/2.**30))
+
+    def key(self, seq_dir, frame, cam):
+        """Key that is identical in every process (no registration needed after the workers fork)"""
+        seq_hash = zlib.crc32(seq_dir.encode()) & 0x7fffffff
+        return (seq_hash << 32) | (int(cam == 'cam_03') << 31) | int(frame)
+
+    def set_of(self, key):
+        """Set of a key (Fibonacci hashing, so consecutive frames spread over the sets)"""
+        return (((key*0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) % self.num_sets
+
+    def get(self, key):
+        """Returns a copy of the cached frame, or None on a miss"""
+        s = self.set_of(key)
+        with self.locks[s % len(self.locks)]:
+            counters = self.counters.numpy()[s]
+            counters[0] += 1
+            way = np.flatnonzero(self.keys.numpy()[s] == key)
+            if way.shape[0] == 0:
+                counters[2] += 1
+                return None
+            counters[1] += 1
+            self.last_used.numpy()[s, way[0]] = counters[0]
+            return np.copy(self.frames.numpy()[s*self.ways + way[0]])
+
+    def put(self, key, img):
+        """Stores a decoded frame, evicting the least recently used one of its set (frames of another shape are not cached)"""
+        if img.shape != self.frame_shape or img.dtype != np.uint8:
+            return
+        s = self.set_of(key)
+        with self.locks[s % len(self.locks)]:
+            keys = self.keys.numpy()[s]
+            if (keys == key).any(): #another worker decoded it first
+                return
+            counters = self.counters.numpy()[s]
+            counters[0] += 1
+            last_used = self.last_used.numpy()[s]
+            way = np.argmin(last_used) #empty slots were never used
+            self.frames.numpy()[s*self.ways + way] = img
+            keys[way] = key
+            last_used[way] = counters[0]
+
+    def stats(self):
+        """Hit/miss counts and occupancy (read without locking, so only approximate while workers are running)"""
+        hits, misses = int(self.counters[:,1].sum()), int(self.counters[:,2].sum())
+        cached = int((self.keys >= 0).sum())
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits/float(max(hits+misses, 1)),
+                'cached_frames': cached, 'capacity_frames': self.num_slots, 'cached_gb': cached*self.frame_bytes/2.**30}
+
+    def reset_stats(self):
+        self.counters[:,1:] = 0
@@ -0,0 +1,82 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+from data.archive_reader import open_image, read_file, is_archive_path
+
+'''
+Storage formats of the preprocessed frames written by the create_* scripts (--output_format):
+
+    jpg: lossy, smallest files, but every read pays a jpeg decode (--jpeg_quality, 75 as imageio's default)
+    png: lossless, larger files, slower to decode than jpg (--png_compression 0-9, 0 is uncompressed)
+    npy: raw uint8 (H,W,3) arrays, the largest files but no decoding
+
+Independently of the per-frame format, --pack_frames also packs each sequence into the per-camera arrays read with
+--frame_store (see create_frame_store.py).  compare_codecs.py reports the bytes per frame and decode throughput of each
+format on a preprocessed sequence.
+'''
+
+output_formats = ['jpg', 'png', 'npy']
+
+def frame_params(output_format, jpeg_quality=75, png_compression=6):
+    """Codec parameters of a format, recorded in the preprocessing manifests (frames written with other parameters are
+    reprocessed)"""
+    params = {'format': output_format}
+    if output_format == 'jpg':
+        params['jpeg_quality'] = jpeg_quality
+    elif output_format == 'png':
+        params['png_compression'] = png_compression
+    elif output_format != 'npy':
+        raise ValueError('unknown output format {} (one of {})'.format(output_format, output_formats))
+    return params
+
+def frame_filename(filename, output_format):
+    """filename with the extension of the format"""
+    return os.path.splitext(filename)[0] + '.' + output_format
+
+def write_frame(filename, img, params):
+    """Writes a PIL image or an (H,W,3) uint8 array with the codec parameters of frame_params()"""
+    if params['format'] == 'npy':
+        np.save(filename, np.asarray(img, dtype=np.uint8))
+        return
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    if params['format'] == 'jpg':
+        img.save(filename, 'JPEG', quality=params['jpeg_quality'])
+    else:
+        img.save(filename, 'PNG', compress_level=params['png_compression'])
+
+def open_frame(path):
+    """A frame of a file or an archive member: the (H,W,3) uint8 array of a .npy file, otherwise the PIL image (opened
+    lazily, like open_image)"""
+    if not str(path).endswith('.npy'):
+        return open_image(path)
+    if is_archive_path(path):
+        return np.load(io.BytesIO(read_file(path)))
+    return np.load(path)
+
+def frame_size(path):
+    """(width, height) of a frame, reading only its header"""
+    if not str(path).endswith('.npy'):
+        return open_image(path).size
+    if is_archive_path(path):
+        shape = np.load(io.BytesIO(read_file(path))).shape
+    else:
+        shape = np.load(path, mmap_mode='r').shape
+    return (shape[1], shape[0])
+
+def load_frame(path):
+    """Decoded (H,W,3) uint8 array of a frame in any of the formats"""
+    img = open_frame(path)
+    if isinstance(img, np.ndarray):
+        return img
+    return np.array(img.convert('RGB'))
+
+def pack_frames(filenames, filename, executor):
+    """Decodes frames (concurrently, with a process pool) into one uint8 (N,H,W,3) .npy array at filename"""
+    h, w, _ = load_frame(filenames[0]).shape
+    frames = np.lib.format.open_memmap(filename, mode='w+', dtype=np.uint8, shape=(len(filenames), h, w, 3))
+    for i, img in enumerate(executor.map(load_frame, filenames, chunksize=32)):
+        frames[i] = img
+    frames.flush()
+    del frames
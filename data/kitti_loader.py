@@ -5,10 +5,72 @@ import torch
 import torch.utils.data
 from PIL import Image
 import scipy.io as sio
-from liegroups import SE3, SO3
+from utils.lie_algebra_np import se3_normalize, se3_inv, se3_log, se3_exp
+from data.dataset_index import PathTable, load_dataset_index
+from data.archive_reader import set_cache_size
+from data.frame_codec import open_frame, frame_size
 import os
 import glob
 
+img_resolutions = {'low': (128,448), 'med': (192,640), 'high': (256,832)} #(height, width) of the copies written by create_kitti_odometry_data.py
+
+def farneback_flow(img_1, img_2):
+    """Dense Farneback optical flow from grayscale img_1 to img_2, as a (2,H,W) float32 array"""
+    flow = cv2.calcOpticalFlowFarneback(img_1, img_2, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+    return np.transpose(flow, (2,0,1))
+
+def flow_cache_filename(seq_dir, mat_name, offset):
+    """Cache of the flow from every frame f of a .mat file to frame f+offset (written by create_flow_cache.py)"""
+    return os.path.join(seq_dir, 'flow', '{}_{:+d}.npy'.format(mat_name, offset))
+
+def frame_store_filename(seq_dir, mat_name, cam):
+    """Packed uint8 (N,H,W,3) frames of one camera ('cam_02' or 'cam_03') of a .mat file (written by create_frame_store.py)"""
+    return os.path.join(seq_dir, 'frames', '{}_{}.npy'.format(mat_name, cam))
+
+def to_gray(img):
+    """Grayscale uint8 array of a PIL image or an (H,W,3) uint8 array (PIL luma conversion in both cases)"""
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    return np.array(img.convert('L'))
+
+def resize_frame(img, size):
+    """Resizes a PIL image or an (H,W,3) uint8 array to size=(height, width).  Jpgs that are opened but not yet decoded
+    are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that is still at least as large as the requested size."""
+    h, w = size
+    if isinstance(img, np.ndarray):
+        if img.shape[0:2] == (h, w):
+            return img
+        return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+    if img.size == (w, h):
+        return img
+    img.draft('RGB', (w, h)) #no-op for other formats, or once the image is loaded
+    return img.convert('RGB').resize((w, h), resample=Image.LANCZOS)
+
+def resize_flow(flow, size):
+    """Resizes a (2,H,W) flow field to size=(height, width), scaling the displacements with it"""
+    h, w = size
+    if flow.shape[1:3] == (h, w):
+        return flow
+    scale = np.array([w/flow.shape[2], h/flow.shape[1]], dtype=np.float32)
+    flow = cv2.resize(np.transpose(flow, (1,2,0)).astype(np.float32), (w, h), interpolation=cv2.INTER_AREA)*scale
+    return np.transpose(flow, (2,0,1))
+
+def collate_samples(samples):
+    """DataLoader collate_fn for KittiLoaderPytorch samples.  Every entry becomes one contiguous tensor (allocated in shared
+    memory inside workers, like the default collate): images [B,S,C,H,W] with the target image first and then the sources,
+    flow [B,S-1,2,H,W], intrinsics [B,3,3], and pose targets [B,S-1,6] ([B,S-1,1] for dt)."""
+    batch_size = len(samples)
+    def stack(entries):
+        if isinstance(entries[0], list): #per-slot tensors
+            slots = [t for e in entries for t in e]
+            return torch.utils.data.default_collate(slots).view((batch_size, len(entries[0])) + tuple(slots[0].shape))
+        return torch.utils.data.default_collate(entries)
+    return {field: {k: stack([s[field][k] for s in samples]) for k in samples[0][field]} for field in samples[0]}
+
+def batch_to_device(batch, device):
+    """Moves a collated batch to the device (asynchronously when the loader uses pinned memory)"""
+    return {field: {k: v.to(device, non_blocking=True) for k, v in entries.items()} for field, entries in batch.items()}
+
 class KittiLoaderPytorch(torch.utils.data.Dataset):
     """Loads the KITTI Odometry Benchmark Dataset"""
     def __init__(self, config, seq, mode='train', transform_img=None, augment=False, skip=None, stereo_imgs=False):
@@ -54,21 +116,38 @@ class KittiLoaderPytorch(torch.utils.data.Dataset):
         self.skip = skip
         self.stereo_imgs = stereo_imgs
         self.load_stereo = config['load_stereo']
+        self.stereo_views = sorted(set(config.get('stereo_views', range(0,self.seq_len)))) if self.load_stereo else [] #window positions of the right images to load
+        self.mode = mode
+        self.batch_augment = config.get('batch_augment', False) #emit uint8 images and float16 flow, augmented on the device (utils.custom_transforms.BatchAugment)
+        self.img_size = config.get('img_size', None) #(height, width) the stored frames are rescaled to on load (None: as stored)
 
             ###Iterate through all specified KITTI sequences and extract raw data, and trajectories
-        self.left_cam_filenames = []
-        self.right_cam_filenames = []
+        self.left_cam_filenames = PathTable()
+        self.right_cam_filenames = PathTable()
+        self.trial_frame_ids = [] #PathTable id of every frame of each trial
         self.raw_intrinsic_trials_left = []
         self.raw_intrinsic_trials_right = []
         self.raw_gt_trials = []
         self.raw_vo_traj = []
         self.raw_ts = []
+        self.trial_dirs = [] #sequence directory of each trial
+        self.trial_strides = [] #.mat frames between consecutive trial frames
+        self.trial_img_sizes = [] #(width, height) of the stored frames of each trial
+        self.mat_name = '{}_data_{}'.format(config['estimator_type'], config['estimator'])
+        self.flow_cache = {}
+        self.frame_store = config.get('frame_store', False) #read frames from packed per-sequence arrays instead of decoding jpgs
+        self.frame_stores = {}
+        self.frame_cache = None #optional SharedFrameCache (data/frame_cache.py) of decoded frames, attached after construction
+        if config.get('archive_cache_mb', 0) > 0: #frame paths can be zip/tar members (data/archive_reader.py)
+            set_cache_size(config['archive_cache_mb'])
         train_seq, val_seq, test_seq = seq
         if train_seq == ['all'] and mode == 'train':
             seq = []
             seq_name={}
             
             for d in glob.glob('{}/**'.format(basedir), recursive=False):
+                if not os.path.isdir(d): #e.g. the dataset index
+                    continue
                 name = d.replace(basedir, '').replace('/','')
                 i=0
                 for s in val_seq:
@@ -94,262 +173,278 @@ class KittiLoaderPytorch(torch.utils.data.Dataset):
             seq_name = seq_names
             seq = test_seq
 
-        for s,i in zip(seq,range(0,len(seq))):
-            data = sio.loadmat(os.path.join(basedir, seq_name[s],'{}_data_{}.mat'.format(config['estimator_type'], config['estimator'])))
-            
-            self.left_cam_filenames.append(np.copy(data['cam_02'].reshape((-1,1))))
-            self.right_cam_filenames.append(np.copy(data['cam_03'].reshape((-1,1))))
-            self.raw_intrinsic_trials_left.append(np.copy(data['intrinsics_left']))
-            self.raw_intrinsic_trials_right.append(np.copy(data['intrinsics_right']))
-            self.raw_gt_trials.append(np.copy(data['sparse_gt_pose']))
-            self.raw_vo_traj.append(np.copy(data['sparse_vo']))
-            self.raw_ts.append(np.copy(data['ts'].reshape((-1))))
-            
+        index = load_dataset_index(basedir, self.mat_name) #written by data/create_dataset_index.py (None if it has not been built)
 
-            if self.config['correction_rate'] != 1:
-                cr = self.config['correction_rate']
-                self.left_cam_filenames[i] = np.copy(self.left_cam_filenames[i][::cr])
-                self.right_cam_filenames[i] = np.copy(self.right_cam_filenames[i][::cr])
-                self.raw_intrinsic_trials_left[i] = np.copy(self.raw_intrinsic_trials_left[i][::cr])
-                self.raw_intrinsic_trials_right[i] = np.copy(self.raw_intrinsic_trials_right[i][::cr])
-                self.raw_gt_trials[i] = np.copy(self.raw_gt_trials[i][::cr])
-                self.raw_vo_traj[i] = np.copy(self.raw_vo_traj[i][::cr])
-                self.raw_ts[i] = np.copy(self.raw_ts[i][::cr])
-            else:
-                cr=1
+            ### correction_rate and num_frames are applied as a single strided slice, so every raw trial is a view of the sequence data
+        cr = self.config['correction_rate']
+        frames = slice(0, None if not self.num_frames else cr*self.num_frames, cr)
+        for s in seq:
+            data = self.load_sequence(index, basedir, seq_name[s])
+            self.trial_dirs.append(os.path.join(basedir, seq_name[s]))
+            self.trial_strides.append(cr)
             
-            if self.num_frames:
-                self.left_cam_filenames[i] = np.copy(self.left_cam_filenames[i][:self.num_frames])
-                self.right_cam_filenames[i] = np.copy(self.right_cam_filenames[i][:self.num_frames])
-                self.raw_intrinsic_trials_left[i] = np.copy(self.raw_intrinsic_trials_left[i][:self.num_frames])
-                self.raw_intrinsic_trials_right[i] = np.copy(self.raw_intrinsic_trials_right[i][:self.num_frames])
-                self.raw_gt_trials[i] = np.copy(self.raw_gt_trials[i][:self.num_frames])
-                self.raw_vo_traj[i] = np.copy(self.raw_vo_traj[i][:self.num_frames])  
-                self.raw_ts[i] = np.copy(self.raw_ts[i][:self.num_frames])      
+            frame_ids = self.left_cam_filenames.extend(data['cam_02'])
+            self.right_cam_filenames.extend(data['cam_03'])
+            self.trial_frame_ids.append(frame_ids[frames])
+            self.trial_img_sizes.append(frame_size(self.left_cam_filenames[frame_ids[0]])) #reads the header only
+            self.raw_intrinsic_trials_left.append(data['intrinsics_left'][frames])
+            self.raw_intrinsic_trials_right.append(data['intrinsics_right'][frames])
+            self.raw_gt_trials.append(data['sparse_gt_pose'][frames])
+            self.raw_vo_traj.append(data['sparse_vo'][frames])
+            self.raw_ts.append(data['ts'].reshape((-1))[frames])
 
-            
-            #also add a trial that skips every other frame, for augmented data that simulates faster motion.
+            ### motion augmentation: windows are drawn with a random frame stride (in trial frames) from the same index
+        self.frame_strides, self.frame_stride_weights = [1], None
         if self.augment == True:
-            for skip_idx in range(1,2):
-                for s, i in zip(seq, range(0,len(seq))):
-                    data = sio.loadmat(os.path.join(basedir, seq_name[s],'{}_data_{}.mat'.format(config['estimator_type'], config['estimator'])))
-                    self.left_cam_filenames.append(np.copy(data['cam_02'].reshape((-1,1)))[::(cr+skip_idx)])
-                    self.right_cam_filenames.append(np.copy(data['cam_03'].reshape((-1,1)))[::(cr+skip_idx)])
-                    self.raw_intrinsic_trials_left.append(np.copy(data['intrinsics_left'])[::(cr+skip_idx)])
-                    self.raw_intrinsic_trials_right.append(np.copy(data['intrinsics_right'])[::(cr+skip_idx)])
-                    self.raw_gt_trials.append(np.copy(data['sparse_gt_pose'])[::(cr+skip_idx)])
-                    self.raw_vo_traj.append(np.copy(data['sparse_vo'])[::(cr+skip_idx)])
-                    self.raw_ts.append(np.copy(data['ts'])[::(cr+skip_idx)])
-         
+            self.frame_strides = config.get('frame_strides', [1,2])
+            weights = config.get('frame_stride_weights') or [1]*len(self.frame_strides)
+            self.frame_stride_weights = np.array(weights, dtype=np.float64)/np.sum(weights)
 
 ###         Merge data from all trials   
-        self.gt_samples, self.left_img_samples, self.right_img_samples, self.intrinsic_samples_left, self.intrinsic_samples_right, \
-            self.vo_samples, self.ts_samples = self.reshape_data()
+        self.sample_index = self.reshape_data()
 
         if self.skip:
             skip = self.config['skip']
-            self.gt_samples, self.left_img_samples, self.intrinsic_samples_left, self.intrinsic_samples_right = self.gt_samples[::skip], self.left_img_samples[::skip], self.intrinsic_samples_left[::skip], self.intrinsic_samples_right[::skip]
-            self.vo_samples = self.vo_samples[::skip]
-            self.right_img_samples = self.right_img_samples[::skip]
-            self.ts_samples = self.ts_samples[::skip]
+            self.sample_index = self.sample_index[::skip]
+
+        self.target_idx = int(self.seq_len/2)
+        self.source_idx = [i for i in range(0,self.seq_len) if i != self.target_idx]
+        self.gt_lie_alg, self.vo_lie_alg, self.gt_correction, self.dt = self.compute_targets()
         
-        print('length',len(self.gt_samples))
+        print('length',len(self.sample_index))
 
 
     def __len__(self):
-        return int(self.gt_samples.shape[0])
+        return int(self.sample_index.shape[0])
 
     def __getitem__(self, idx):
+        trial, start = self.sample_index[idx]
+        stride = 1
+        if self.frame_stride_weights is not None: #motion augmentation
+            stride = np.random.choice(self.frame_strides, p=self.frame_stride_weights)
+            last_start = self.raw_gt_trials[trial].shape[0] - 1 - (self.seq_len-1)*stride
+            start, stride = (min(start, last_start), stride) if last_start >= 0 else (start, 1) #shift windows that run past the end
+        frames = start + np.arange(0,self.seq_len)*stride
+
         imgs_left = []
         for i in range(0,self.seq_len):
-            imgs_left.append(self.load_image(self.left_img_samples[idx,i]))        
+            imgs_left.append(self.load_image(trial, frames[i], 'cam_02'))        
             
         imgs = list(imgs_left)
-        intrinsics = self.intrinsic_samples_left[idx] 
+        intrinsics = self.raw_intrinsic_trials_left[trial][frames]*self.intrinsic_scale(trial)
         
-        if self.load_stereo:
+        if len(self.stereo_views) > 0:
             imgs_left = imgs
             intrinsics_left = intrinsics
             imgs_right = []
             
-            for i in range(0,self.seq_len):
-                imgs_right.append(self.load_image(self.right_img_samples[idx,i]))     
+            for i in self.stereo_views:
+                imgs_right.append(self.load_image(trial, frames[i], 'cam_03'))     
         
             imgs_right = list(imgs_right)
-            intrinsics_right = self.intrinsic_samples_right[idx]
+            intrinsics_right = self.raw_intrinsic_trials_right[trial][frames[self.stereo_views]]*self.intrinsic_scale(trial)
             imgs = imgs_left + imgs_right
             intrinsics = np.vstack((intrinsics_left, intrinsics_right))
             
-        target_idx = int(len(imgs_left)/2)   
-        source_idx = list(range(0,self.seq_len))
-        source_idx.pop(target_idx)             
+        target_idx = self.target_idx
+        source_idx = self.source_idx
         
-        lie_alg = []
-        transformed_lie_alg = []
-        for i in range(0,self.seq_len-1):
-            lie_alg.append(list(self.compute_target(idx,target_idx, source_idx[i])))    
-            transformed_lie_alg.append(list(self.compute_target(idx,target_idx, source_idx[i])))   
-        
-        if self.load_stereo:
-            lie_alg = lie_alg+lie_alg
-            transformed_lie_alg = transformed_lie_alg + transformed_lie_alg #make 2 copies for transforms    
+        lie_alg = self.get_targets(idx, trial, start, stride)
+        transformed_lie_alg = [list(l) for l in lie_alg] #the transforms replace the list entries
         
         if self.transform_img != None:
             orig, transformed = self.transform_img((imgs, intrinsics, lie_alg), (imgs, intrinsics, transformed_lie_alg)) 
         orig_imgs, orig_intrinsics, orig_lie_alg = orig
         transformed_imgs, transformed_intrinsics, transformed_lie_alg = transformed  
       
-        flow_imgs_fwd, flow_imgs_fwd_list = [], []
-        flow_imgs_back, flow_imgs_back_list = [], []
+        flow_imgs_fwd = []
+        flow_imgs_back = []
         
 
         if self.config['flow_type'] == 'classical': # and self.config['preprocess_flow'] == False: ## compute flow online
             for i in range(0,len(imgs_left)-1):  
-                flow_img_t = np.array(imgs_left[target_idx].convert('L'))
-                flow_img_s = np.array(imgs_left[source_idx[i]].convert('L'))
-                flow_img_fwd = cv2.calcOpticalFlowFarneback(flow_img_t,flow_img_s, None, 0.5, 3, 15, 3, 5, 1.2, 0) #fwd is target to source
-                flow_img_fwd = torch.from_numpy(np.transpose(flow_img_fwd, (2,0,1))).float()
-                flow_img_back = cv2.calcOpticalFlowFarneback(flow_img_s,flow_img_t, None, 0.5, 3, 15, 3, 5, 1.2, 0) #back is src to target
-                flow_img_back = torch.from_numpy(np.transpose(flow_img_back, (2,0,1))).float()
+                flow_img_t = to_gray(imgs_left[target_idx])
+                flow_img_s = to_gray(imgs_left[source_idx[i]])
+                flow_img_fwd = torch.from_numpy(farneback_flow(flow_img_t,flow_img_s)).float() #fwd is target to source
+                flow_img_back = torch.from_numpy(farneback_flow(flow_img_s,flow_img_t)).float() #back is src to target
                 flow_imgs_fwd.append(flow_img_back) 
                 flow_imgs_back.append(flow_img_fwd)     
-            
-        target_im = {'color_left': orig_imgs[0:self.seq_len][target_idx], 'color_aug_left': transformed_imgs[0:self.seq_len][target_idx] }
-        source_imgs = {'color_left': [orig_imgs[0:self.seq_len][i] for i in source_idx], 'color_aug_left': [transformed_imgs[0:self.seq_len][i] for i in source_idx] }
-        intrinsics = {'color_left': orig_intrinsics[0:self.seq_len], 'color_aug_left': transformed_intrinsics[0:self.seq_len]}
-        lie_alg = {'color': orig_lie_alg[0:self.seq_len], 'color_aug': transformed_lie_alg[0:self.seq_len]}        
-        if self.load_stereo:
-            target_im['color_right'] = orig_imgs[self.seq_len:][target_idx]
-            target_im['color_aug_right'] = transformed_imgs[self.seq_len:][target_idx]
-            source_imgs['color_right'] = [orig_imgs[self.seq_len:][i] for i in source_idx]
-            source_imgs['color_aug_right'] = [transformed_imgs[self.seq_len:][i] for i in source_idx]
-            intrinsics['color_right'] = orig_intrinsics[self.seq_len:]
-            intrinsics['color_aug_right'] = transformed_intrinsics[self.seq_len:]
+
+        if self.config['flow_type'] == 'cached': ## same pairs as above, read from the cache written by data/create_flow_cache.py
+            for i in range(0,len(imgs_left)-1):
+                flow_imgs_fwd.append(self.load_cached_flow(trial, frames[source_idx[i]], (target_idx-source_idx[i])*stride))
+                flow_imgs_back.append(self.load_cached_flow(trial, frames[target_idx], (source_idx[i]-target_idx)*stride))
+
+            ### images are listed target first, then the sources; collate_samples stacks each list into a [B,S,C,H,W] tensor.
+            ### The flip is applied to both versions of the images, so the intrinsics and pose targets are shared by them.
+        slots = [target_idx] + source_idx
+        sample = {'imgs': {'color_left': [orig_imgs[i] for i in slots]},
+                  'intrinsics': {'color_left': orig_intrinsics[0].astype(np.float32)}, #constant across the sample
+                  'lie_alg': {'gt': np.stack([l[0] for l in orig_lie_alg]), 'vo': np.stack([l[1] for l in orig_lie_alg]),
+                              'gt_correction': np.stack([l[2] for l in orig_lie_alg]), 'dt': np.stack([l[3] for l in orig_lie_alg])}}
+        if not self.batch_augment:
+            sample['imgs']['color_aug_left'] = [transformed_imgs[i] for i in slots]
+        if len(self.stereo_views) > 0: ## only the right images in stereo_views, in slot order (slot 0 is the target if it is loaded)
+            right_slots = [self.seq_len + self.stereo_views.index(i) for i in slots if i in self.stereo_views]
+            sample['imgs']['color_right'] = [orig_imgs[j] for j in right_slots]
+            sample['intrinsics']['color_right'] = orig_intrinsics[self.seq_len].astype(np.float32)
+            if not self.batch_augment:
+                sample['imgs']['color_aug_right'] = [transformed_imgs[j] for j in right_slots]
+
+        if len(flow_imgs_fwd) > 0:
+            if self.batch_augment: ## halves the bytes of the flow sent to the main process
+                flow_imgs_fwd = [f.half() for f in flow_imgs_fwd]
+                flow_imgs_back = [f.half() for f in flow_imgs_back]
+            sample['flow'] = {'fwd': flow_imgs_fwd, 'back': flow_imgs_back}
         
-        return target_im, source_imgs, lie_alg, intrinsics, (flow_imgs_fwd, flow_imgs_back)
+        return sample
+
+
+    def load_sequence(self, index, basedir, name):
+        """Arrays of a sequence's .mat file, as memory-mapped views of the dataset index if it is up to date"""
+        mat_file = os.path.join(basedir, name, '{}.mat'.format(self.mat_name))
+        if index is not None and name in index:
+            if os.path.getmtime(mat_file) <= index.mtime:
+                return index.sequence(name)
+            print('{} is newer than {} - loading the .mat file (rerun data/create_dataset_index.py)'.format(mat_file, index.filename))
+        data = sio.loadmat(mat_file)
+        data['cam_02'], data['cam_03'] = data['cam_02'].reshape((-1)), data['cam_03'].reshape((-1))
+        return data
+
+    def set_img_size(self, img_size):
+        """Changes the (height, width) frames are rescaled to (None: as stored), e.g. between epochs.  DataLoader workers
+        started afterwards (i.e. at the next epoch, unless the workers are persistent) use the new size."""
+        self.img_size = tuple(img_size) if img_size is not None else None
 
+    def intrinsic_scale(self, trial):
+        """(3,1) factors that rescale the rows of a trial's stored intrinsics to img_size"""
+        if self.img_size is None:
+            return np.ones((3,1))
+        w, h = self.trial_img_sizes[trial]
+        return np.array([[self.img_size[1]/w], [self.img_size[0]/h], [1.]])
 
-    def load_image(self, img_file):
-        img = Image.open(img_file[0])
+    def load_image(self, trial, frame, cam='cam_02'):
+        """Frame of a trial, as a PIL image, an (H,W,3) uint8 array (.npy frames) or (with the frame store) a zero-copy
+        (H,W,3) uint8 view of the packed frames.
+        With a frame cache attached, frames are (H,W,3) uint8 arrays shared between the workers of all loaders.
+        With img_size set, frames are rescaled to it (the cache holds frames as stored, so it serves every size)."""
+        if self.frame_cache is not None:
+            key = self.frame_cache.key(self.trial_dirs[trial], frame*self.trial_strides[trial], cam)
+            img = self.frame_cache.get(key)
+            if img is None:
+                img = np.array(self.read_image(trial, frame, cam))
+                self.frame_cache.put(key, img)
+        else:
+            img = self.read_image(trial, frame, cam)
+        if self.img_size is not None:
+            img = resize_frame(img, self.img_size)
         return img
+
+    def read_image(self, trial, frame, cam='cam_02'):
+        if self.frame_store:
+            return self.load_packed_frames(trial, cam)[frame*self.trial_strides[trial]]
+        filenames = self.left_cam_filenames if cam == 'cam_02' else self.right_cam_filenames
+        img = open_frame(filenames[self.trial_frame_ids[trial][frame]]) #a file, or a member of a zip/tar archive (a PIL image, or an array for .npy frames)
+        return img
+
+    def frame_shape(self):
+        """Shape of a decoded frame, e.g. for sizing a SharedFrameCache"""
+        return np.array(self.read_image(0, 0, 'cam_02')).shape
+
+    def load_packed_frames(self, trial, cam):
+        """Memory-maps the packed frames of a trial's sequence (copy-on-write, so views can be handed to torch.from_numpy
+        while the OS page cache shares the pixels between all DataLoader workers)"""
+        key = (self.trial_dirs[trial], cam)
+        if key not in self.frame_stores:
+            filename = frame_store_filename(self.trial_dirs[trial], self.mat_name, cam)
+            if not os.path.exists(filename):
+                raise FileNotFoundError('{} is missing - run data/create_frame_store.py first'.format(filename))
+            self.frame_stores[key] = np.load(filename, mmap_mode='c')
+        return self.frame_stores[key]
+
+    def load_cached_flow(self, trial, frame, offset):
+        """Flow from a trial frame to the frame offset from it, sliced from the memory-mapped flow cache.
+        Caches are opened lazily, so each DataLoader worker maps its own (read-only) copy."""
+        stride = self.trial_strides[trial]
+        key = (self.trial_dirs[trial], offset*stride)
+        if key not in self.flow_cache:
+            filename = flow_cache_filename(self.trial_dirs[trial], self.mat_name, offset*stride)
+            if not os.path.exists(filename):
+                raise FileNotFoundError('{} is missing - run data/create_flow_cache.py first'.format(filename))
+            self.flow_cache[key] = np.load(filename, mmap_mode='r')
+        flow = self.flow_cache[key][frame*stride]
+        if self.img_size is not None:
+            flow = resize_flow(flow, self.img_size)
+        return torch.from_numpy(flow.astype(np.float16 if self.batch_augment else np.float32))
     
-    def compute_target(self, idx, target_idx, source_idx):
-        ## Compute ts
-        # dt = np.abs(self.ts_samples[idx,target_idx] - self.ts_samples[idx, source_idx])
-        dt = self.ts_samples[idx,target_idx] - self.ts_samples[idx, source_idx]
-        
-        #compute Tau_gt
-        T2 = SE3.from_matrix(self.gt_samples[idx,target_idx,:,:],normalize=True).inv()
-        T1 = SE3.from_matrix(self.gt_samples[idx,source_idx,:,:],normalize=True)
-        dT_gt = T2.dot(T1) #pose change from source to a target (for reconstructing source from target)
-        gt_lie_alg = dT_gt.log()
-         
-        #compute Tau_vo
-        T2 = SE3.from_matrix(self.vo_samples[idx,target_idx,:,:],normalize=True).inv()
-        T1 = SE3.from_matrix(self.vo_samples[idx,source_idx,:,:],normalize=True)
-        dT_vo = T2.dot(T1)
-        vo_lie_alg = dT_vo.log()
-        
-        if self.config['estimator_type'] == 'mono':
-            if np.linalg.norm(vo_lie_alg[0:3]) >= 1e-8:
-                scale = np.linalg.norm(gt_lie_alg[0:3])/np.linalg.norm(vo_lie_alg[0:3])
-                scale = 1
-                vo_lie_alg[0:3] = scale*vo_lie_alg[0:3]
-                dT_vo = SE3.exp(vo_lie_alg)
-
-        gt_correction = (dT_gt.dot(dT_vo.inv())).log()
+    def get_targets(self, idx, trial, start, stride=1):
+        """[gt_lie_alg, vo_lie_alg, gt_correction, dt] of every source slot of a sample (precomputed for stride 1)"""
+        if stride == 1:
+            targets = [self.gt_lie_alg[idx], self.vo_lie_alg[idx], self.gt_correction[idx], self.dt[idx]]
+        else:
+            targets = [t[0] for t in self.window_targets(trial, np.array([start]), stride)]
+        return [[t[i] for t in targets] for i in range(0,self.seq_len-1)]
+
+    def compute_targets(self):
+        """Computes the pose change targets of every sample and source slot (see window_targets).
+        Returns float32 arrays indexed by [sample, source slot]."""
+        num_samples, num_sources = self.sample_index.shape[0], len(self.source_idx)
+        gt_lie_alg = np.zeros((num_samples, num_sources, 6), dtype=np.float32)
+        vo_lie_alg = np.zeros((num_samples, num_sources, 6), dtype=np.float32)
+        gt_correction = np.zeros((num_samples, num_sources, 6), dtype=np.float32)
+        dt = np.zeros((num_samples, num_sources, 1), dtype=np.float32)
+
+        for trial in range(0,len(self.raw_gt_trials)):
+            samples = np.where(self.sample_index[:,0] == trial)[0]
+            if samples.shape[0] == 0:
+                continue
+            gt_lie_alg[samples], vo_lie_alg[samples], gt_correction[samples], dt[samples] = \
+                self.window_targets(trial, self.sample_index[samples,1], 1)
+
+        return gt_lie_alg, vo_lie_alg, gt_correction, dt
+
+    def window_targets(self, trial, start, stride):
+        """Pose change targets of the windows of a trial that start at the frames in `start`, with `stride` frames between
+        images, computed with batched SE(3) logs.  Returns float32 arrays indexed by [window, source slot]: gt and vo lie
+        algebra (source to target), the gt correction to the vo estimate, and the timestamp difference dt."""
+        frames = start.reshape((-1,1)) + np.arange(0,self.seq_len)*stride
+        used, frame_idx = np.unique(frames, return_inverse=True) #every pose is normalized once
+        frame_idx = frame_idx.reshape(frames.shape)
+        gt, vo, ts = se3_normalize(self.raw_gt_trials[trial][used]), se3_normalize(self.raw_vo_traj[trial][used]), self.raw_ts[trial][used]
+        gt_inv, vo_inv = se3_inv(gt), se3_inv(vo)
+
+        num_windows, num_sources = frames.shape[0], len(self.source_idx)
+        gt_lie_alg = np.zeros((num_windows, num_sources, 6), dtype=np.float32)
+        vo_lie_alg = np.zeros((num_windows, num_sources, 6), dtype=np.float32)
+        gt_correction = np.zeros((num_windows, num_sources, 6), dtype=np.float32)
+        dt = np.zeros((num_windows, num_sources, 1), dtype=np.float32)
+        target = frame_idx[:,self.target_idx]
+        for i, s in enumerate(self.source_idx):
+            source = frame_idx[:,s]
+            dt[:,i,0] = ts[target] - ts[source]
+
+            dT_gt = gt_inv[target] @ gt[source] #pose change from source to a target (for reconstructing source from target)
+            gt_lie_alg[:,i] = se3_log(dT_gt)
+
+            dT_vo = vo_inv[target] @ vo[source]
+            vo_log = se3_log(dT_vo)
+            vo_lie_alg[:,i] = vo_log
+
+            if self.config['estimator_type'] == 'mono': #vo translation is used unscaled (scale = 1)
+                moving = np.linalg.norm(vo_log[:,0:3], axis=1) >= 1e-8
+                dT_vo[moving] = se3_exp(vo_log[moving])
+
+            gt_correction[:,i] = se3_log(dT_gt @ se3_inv(dT_vo))
+
         return gt_lie_alg, vo_lie_alg, gt_correction, dt
 
     def reshape_data(self):
-        self.samples_per_file=None
-        gt_samples = self.raw_gt_trials[0][0:self.seq_len,:,:].reshape((1,self.seq_len,4,4))
-        vo_samples = self.raw_vo_traj[0][0:self.seq_len,:,:].reshape((1,self.seq_len,4,4))
-        intrinsic_samples_left = self.raw_intrinsic_trials_left[0][0:self.seq_len,:,:].reshape((1,self.seq_len,3,3))
-        intrinsic_samples_right = self.raw_intrinsic_trials_right[0][0:self.seq_len,:,:].reshape((1,self.seq_len,3,3))
-        left_img_samples = self.left_cam_filenames[0][0:self.seq_len].reshape((1,self.seq_len,1))
-        right_img_samples = self.right_cam_filenames[0][0:self.seq_len].reshape((1,self.seq_len,1))
-        ts_samples = self.raw_ts[0][0:self.seq_len].reshape((1,self.seq_len,1))
-        pose_per_sample = []
-
-        for gt in self.raw_gt_trials:
-            gt = gt.reshape((-1,gt.shape[1]*gt.shape[2]))
-            if self.samples_per_file == None:
-                num_samples = int(gt.shape[0]/(self.seq_len))
-            new_gt = self.split_data(gt, num_samples, self.seq_len)
-            new_gt = new_gt.reshape((-1,self.seq_len,4,4))
-            gt_samples = np.vstack((gt_samples, new_gt))
-            pose_per_sample.append(new_gt.shape[0])
-            
-        for vo in self.raw_vo_traj:
-            vo = vo.reshape((-1,vo.shape[1]*vo.shape[2]))
-            if self.samples_per_file == None:
-                num_samples = int(vo.shape[0]/(self.seq_len))
-            new_vo = self.split_data(vo, num_samples, self.seq_len)
-            new_vo = new_vo.reshape((-1,self.seq_len,4,4))
-            vo_samples = np.vstack((vo_samples, new_vo))
-            
-        for intrins in self.raw_intrinsic_trials_left:
-            intrins = intrins.reshape((-1,intrins.shape[1]*intrins.shape[2]))
-            if self.samples_per_file == None:
-                num_samples = int(intrins.shape[0]/(self.seq_len))
-            new_intrins = self.split_data(intrins, num_samples, self.seq_len)
-            new_intrins = new_intrins.reshape((-1,self.seq_len,3,3))
-            intrinsic_samples_left = np.vstack((intrinsic_samples_left, new_intrins))
-            
-        for intrins_r in self.raw_intrinsic_trials_right:
-            intrins_r = intrins_r.reshape((-1,intrins_r.shape[1]*intrins_r.shape[2]))
-            if self.samples_per_file == None:
-                num_samples = int(intrins_r.shape[0]/(self.seq_len))
-            new_intrins = self.split_data(intrins_r, num_samples, self.seq_len)
-            new_intrins = new_intrins.reshape((-1,self.seq_len,3,3))
-            intrinsic_samples_right = np.vstack((intrinsic_samples_right, new_intrins))   
-                 
-        count = 0
-        for im in self.left_cam_filenames:
-            im = im.reshape((-1,1))
-            if self.samples_per_file == None:
-                num_samples = int(im.shape[0]/(self.seq_len))
-            new_imgs = self.split_data(im, num_samples, self.seq_len)
-            left_img_samples = np.vstack((left_img_samples, new_imgs[0:pose_per_sample[count]])) #get rid of extra imgs due to rounding of gt
-            count +=1
-
-        count = 0
-        for im in self.right_cam_filenames:
-            im = im.reshape((-1,1))
-            if self.samples_per_file == None:
-                num_samples = int(im.shape[0]/(self.seq_len))
-            new_imgs = self.split_data(im, num_samples, self.seq_len)
-            right_img_samples = np.vstack((right_img_samples, new_imgs[0:pose_per_sample[count]])) #get rid of extra imgs due to rounding of gt
-            count +=1
-
-        count = 0
-        for t in self.raw_ts:
-            t = t.reshape((-1,1))
-            if self.samples_per_file == None:
-                num_samples = int(t.shape[0]/(self.seq_len))
-            new_ts = self.split_data(t, num_samples, self.config['img_per_sample'])
-            ts_samples = np.vstack((ts_samples, new_ts[0:pose_per_sample[count]])) #get rid of extra imgs due to rounding of gt
-            count +=1
-           
-        gt_samples = gt_samples[1:]
-        intrinsic_samples_left = intrinsic_samples_left[1:]
-        intrinsic_samples_right = intrinsic_samples_right[1:]
-        left_img_samples = left_img_samples[1:]
-        right_img_samples = right_img_samples[1:]
-        vo_samples = vo_samples[1:]
-        ts_samples = ts_samples[1:]
-
-        return gt_samples, left_img_samples, right_img_samples, intrinsic_samples_left, intrinsic_samples_right, vo_samples, \
-            ts_samples
+        """Sample index of the sliding windows of every trial (a window starting at every frame): the (trial, window
+        start) pair of every sample, in the same order as before.  The window data is sliced from the raw trials
+        when a sample is read (frame f of a trial is filenames[trial_frame_ids[trial][f]])."""
+        num_windows = np.array([max(gt.shape[0] - self.seq_len + 1, 0) for gt in self.raw_gt_trials], dtype=np.int64)
+        trial = np.repeat(np.arange(num_windows.shape[0]), num_windows)
+        start = np.arange(trial.shape[0]) - np.repeat(np.cumsum(num_windows) - num_windows, num_windows)
+        sample_index = np.stack((trial, start), axis=1)
 
-        
-    def split_data(self, data, num_samples,sample_size):
-        Type = data.dtype
-        samplesize=int(sample_size)
-        output = np.zeros((1,samplesize,data.shape[1])).astype(Type)
-        i=0
-        while i <= (data.shape[0]-sample_size):
-            output = np.vstack((output, data[i:i+samplesize].reshape(1,samplesize,data.shape[1])))
-            # i+=(samplesize-1) 
-            i+=1           
-        return output[1:] 
+        return sample_index
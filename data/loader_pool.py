@@ -0,0 +1,91 @@
+import torch
+import torch.utils.data
+from data.kitti_loader import collate_samples
+
+class SplitBatchSampler(torch.utils.data.Sampler):
+    """Batches of the split that is being iterated, as indices into the concatenated datasets of a LoaderPool"""
+    def __init__(self, batch_samplers, offsets):
+        self.batch_samplers = batch_samplers
+        self.offsets = offsets
+        self.split = None
+
+    def __iter__(self):
+        offset = self.offsets[self.split]
+        for batch in self.batch_samplers[self.split]:
+            yield [offset + i for i in batch]
+
+    def __len__(self):
+        return len(self.batch_samplers[self.split])
+
+class SplitLoader(object):
+    """One split of a LoaderPool, used like a DataLoader (iteration, len() in batches, and .dataset)"""
+    def __init__(self, pool, split):
+        self.pool = pool
+        self.split = split
+        self.dataset = pool.datasets[split]
+        self.batch_size = pool.batch_size
+
+    def __len__(self):
+        return len(self.pool.batch_samplers[self.split])
+
+    def __iter__(self):
+        return self.pool.iterate(self.split)
+
+class LoaderPool(object):
+    """A single DataLoader with persistent workers that serves the batches of several dataset splits (e.g. train, val and
+    test), which are never iterated at the same time.
+
+    The workers are started on the first iteration (so e.g. a SharedFrameCache can still be attached to the datasets) and
+    are then kept for every split and epoch, instead of each split's DataLoader starting num_workers processes every
+    epoch.  pool[split] is iterated like that split's DataLoader; breaking out of an iteration is fine, the next one
+    discards the batches that were prefetched for it.
+
+    Splits can share a dataset (e.g. the same val windows read shuffled for a loss and in order for an evaluation); it is
+    then loaded once and only the splits' samplers differ.
+
+    Args:
+        datasets: {split: dataset}
+        samplers: optional {split: sampler} (e.g. RandomSampler or data.motion_sampler.MotionSampler); splits without one
+            are read in order
+        prefetch_factor: batches loaded in advance by each worker
+    """
+    def __init__(self, datasets, batch_size, samplers=None, num_workers=8, prefetch_factor=2, collate_fn=collate_samples, pin_memory=None):
+        samplers = samplers or {}
+        self.datasets = datasets
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.collate_fn = collate_fn
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+
+        self.batch_samplers, offsets, dataset_offsets, offset = {}, {}, {}, 0
+        self.unique_datasets = [] #concatenated once each, in split order
+        for split, dataset in datasets.items():
+            sampler = samplers.get(split) or torch.utils.data.SequentialSampler(dataset)
+            self.batch_samplers[split] = torch.utils.data.BatchSampler(sampler, batch_size, drop_last=False)
+            if id(dataset) not in dataset_offsets:
+                dataset_offsets[id(dataset)] = offset
+                self.unique_datasets.append(dataset)
+                offset += len(dataset)
+            offsets[split] = dataset_offsets[id(dataset)]
+        self.split_sampler = SplitBatchSampler(self.batch_samplers, offsets)
+        self.loader = None
+        self.loaders = {split: SplitLoader(self, split) for split in datasets}
+
+    def __getitem__(self, split):
+        return self.loaders[split]
+
+    def iterate(self, split):
+        if self.loader is None:
+            kwargs = {'num_workers': self.num_workers, 'collate_fn': self.collate_fn, 'pin_memory': self.pin_memory}
+            if self.num_workers > 0:
+                kwargs.update(persistent_workers=True, prefetch_factor=self.prefetch_factor)
+            self.loader = torch.utils.data.DataLoader(torch.utils.data.ConcatDataset(self.unique_datasets), \
+                batch_sampler=self.split_sampler, **kwargs)
+        self.split_sampler.split = split #read when the loader requests the first batches
+        return iter(self.loader)
+
+    def restart(self):
+        """Drops the DataLoader, whose workers exit with its iterator, so that workers are started again (with copies of
+        the datasets' current state, e.g. after set_img_size) on the next iteration"""
+        self.loader = None
@@ -0,0 +1,33 @@
+import numpy as np
+import torch
+import torch.utils.data
+
+class MotionSampler(torch.utils.data.Sampler):
+    """Samples the windows of a KittiLoaderPytorch dataset by how much the camera moves within them.
+
+    The motion of a window is the largest translation and rotation norm of its source-to-target pose changes (from the
+    gt or vo poses of the dataset, which come from the dataset index or the .mat files).  Windows in which both stay below
+    the thresholds (the static-frame thresholds of create_kitti_odometry_data.py by default) are near-static: they are drawn
+    with weight static_weight (0 skips them) instead of 1.  Every epoch draws a new random subset of
+    epoch_fraction*(number of windows with nonzero weight) windows without replacement, so an epoch covers a
+    representative subset of the sequences in a fraction of the time.
+    """
+    def __init__(self, dataset, epoch_fraction=1.0, static_weight=0.0, min_trans=0.15, min_rot=0.003, motion_source='gt'):
+        self.dataset = dataset
+        lie_alg = dataset.gt_lie_alg if motion_source == 'gt' else dataset.vo_lie_alg #[sample, source slot, 6]
+        self.trans = np.linalg.norm(lie_alg[:,:,0:3], axis=2).max(axis=1)
+        self.rot = np.linalg.norm(lie_alg[:,:,3:6], axis=2).max(axis=1)
+        self.static = (self.trans < min_trans) & (self.rot < min_rot)
+        self.weights = torch.from_numpy(np.where(self.static, static_weight, 1.0))
+        num_candidates = int((self.weights > 0).sum())
+        self.num_samples = min(max(int(round(epoch_fraction*num_candidates)), 1), num_candidates)
+        print('motion sampler: {} of {} windows are static, drawing {} windows per epoch'.format(int(self.static.sum()), \
+            self.static.shape[0], self.num_samples))
+
+    def __iter__(self):
+        if self.num_samples == 0:
+            return iter([])
+        return iter(torch.multinomial(self.weights, self.num_samples, replacement=False).tolist())
+
+    def __len__(self):
+        return self.num_samples
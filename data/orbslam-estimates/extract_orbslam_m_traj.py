@@ -1,5 +1,4 @@
 import numpy as np
-from liegroups.numpy import SO3, SE3
 from collections import namedtuple
 from PIL import Image
 import scipy.io as sio
@@ -7,6 +6,9 @@ import matplotlib.pyplot as plt
 from pyslam.metrics import TrajectoryMetrics
 import glob
 import numpy as np
+import sys
+sys.path.insert(0,'../..')
+from utils.lie_algebra_np import quaternion_to_so3, se3_inv, se3_normalize, se3_log
 
 
 seq_names= {'00': '2011_10_03_drive_0027',
@@ -24,6 +26,7 @@ seq_names= {'00': '2011_10_03_drive_0027',
 gt_dir = 'ground_truth'
 output_dir = 'orbslam_mono_traj'
 data_dir = '/media/brandon/DATA/KITTI-odometry-gray/sequences'
+max_time_diff = 0.05 #keyframes further (in s) from every KITTI frame are reported and dropped
 
 for seq in seq_names:
 
@@ -33,78 +36,43 @@ for seq in seq_names:
     kitti_ts = np.loadtxt('{}/{}/times.txt'.format(data_dir, seq))
     
     f = '/home/brandon/Desktop/Projects/VO-implementations/ORB_SLAM2/saved_trajectories/{}.txt'.format(seq)
-    img_idx = []
-    dT_list = []
-    T = []
     l = np.loadtxt(f)
     ts = l[:,0]
     pos = l[:,1:4]
     quat = l[:,4:8]
-    
-    for i in range(0, pos.shape[0]):
-        R = SO3.from_quaternion(quat[i],ordering='xyzw')
-        T.append(SE3(R, pos[i]))
-        img_idx.append(np.argmin(np.abs(ts[i]-kitti_ts)))
 
-    for i in range(0, len(T)-1):
-        dT = (T[i].inv()).dot(T[i+1])
-        dT_list.append(dT.as_matrix())
+        ###associate every keyframe with the nearest KITTI frame (kitti_ts is sorted; ties go to the earlier frame)
+    upper = np.clip(np.searchsorted(kitti_ts, ts), 1, kitti_ts.shape[0]-1)
+    lower = upper - 1
+    img_idx = np.where(np.abs(ts - kitti_ts[lower]) <= np.abs(kitti_ts[upper] - ts), lower, upper)
+    matched = np.abs(ts - kitti_ts[img_idx]) <= max_time_diff
+    if not matched.all():
+        print('{} keyframes are more than {}s from any KITTI frame (dropped): {}'.format(np.sum(~matched), max_time_diff, ts[~matched]))
+    img_idx, pos, quat = img_idx[matched], pos[matched], quat[matched]
 
-    gt_traj = data['poses_gt'].transpose(2,0,1) #[0:4541]
-    est_traj = []
-    est_traj.append(gt_traj[0])
-    
-    for i in range(0,len(dT_list)):
-        
-        dT = SE3.from_matrix(dT_list[i],normalize=True)
-        
-        new_est = SE3.as_matrix(SE3.from_matrix(est_traj[i],normalize=True).dot(dT))
-        est_traj.append(new_est)
+    T = np.zeros((pos.shape[0],4,4))
+    T[:,0:3,0:3] = quaternion_to_so3(quat, ordering='xyzw')
+    T[:,0:3,3] = pos
+    T[:,3,3] = 1
 
-    est_traj = np.array(est_traj)
+        ###chaining the relative poses dT_i = T_i^-1 T_i+1 onto the first gt pose telescopes to gt_0 T_0^-1 T_k
+    gt_traj = data['poses_gt'].transpose(2,0,1) #[0:4541]
+    est_traj = se3_normalize(se3_normalize(gt_traj[0]) @ se3_inv(T[0:1]) @ T)
     gt_traj = np.array(gt_traj)[img_idx]
 
-    gt_traj_se3 = [SE3.from_matrix(T) for T in gt_traj]
-    est_traj_se3 = [SE3.from_matrix(T,normalize=True) for T in est_traj]
     data['poses_est'] = est_traj.transpose(1,2,0)
     data['poses_gt'] = gt_traj.transpose(1,2,0)
     data['keyframe_idx'] = np.array(img_idx)
     sio.savemat('{}/{}.mat'.format(output_dir,drive), data)
-    gt_pose_vec = []
-    est_pose_vec = []
-    
-    ###create the pose vec
-    for idx in range(0, est_traj.shape[0]-1):
-        T2 = SE3.from_matrix(est_traj[idx+1,:,:], normalize=True).inv()
-        T1 = SE3.from_matrix(est_traj[idx,:,:],normalize=True)
-        dT = T2.dot(T1)
-        
-        gt2 = SE3.from_matrix(gt_traj[idx+1,:,:],normalize=True).inv()
-        gt1 = SE3.from_matrix(gt_traj[idx,:,:],normalize=True)
-        gt_dT = gt2.dot(gt1)
-        gt_pose_vec = gt_dT.log()
-        print(gt_pose_vec)
-        
-        svo_target = dT.log()
-        if np.linalg.norm(svo_target[0:3]) >=1e-10:
-            scale = np.linalg.norm(gt_pose_vec[0:3])/np.linalg.norm(svo_target[0:3])
-            scale=1
-            svo_target[0:3] = scale*svo_target[0:3]
-            
-        est_pose_vec.append(svo_target)
-    
-    scaled_traj = []
-    scaled_traj.append(gt_traj[0]) 
-    
-    for i in range(0,est_traj.shape[0]-1):
-        #classically estimated traj
-        dT = SE3.exp(est_pose_vec[i])
-        new_est = SE3.as_matrix((dT.dot(SE3.from_matrix(scaled_traj[i],normalize=True).inv())).inv())
-        scaled_traj.append(new_est)
-    
-    scaled_traj_se3 = [SE3.from_matrix(T,normalize=True) for T in scaled_traj]
-    scaled_traj = np.array(scaled_traj)
-    
+
+        ###create the pose vecs: relative motion T_i+1^-1 T_i of consecutive frames (est_pose_vec with the scale fixed to 1)
+    gt_traj_norm, est_traj_norm = se3_normalize(gt_traj), se3_normalize(est_traj)
+    gt_pose_vec = se3_log(se3_inv(gt_traj_norm[1:]) @ gt_traj_norm[:-1])
+    est_pose_vec = se3_log(se3_inv(est_traj_norm[1:]) @ est_traj_norm[:-1])
+    print(gt_pose_vec)
+
+        ###re-integrating est_pose_vec (T_k+1 = T_k exp(v_k)^-1, which telescopes) from the (matched) first gt pose, for plotting
+    scaled_traj = se3_normalize(gt_traj[0]) @ se3_inv(est_traj[0:1]) @ est_traj
 
     plt.plot(scaled_traj[:,0,3], scaled_traj[:,1,3])    
 
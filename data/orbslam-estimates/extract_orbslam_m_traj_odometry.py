@@ -1,5 +1,4 @@
 import numpy as np
-from liegroups.numpy import SO3, SE3
 from collections import namedtuple
 from PIL import Image
 import scipy.io as sio
@@ -7,6 +6,9 @@ import matplotlib.pyplot as plt
 from pyslam.metrics import TrajectoryMetrics
 import glob
 import numpy as np
+import sys
+sys.path.insert(0,'../..')
+from utils.lie_algebra_np import se3_inv, se3_normalize, se3_log
 
 
 seq_names= {'00': '2011_10_03_drive_0027',
@@ -50,7 +52,6 @@ for seq in seqs:
         
     orbslam_dir = '/home/brandon/Desktop/Projects/VO-implementations/ORB_SLAM2/saved_trajectories/{}/'.format(seq)
     T_list = []
-    dT_list = []
     valid_idx = []
     for i, f in enumerate(sorted(glob.glob('{}**'.format(orbslam_dir))) ):
         T = np.loadtxt(f)
@@ -59,29 +60,14 @@ for seq in seqs:
             valid_idx.append(i)
 
 
-    se3_list = []
-    for T in T_list:
-        se3_list.append(SE3.from_matrix(T,normalize=True))
-
-    for i in range(0, len(se3_list)-1):
-        dT = (se3_list[i].dot(se3_list[i+1].inv()))
-        dT_list.append(dT.as_matrix())
-    
-
-    for i in range(0,len(dT_list)):
-        dT = SE3.from_matrix(dT_list[i],normalize=True)
-        new_est = SE3.as_matrix(SE3.from_matrix(est_traj[i],normalize=True).dot(dT)) ## dT is T_12, T02 = T01 * T12
-        est_traj.append(new_est)
-
-    est_traj = np.array(est_traj)
+        ###chaining the relative poses dT_i = T_i T_i+1^-1 onto the first pose telescopes to est_0 T_0 T_k^-1
+    T = se3_normalize(np.array(T_list).reshape((-1,4,4)))
+    est_traj = se3_normalize(se3_normalize(est_traj[0]) @ T[0:1] @ se3_inv(T))
     if seq_names[seq] is not None:
         gt_traj = np.array(gt_traj)[valid_idx]
     else:
         gt_traj = np.copy(est_traj)
 
-
-    gt_traj_se3 = [SE3.from_matrix(T,normalize=True) for T in gt_traj]
-    est_traj_se3 = [SE3.from_matrix(T,normalize=True) for T in est_traj]
     data['poses_est'] = est_traj.transpose(1,2,0)
     data['poses_gt'] = gt_traj.transpose(1,2,0)
     data['keyframe_idx'] = np.array(valid_idx)
@@ -89,39 +75,14 @@ for seq in seqs:
     print(data['poses_est'].shape, data['poses_gt'].shape)
     
     sio.savemat('{}/{}.mat'.format(output_dir,seq), data)
-    gt_pose_vec = []
-    est_pose_vec = []
-    
-    ###create the pose vec
-    for idx in range(0, est_traj.shape[0]-1):
-        T2 = SE3.from_matrix(est_traj[idx+1,:,:], normalize=True).inv()
-        T1 = SE3.from_matrix(est_traj[idx,:,:],normalize=True)
-        dT = T2.dot(T1)
-        
-        gt2 = SE3.from_matrix(gt_traj[idx+1,:,:],normalize=True).inv()
-        gt1 = SE3.from_matrix(gt_traj[idx,:,:],normalize=True)
-        gt_dT = gt2.dot(gt1)
-        gt_pose_vec = gt_dT.log()
-        
-        svo_target = dT.log()
-        if np.linalg.norm(svo_target[0:3]) >=1e-10:
-            scale = np.linalg.norm(gt_pose_vec[0:3])/np.linalg.norm(svo_target[0:3])
-            scale=1
-            svo_target[0:3] = scale*svo_target[0:3]
-            
-        est_pose_vec.append(svo_target)
-    
-    scaled_traj = []
-    scaled_traj.append(gt_traj[0]) 
-    
-    for i in range(0,est_traj.shape[0]-1):
-        #classically estimated traj
-        dT = SE3.exp(est_pose_vec[i])
-        new_est = SE3.as_matrix((dT.dot(SE3.from_matrix(scaled_traj[i],normalize=True).inv())).inv()) 
-        scaled_traj.append(new_est)
-    
-    scaled_traj_se3 = [SE3.from_matrix(T,normalize=True) for T in scaled_traj]
-    scaled_traj = np.array(scaled_traj)
+
+        ###create the pose vecs: relative motion T_i+1^-1 T_i of consecutive frames (est_pose_vec with the scale fixed to 1)
+    gt_traj_norm, est_traj_norm = se3_normalize(gt_traj), se3_normalize(est_traj)
+    gt_pose_vec = se3_log(se3_inv(gt_traj_norm[1:]) @ gt_traj_norm[:-1])
+    est_pose_vec = se3_log(se3_inv(est_traj_norm[1:]) @ est_traj_norm[:-1])
+
+        ###re-integrating est_pose_vec (T_k+1 = T_k exp(v_k)^-1, which telescopes) from the first gt pose, for plotting
+    scaled_traj = se3_normalize(gt_traj[0]) @ se3_inv(est_traj[0:1]) @ est_traj
     
 
     plt.plot(scaled_traj[:,0,3], scaled_traj[:,1,3])    
@@ -0,0 +1,101 @@
+import os
+import json
+import math
+import numpy as np
+import cv2
+
+'''
+Fused preprocessing of raw Robotcar (Bayer) images: a uint8 demosaic followed by a single remap that undistorts, crops
+and resizes, instead of a float64 demosaic, a full-frame per-channel undistortion (CameraModel.undistort), a crop and a
+resize.
+
+The remap table of a camera composes, for every output pixel, the resize (pixel centres, as PIL's resize), the crop and
+the camera's undistortion LUT into source (distorted) image coordinates, so only the output pixels are interpolated.
+When the resize downsamples, each output pixel is the mean of sub_x*sub_y bilinear samples spread over its footprint
+(an area filter, like the antialiasing of the PIL resize it replaces).
+
+Tables are saved once per camera (RemapTable.save) and memory-mapped by every process that uses them (load_table), so
+process pool tasks only need to carry a frame path and a table filename, and workers share the table pages.
+'''
+
+tables = {} #loaded once per process, by filename
+
+## OpenCV names Bayer patterns by the second row (e.g. a 'gbrg' sensor is COLOR_BayerGR2RGB)
+bayer_codes = {'gbrg': cv2.COLOR_BayerGR2RGB, 'grbg': cv2.COLOR_BayerGB2RGB, 'rggb': cv2.COLOR_BayerBG2RGB, 'bggr': cv2.COLOR_BayerRG2RGB}
+
+def demosaic(raw, pattern):
+    """Bilinear demosaic of a HxW uint8 Bayer image into a HxWx3 uint8 RGB image"""
+    return cv2.cvtColor(np.ascontiguousarray(raw, dtype=np.uint8), bayer_codes[pattern])
+
+class RemapTable(object):
+    """Undistort + crop + resize of the images of one camera, as a single remap.
+
+    Args:
+        model: oxford.camera_model.CameraModel of the camera
+        image_shape: (height, width) of the distorted images
+        crop: [top, bottom, left, right] crop of the undistorted image (slice bounds, negative values count from the end)
+        out_size: (width, height) of the output images
+    Attributes:
+        zoom_x, zoom_y: scale factors from the cropped to the output image (for the intrinsics)
+    """
+    def __init__(self, model, image_shape, crop, out_size):
+        height, width = image_shape
+        if height*width != model.bilinear_lut.shape[0]:
+            raise ValueError('Incorrect image size for camera model')
+        rows, cols = range(0,height)[crop[0]:crop[1]], range(0,width)[crop[2]:crop[3]]
+        self.out_size = out_size
+        out_width, out_height = out_size
+        self.zoom_x, self.zoom_y = out_width/len(cols), out_height/len(rows)
+        self.sub_x, self.sub_y = math.ceil(len(cols)/out_width), math.ceil(len(rows)/out_height)
+
+            ## sample positions (sub-pixel grid of each output pixel) in the undistorted image
+        x = cols.start + (np.arange(0, out_width*self.sub_x) + 0.5)*len(cols)/(out_width*self.sub_x) - 0.5
+        y = rows.start + (np.arange(0, out_height*self.sub_y) + 0.5)*len(rows)/(out_height*self.sub_y) - 0.5
+        x, y = np.meshgrid(x.astype(np.float32), y.astype(np.float32))
+
+            ## their positions in the distorted image (bilinear interpolation of the undistortion LUT)
+        lut = model.bilinear_lut.astype(np.float32).reshape((height, width, 2))
+        map_x = cv2.remap(lut[:,:,0], x, y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        map_y = cv2.remap(lut[:,:,1], x, y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        self.maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+    def save(self, filename):
+        """Saves the table as '{filename}.map1.npy', '{filename}.map2.npy' and '{filename}.json' (written last, and each
+        file atomically, so concurrent runs can build the same table)"""
+        meta = {'zoom_x': self.zoom_x, 'zoom_y': self.zoom_y, 'sub_x': self.sub_x, 'sub_y': self.sub_y, 'out_size': list(self.out_size)}
+        for suffix, arr in [('map1', self.maps[0]), ('map2', self.maps[1])]:
+            tmp_filename = '{}.{}.{}.tmp.npy'.format(filename, suffix, os.getpid())
+            np.save(tmp_filename, arr)
+            os.replace(tmp_filename, '{}.{}.npy'.format(filename, suffix))
+        tmp_filename = '{}.{}.tmp.json'.format(filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_filename, filename + '.json')
+
+    @staticmethod
+    def exists(filename):
+        return os.path.exists(filename + '.json')
+
+    @staticmethod
+    def load(filename):
+        """Table saved with save(), with memory-mapped maps"""
+        table = RemapTable.__new__(RemapTable)
+        with open(filename + '.json') as f:
+            meta = json.load(f)
+        table.zoom_x, table.zoom_y, table.sub_x, table.sub_y = meta['zoom_x'], meta['zoom_y'], meta['sub_x'], meta['sub_y']
+        table.out_size = tuple(meta['out_size'])
+        table.maps = tuple(np.load('{}.{}.npy'.format(filename, suffix), mmap_mode='r') for suffix in ['map1', 'map2'])
+        return table
+
+    def __call__(self, img):
+        """Undistorted, cropped and resized copy of a demosaiced HxWx3 uint8 image"""
+        img = cv2.remap(img, self.maps[0], self.maps[1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if self.sub_x > 1 or self.sub_y > 1:
+            img = cv2.resize(img, self.out_size, interpolation=cv2.INTER_AREA)
+        return img
+
+def load_table(filename):
+    """RemapTable saved at filename, loaded once per process"""
+    if filename not in tables:
+        tables[filename] = RemapTable.load(filename)
+    return tables[filename]
@@ -12,13 +12,45 @@
 #
 ################################################################################
 
-import bisect
-import csv
+import os
 import numpy as np
-import numpy.matlib as ml
 from transform import *
 
 
+def read_pose_columns(path, columns, cache_name):
+    """Reads the timestamps (first column) and six pose columns of a csv file as arrays.
+
+    The parsed columns are cached next to the file ('{path}.{cache_name}.npz') and reused while the cache is newer than
+    the file, so reruns skip parsing.
+
+    Args:
+        path (str): path to the csv file (with a header row).
+        columns (list[int]): positions of the x, y, z, roll, pitch, yaw columns (negative positions count from the end).
+        cache_name (str): name of the cached columns.
+
+    Returns:
+        numpy.ndarray: N int64 timestamps
+        numpy.ndarray: Nx6 float64 xyzrpy values
+
+    """
+    cache_file = '{}.{}.npz'.format(path, cache_name)
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(path):
+        with np.load(cache_file) as cache:
+            return cache['timestamps'], cache['xyzrpy']
+
+    with open(path) as f:
+        num_columns = len(next(f).split(','))
+    columns = [c % num_columns for c in columns]
+    table = np.loadtxt(path, delimiter=',', skiprows=1, usecols=[0] + columns, ndmin=2)
+    timestamps = table[:, 0].astype(np.int64) #UNIX timestamps in microseconds are exact in float64
+    xyzrpy = table[:, 1:7]
+    try:
+        np.savez(cache_file, timestamps=timestamps, xyzrpy=xyzrpy)
+    except OSError: #read-only dataset directory
+        pass
+    return timestamps, xyzrpy
+
+
 def interpolate_vo_poses(vo_path, pose_timestamps, origin_timestamp):
     """Interpolate poses from visual odometry.
 
@@ -28,34 +60,25 @@ def interpolate_vo_poses(vo_path, pose_timestamps, origin_timestamp):
         origin_timestamp (int): UNIX timestamp of origin frame. Poses will be reported relative to this frame.
 
     Returns:
-        list[numpy.matrixlib.defmatrix.matrix]: SE3 matrix representing interpolated pose for each requested timestamp.
+        numpy.ndarray: Nx4x4 SE3 matrices representing interpolated pose for each requested timestamp.
 
     """
-    with open(vo_path) as vo_file:
-        vo_reader = csv.reader(vo_file)
-        headers = next(vo_file)
-
-        vo_timestamps = [0]
-        abs_poses = [ml.identity(4)]
-
-        lower_timestamp = min(min(pose_timestamps), origin_timestamp)
-        upper_timestamp = max(max(pose_timestamps), origin_timestamp)
+    timestamps, xyzrpy = read_pose_columns(vo_path, [2, 3, 4, 5, 6, 7], 'vo')
 
-        for row in vo_reader:
-            timestamp = int(row[0])
-            if timestamp < lower_timestamp:
-                vo_timestamps[0] = timestamp
-                continue
+    lower_timestamp = min(min(pose_timestamps), origin_timestamp)
+    upper_timestamp = max(max(pose_timestamps), origin_timestamp)
 
-            vo_timestamps.append(timestamp)
+    # Rows before lower_timestamp only set the timestamp of the identity pose the others are chained to; the rows up
+    # to (and including) the first one at upper_timestamp are used
+    below = timestamps < lower_timestamp
+    first_timestamp = timestamps[below][-1] if below.any() else 0
+    timestamps, xyzrpy = timestamps[~below], xyzrpy[~below]
+    past_upper = np.nonzero(timestamps >= upper_timestamp)[0]
+    if past_upper.shape[0] > 0:
+        timestamps, xyzrpy = timestamps[0:past_upper[0] + 1], xyzrpy[0:past_upper[0] + 1]
 
-            xyzrpy = [float(v) for v in row[2:8]]
-            rel_pose = build_se3_transform(xyzrpy)
-            abs_pose = abs_poses[-1] * rel_pose
-            abs_poses.append(abs_pose)
-
-            if timestamp >= upper_timestamp:
-                break
+    vo_timestamps = np.concatenate(([first_timestamp], timestamps))
+    abs_poses = se3_cumprod(np.concatenate((np.eye(4)[None], build_se3_transforms(xyzrpy))))
 
     return interpolate_poses(vo_timestamps, abs_poses, pose_timestamps, origin_timestamp)
 
@@ -69,33 +92,18 @@ def interpolate_ins_poses(ins_path, pose_timestamps, origin_timestamp, use_rtk=F
         origin_timestamp (int): UNIX timestamp of origin frame. Poses will be reported relative to this frame.
 
     Returns:
-        list[numpy.matrixlib.defmatrix.matrix]: SE3 matrix representing interpolated pose for each requested timestamp.
+        numpy.ndarray: Nx4x4 SE3 matrices representing interpolated pose for each requested timestamp.
 
     """
-    with open(ins_path) as ins_file:
-        ins_reader = csv.reader(ins_file)
-        headers = next(ins_file)
-
-        ins_timestamps = [0]
-        abs_poses = [ml.identity(4)]
-
-        upper_timestamp = max(max(pose_timestamps), origin_timestamp)
+    columns = [5, 6, 7, -3, -2, -1] if not use_rtk else [4, 5, 6, 11, 12, 13]
+    ins_timestamps, xyzrpy = read_pose_columns(ins_path, columns, 'rtk' if use_rtk else 'ins')
 
-        for row in ins_reader:
-            timestamp = int(row[0])
-            ins_timestamps.append(timestamp)
+    upper_timestamp = max(max(pose_timestamps), origin_timestamp)
+    past_upper = np.nonzero(ins_timestamps >= upper_timestamp)[0]
+    if past_upper.shape[0] > 0:
+        ins_timestamps, xyzrpy = ins_timestamps[0:past_upper[0] + 1], xyzrpy[0:past_upper[0] + 1]
 
-            utm = row[5:8] if not use_rtk else row[4:7]
-            rpy = row[-3:] if not use_rtk else row[11:14]
-            xyzrpy = [float(v) for v in utm] + [float(v) for v in rpy]
-            abs_pose = build_se3_transform(xyzrpy)
-            abs_poses.append(abs_pose)
-
-            if timestamp >= upper_timestamp:
-                break
-
-    ins_timestamps = ins_timestamps[1:]
-    abs_poses = abs_poses[1:]
+    abs_poses = build_se3_transforms(xyzrpy)
 
     return interpolate_poses(ins_timestamps, abs_poses, pose_timestamps, origin_timestamp)
 
@@ -105,12 +113,12 @@ def interpolate_poses(pose_timestamps, abs_poses, requested_timestamps, origin_t
 
     Args:
         pose_timestamps (list[int]): Timestamps of supplied poses. Must be in ascending order.
-        abs_poses (list[numpy.matrixlib.defmatrix.matrix]): SE3 matrices representing poses at the timestamps specified.
+        abs_poses (numpy.ndarray): Nx4x4 SE3 matrices representing poses at the timestamps specified.
         requested_timestamps (list[int]): Timestamps for which interpolated timestamps are required.
         origin_timestamp (int): UNIX timestamp of origin frame. Poses will be reported relative to this frame.
 
     Returns:
-        list[numpy.matrixlib.defmatrix.matrix]: SE3 matrix representing interpolated pose for each requested timestamp.
+        numpy.ndarray: (1+M)x4x4 SE3 matrices representing interpolated pose for the origin and each requested timestamp.
 
     Raises:
         ValueError: if pose_timestamps and abs_poses are not the same length
@@ -120,28 +128,20 @@ def interpolate_poses(pose_timestamps, abs_poses, requested_timestamps, origin_t
     requested_timestamps.insert(0, origin_timestamp)
     requested_timestamps = np.array(requested_timestamps)
     pose_timestamps = np.array(pose_timestamps)
-
+    abs_poses = np.asarray(abs_poses, dtype=np.float64).reshape((-1, 4, 4))
 
     if len(pose_timestamps) != len(abs_poses):
         raise ValueError('Must supply same number of timestamps as poses')
+    if np.any(pose_timestamps[1:] <= pose_timestamps[:-1]):
+        raise ValueError('Pose timestamps must be in ascending order')
 
-    abs_quaternions = np.zeros((4, len(abs_poses)))
-    abs_positions = np.zeros((3, len(abs_poses)))
-    for i, pose in enumerate(abs_poses):
-        if i > 0 and pose_timestamps[i-1] >= pose_timestamps[i]:
-            raise ValueError('Pose timestamps must be in ascending order')
-
-        abs_quaternions[:, i] = so3_to_quaternion(pose[0:3, 0:3])
-        abs_positions[:, i] = np.ravel(pose[0:3, 3])
+    abs_quaternions = so3_to_quaternions(abs_poses[:, 0:3, 0:3]).T
+    abs_positions = abs_poses[:, 0:3, 3].T
 
-    upper_indices = [bisect.bisect(pose_timestamps, pt) for pt in requested_timestamps]
-    lower_indices = [u - 1 for u in upper_indices]
+    upper_indices = np.searchsorted(pose_timestamps, requested_timestamps, side='right')
+    lower_indices = upper_indices - 1
+    upper_indices = np.minimum(upper_indices, len(pose_timestamps) - 1)
 
-    if max(upper_indices) >= len(pose_timestamps):
-        upper_indices = [min(i, len(pose_timestamps) - 1) for i in upper_indices]
-
-    # fractions = (requested_timestamps - pose_timestamps[lower_indices]) // \
-    #             (pose_timestamps[upper_indices] - pose_timestamps[lower_indices])
     fractions = (requested_timestamps - pose_timestamps[lower_indices]) / \
                 (pose_timestamps[upper_indices] - pose_timestamps[lower_indices])
 
@@ -169,45 +169,20 @@ def interpolate_poses(pose_timestamps, abs_poses, requested_timestamps, origin_t
     negative_d_indices = np.nonzero(d_array < 0)
     scale1_array[negative_d_indices] = -scale1_array[negative_d_indices]
 
-    quaternions_interp = np.tile(scale0_array, (4, 1)) * quaternions_lower \
-                         + np.tile(scale1_array, (4, 1)) * quaternions_upper
-
-    positions_lower = abs_positions[:, lower_indices]
-    positions_upper = abs_positions[:, upper_indices]
-
-    positions_interp = np.multiply(np.tile((1 - fractions), (3, 1)), positions_lower) \
-                       + np.multiply(np.tile(fractions, (3, 1)), positions_upper)
-
-    poses_mat = ml.zeros((4, 4 * len(requested_timestamps)))
-
-    poses_mat[0, 0::4] = 1 - 2 * np.square(quaternions_interp[2, :]) - \
-                         2 * np.square(quaternions_interp[3, :])
-    poses_mat[0, 1::4] = 2 * np.multiply(quaternions_interp[1, :], quaternions_interp[2, :]) - \
-                         2 * np.multiply(quaternions_interp[3, :], quaternions_interp[0, :])
-    poses_mat[0, 2::4] = 2 * np.multiply(quaternions_interp[1, :], quaternions_interp[3, :]) + \
-                         2 * np.multiply(quaternions_interp[2, :], quaternions_interp[0, :])
-
-    poses_mat[1, 0::4] = 2 * np.multiply(quaternions_interp[1, :], quaternions_interp[2, :]) \
-                         + 2 * np.multiply(quaternions_interp[3, :], quaternions_interp[0, :])
-    poses_mat[1, 1::4] = 1 - 2 * np.square(quaternions_interp[1, :]) \
-                         - 2 * np.square(quaternions_interp[3, :])
-    poses_mat[1, 2::4] = 2 * np.multiply(quaternions_interp[2, :], quaternions_interp[3, :]) - \
-                         2 * np.multiply(quaternions_interp[1, :], quaternions_interp[0, :])
-
-    poses_mat[2, 0::4] = 2 * np.multiply(quaternions_interp[1, :], quaternions_interp[3, :]) - \
-                         2 * np.multiply(quaternions_interp[2, :], quaternions_interp[0, :])
-    poses_mat[2, 1::4] = 2 * np.multiply(quaternions_interp[2, :], quaternions_interp[3, :]) + \
-                         2 * np.multiply(quaternions_interp[1, :], quaternions_interp[0, :])
-    poses_mat[2, 2::4] = 1 - 2 * np.square(quaternions_interp[1, :]) - \
-                         2 * np.square(quaternions_interp[2, :])
-
-    poses_mat[0:3, 3::4] = positions_interp
-    poses_mat[3, 3::4] = 1
-    
-    poses_mat = np.linalg.solve(poses_mat[0:4, 0:4], poses_mat)
-
-    poses_out = [0] * (len(requested_timestamps))
-    for i in range(0, len(requested_timestamps)):
-        poses_out[i] = poses_mat[0:4, i * 4:(i + 1) * 4]
-
-    return poses_out
\ No newline at end of file
+    w, x, y, z = scale0_array * quaternions_lower + scale1_array * quaternions_upper
+    positions_interp = (1 - fractions) * abs_positions[:, lower_indices] + fractions * abs_positions[:, upper_indices]
+
+    poses = np.zeros((len(requested_timestamps), 4, 4))
+    poses[:, 0, 0] = 1 - 2 * np.square(y) - 2 * np.square(z)
+    poses[:, 0, 1] = 2 * x * y - 2 * z * w
+    poses[:, 0, 2] = 2 * x * z + 2 * y * w
+    poses[:, 1, 0] = 2 * x * y + 2 * z * w
+    poses[:, 1, 1] = 1 - 2 * np.square(x) - 2 * np.square(z)
+    poses[:, 1, 2] = 2 * y * z - 2 * x * w
+    poses[:, 2, 0] = 2 * x * z - 2 * y * w
+    poses[:, 2, 1] = 2 * y * z + 2 * x * w
+    poses[:, 2, 2] = 1 - 2 * np.square(x) - 2 * np.square(y)
+    poses[:, 0:3, 3] = positions_interp.T
+    poses[:, 3, 3] = 1
+
+    return np.linalg.solve(poses[0:1], poses)
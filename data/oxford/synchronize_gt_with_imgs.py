@@ -1,5 +1,4 @@
 import numpy as np
-from liegroups.numpy import SO3, SE3
 from collections import namedtuple
 from PIL import Image
 import scipy.io as sio
@@ -9,7 +8,10 @@ import glob
 import numpy as np
 import pandas as pd
 from interpolate_poses import interpolate_ins_poses, interpolate_vo_poses
-from transform import se3_to_components
+from transform import se3_to_components, se3_cumprod
+import sys
+sys.path.insert(0,'../..')
+from utils.lie_algebra_np import rpy_to_so3, se3_inv, se3_log, se3_exp, se3_normalize
 
 '''
 This script processes ground truth poses for the oxford robotcar dataset
@@ -83,32 +85,25 @@ for seq in seq_names:
     plt.figure()
     
     ''' GT '''   
-    C_c_imu = SO3(np.array([[1,0,0],[0,0,1],[0,1,0]]))
-    gt_traj=[np.array([[ 1, 0,  0,  0], \
+    C_c_imu = np.array([[1,0,0],[0,0,1],[0,1,0]])
+    gt_T_0 = np.array([[ 1, 0,  0,  0], \
                       [0, 0,  1,  0], \
                       [0, -1, 0,  0],  \
-                      [ 0.,          0.,          0.,          1.        ]])]
-    gt_T_w_c_list = []
-    for i in range(0, r_w_imu_w.shape[0]):
-        C_imu_w = SO3.from_rpy(rpy_w_imu_w[i,0], rpy_w_imu_w[i,1], rpy_w_imu_w[i,2]).inv()
-        C_c_w = C_c_imu.dot(C_imu_w)
-        C_w_c = SO3(np.copy(C_c_w.inv().as_matrix()))
-        
-        T_w_c = SE3(C_w_c, r_w_imu_w[i])
-        gt_T_w_c_list.append(T_w_c)
-    
-    gt_pose_vec_list, gt_dT_list = [], []    
-    for i in range(0,len(gt_T_w_c_list)-1):
-        T_12 = (gt_T_w_c_list[i].inv().dot(gt_T_w_c_list[i+1]))
-        gt_pose_vec = T_12.log()
-        gt_pose_vec_list.append(gt_pose_vec)
-        gt_dT_list.append(SE3.exp(gt_pose_vec).as_matrix())
+                      [ 0.,          0.,          0.,          1.        ]])
+
+        ### camera poses of all frames: C_w_c = (C_c_imu C_imu_w)^-1 with C_imu_w = C(rpy)^-1
+    gt_T_w_c = np.zeros((r_w_imu_w.shape[0],4,4))
+    gt_T_w_c[:,0:3,0:3] = rpy_to_so3(rpy_w_imu_w) @ C_c_imu.T
+    gt_T_w_c[:,0:3,3] = r_w_imu_w
+    gt_T_w_c[:,3,3] = 1
+
+        ### relative motion of consecutive frames (through the lie algebra, as SE3.exp(T_12.log()))
+    gt_T_12 = se3_inv(gt_T_w_c[:-1]) @ gt_T_w_c[1:]
+    gt_dT = se3_exp(se3_log(gt_T_12))
 
-        
-    for i in range(0, len(gt_dT_list)):
-        dT = SE3.from_matrix(gt_dT_list[i],normalize=True).inv()
-        new_est = SE3.as_matrix(SE3.from_matrix(gt_traj[-1],normalize=True).dot(dT))
-        gt_traj.append(new_est)
+        ### re-integrate: T_k+1 = T_k dT_k^-1
+    gt_traj = se3_cumprod(np.concatenate((gt_T_0[None], se3_inv(se3_normalize(gt_dT))), 0))
+    gt_traj = se3_normalize(gt_traj)
     
 
     est_traj = np.array(gt_traj) #use gt as placeholder because vo isn't set up correctly
@@ -41,6 +41,54 @@ def build_se3_transform(xyzrpy):
     return se3
 
 
+def build_se3_transforms(xyzrpy):
+    """Creates Nx4x4 SE3 transforms from N translations and Euler angles (batched build_se3_transform).
+
+    Args:
+        xyzrpy (numpy.ndarray): Nx6 translations and Euler angles.
+
+    Returns:
+        numpy.ndarray: Nx4x4 SE3 homogeneous transformation matrices
+
+    """
+    xyzrpy = np.asarray(xyzrpy, dtype=np.float64).reshape((-1, 6))
+    cr, sr = np.cos(xyzrpy[:, 3]), np.sin(xyzrpy[:, 3])
+    cp, sp = np.cos(xyzrpy[:, 4]), np.sin(xyzrpy[:, 4])
+    cy, sy = np.cos(xyzrpy[:, 5]), np.sin(xyzrpy[:, 5])
+
+    se3 = np.zeros((xyzrpy.shape[0], 4, 4))
+    se3[:, 0, 0] = cy * cp
+    se3[:, 0, 1] = cy * sp * sr - sy * cr
+    se3[:, 0, 2] = cy * sp * cr + sy * sr
+    se3[:, 1, 0] = sy * cp
+    se3[:, 1, 1] = sy * sp * sr + cy * cr
+    se3[:, 1, 2] = sy * sp * cr - cy * sr
+    se3[:, 2, 0] = -sp
+    se3[:, 2, 1] = cp * sr
+    se3[:, 2, 2] = cp * cr
+    se3[:, 0:3, 3] = xyzrpy[:, 0:3]
+    se3[:, 3, 3] = 1
+    return se3
+
+
+def se3_cumprod(se3):
+    """Cumulative products T_0, T_0 T_1, T_0 T_1 T_2, ... of Nx4x4 transforms, in log2(N) batched matrix products.
+
+    Args:
+        se3 (numpy.ndarray): Nx4x4 transforms
+
+    Returns:
+        numpy.ndarray: Nx4x4 cumulative products
+
+    """
+    prod = np.array(se3, dtype=np.float64)
+    shift = 1
+    while shift < prod.shape[0]:
+        prod[shift:] = prod[:-shift] @ prod[shift:]
+        shift *= 2
+    return prod
+
+
 def euler_to_so3(rpy):
     """Converts Euler angles to an SO3 rotation matrix.
 
@@ -161,6 +209,36 @@ def so3_to_quaternion(so3):
     return np.array([w, x, y, z])
 
 
+def so3_to_quaternions(so3):
+    """Converts Nx3x3 SO3 rotation matrices to quaternions (batched so3_to_quaternion)
+
+    Args:
+        so3 (numpy.ndarray): Nx3x3 rotation matrices
+
+    Returns:
+        numpy.ndarray: Nx4 quaternions [w, x, y, z]
+
+    """
+    so3 = np.asarray(so3).reshape((-1, 3, 3))
+    R_xx, R_xy, R_xz = so3[:, 0, 0], so3[:, 0, 1], so3[:, 0, 2]
+    R_yx, R_yy, R_yz = so3[:, 1, 0], so3[:, 1, 1], so3[:, 1, 2]
+    R_zx, R_zy, R_zz = so3[:, 2, 0], so3[:, 2, 1], so3[:, 2, 2]
+
+    # As in so3_to_quaternion: non-real w is 0, and the other components are clipped to avoid negative roots
+    wxyz = np.sqrt(np.maximum(np.stack((R_xx + R_yy + R_zz + 1,
+                                        1 + R_xx - R_yy - R_zz,
+                                        1 + R_yy - R_xx - R_zz,
+                                        1 + R_zz - R_yy - R_xx), 1), 0)) / 2
+    max_index = np.argmax(wxyz, 1)
+    w, x, y, z = wxyz.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        candidates = [np.stack((w, (R_zy - R_yz) / (4 * w), (R_xz - R_zx) / (4 * w), (R_yx - R_xy) / (4 * w)), 1),
+                      np.stack(((R_zy - R_yz) / (4 * x), x, (R_xy + R_yx) / (4 * x), (R_zx + R_xz) / (4 * x)), 1),
+                      np.stack(((R_xz - R_zx) / (4 * y), (R_xy + R_yx) / (4 * y), y, (R_yz + R_zy) / (4 * y)), 1),
+                      np.stack(((R_yx - R_xy) / (4 * z), (R_zx + R_xz) / (4 * z), (R_yz + R_zy) / (4 * z), z), 1)]
+    return np.choose(max_index[:, None], candidates)
+
+
 def se3_to_components(se3):
     """Converts an SE3 rotation matrix to linear translation and Euler angles
 
@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+from data.archive_reader import read_file, is_archive_path, split_archive_path
+
+'''
+Manifest of the frames that create_kitti_odometry_data.py / create_oxford_data.py wrote to one output sequence
+('{sequence dir}/manifest.json'), so that reruns (after an interrupted run, or when sequences are added) only process
+new or changed frames.
+
+Every written frame has an entry {output path: {'source', 'size', 'mtime', 'params', ...}}: the source path and its
+size and modification time (of the archive, for archive members), the preprocessing parameters (resolution, crop,
+demosaic pattern, ...) and whatever the script needs to rebuild its .mat file without reprocessing the frame (e.g. the
+source image size, for the intrinsics).  A frame is reprocessed when its output is missing, its parameters changed, or
+its source changed.  With hash=True the sha1 of the sources is recorded too, and a source whose size or mtime changed
+but whose content did not (e.g. re-extracted or copied datasets) is not reprocessed.
+
+Each output sequence has its own manifest, so different sequences can be processed by concurrent runs (e.g. with
+--sequences).  The manifest is saved every save_every recorded frames and written atomically, so an interrupted run
+loses at most the frames recorded since the last save.
+'''
+
+def source_stat(source):
+    """(size, mtime) of a source file, or of the archive containing it"""
+    path = split_archive_path(source)[0] if is_archive_path(source) else source
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+def source_hash(source):
+    return hashlib.sha1(read_file(source)).hexdigest()
+
+class Manifest(object):
+    def __init__(self, seq_dir, hash=False, save_every=500):
+        self.filename = os.path.join(seq_dir, 'manifest.json')
+        self.hash = hash
+        self.save_every = save_every
+        self.unsaved = 0
+        self.entries = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.entries = json.load(f)
+
+    def up_to_date(self, output, source, params):
+        entry = self.entries.get(output)
+        if entry is None or entry['source'] != source or entry['params'] != json.loads(json.dumps(params)) or not os.path.exists(output):
+            return False
+        size, mtime = source_stat(source)
+        if (entry['size'], entry['mtime']) == (size, mtime):
+            return True
+        if self.hash and entry.get('hash') == source_hash(source): ## unchanged content, e.g. a re-extracted source
+            entry['size'], entry['mtime'] = size, mtime
+            self.unsaved += 1
+            return True
+        return False
+
+    def record(self, output, source, params, **info):
+        """Records a written frame (info: extra JSON-serializable values, available as self[output][key])"""
+        size, mtime = source_stat(source)
+        entry = {'source': source, 'size': size, 'mtime': mtime, 'params': json.loads(json.dumps(params))}
+        if self.hash:
+            entry['hash'] = source_hash(source)
+        entry.update(json.loads(json.dumps(info)))
+        self.entries[output] = entry
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.save()
+
+    def __getitem__(self, output):
+        return self.entries[output]
+
+    def save(self):
+        tmp_filename = '{}.{}.tmp'.format(self.filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_filename, self.filename)
+        self.unsaved = 0
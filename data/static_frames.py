@@ -0,0 +1,25 @@
+import numpy as np
+from utils.lie_algebra_np import se3_normalize, se3_inv, se3_log
+
+def remove_static_frames(poses, min_trans, min_rot):
+    """Indices of the frames of a trajectory that are kept after removing static frames.
+
+    Frames are paired with stride 2 ((0,1), (2,3), ...), and the first frame of each pair whose relative motion has
+    translation norm < min_trans and rotation norm < min_rot is removed; this repeats on the remaining frames until no
+    pair is static (the frame removal of the create_* scripts).  Each pass is a single batched SE(3) log over all pairs
+    and only updates an index array, so the per-frame fields are indexed once with the result.
+
+    Args:
+        poses: [N,4,4] poses (normalized like SE3.from_matrix(T, normalize=True))
+    Returns:
+        sorted indices of the kept frames
+    """
+    poses = se3_normalize(poses)
+    keep = np.arange(0, poses.shape[0])
+    while True:
+        first, second = keep[0:-1:2], keep[1::2]
+        motion = se3_log(se3_inv(poses[second]) @ poses[first])
+        static = (np.linalg.norm(motion[:,0:3], axis=1) < min_trans) & (np.linalg.norm(motion[:,3:6], axis=1) < min_rot)
+        if not static.any():
+            return keep
+        keep = np.delete(keep, 2*np.where(static)[0])
@@ -118,6 +118,14 @@ class Left_Right_Consist_Loss(torch.nn.Module):
         loss = (diff_img * valid_mask.expand_as(diff_img)).sum() / valid_mask.sum()
         return loss      
 
+def stereo_views(config):
+    """Window positions of the right-camera images that the active losses use (the loader only loads these).
+    Left_Right_Consist_Loss only reprojects the target image."""
+    views = []
+    if config.get('l_left_right_consist', False):
+        views.append(int(config['img_per_sample']/2))
+    return views
+
 class Compute_Loss(nn.modules.Module):
     def __init__(self, config, plane_model=None):
         super(Compute_Loss, self).__init__()
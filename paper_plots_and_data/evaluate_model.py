@@ -9,6 +9,8 @@ import validate
 from train_mono import compute_pose
 from plane_fitting import img_to_3d_torch, fit_plane_torch
 from utils.learning_helpers import save_obj, load_obj, disp_to_depth, data_and_model_loader
+from data.kitti_loader import batch_to_device
+from utils.dense_flow import batch_flow
 import os
 from validate import compute_trajectory as tt
 import glob
@@ -100,34 +102,26 @@ for seq in seq_list:
         
         with torch.no_grad():
             for k, data in enumerate(test_dset_loaders):
-                target_img, source_imgs, lie_alg, intrinsics, flow_imgs  = data
-                lie_alg = lie_alg['color']
-                target_img, source_imgs, intrinsics = target_img['color_left'], source_imgs['color_left'], intrinsics['color_left']
-                target_img = target_img.to(device)
+                data = batch_to_device(data, device)
+                imgs = data['imgs']['color_left'] #[B,S,3,H,W], target image first
+                target_img = imgs[:,0]
                 
-                source_img_list = []
-                gt_lie_alg_list = []
-                vo_lie_alg_list = []
+                source_img_list = list(imgs[:,1:].unbind(1))
+                gt_lie_alg_list = list(data['lie_alg']['gt'].cpu().unbind(1))
+                vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
                 pose_results = {'source1': {}, 'source2': {} }
-                flow_imgs_fwd_list, flow_imgs_back_list = [], []
-                for i, im, in enumerate(source_imgs):
-                    source_img_list.append(im.to(device))
-                    gt_lie_alg_list.append(lie_alg[i][0].type(torch.FloatTensor))
-                    vo_lie_alg_list.append(lie_alg[i][1].type(torch.FloatTensor).to(device))
 
-                if config['flow_type'] == 'classical':
-                    flow_imgs_fwd, flow_imgs_back = flow_imgs
-                    flow_imgs_fwd_list, flow_imgs_back_list = [], []
-                    for i in range(0, len(flow_imgs_fwd)):
-                        flow_imgs_fwd_list.append(flow_imgs_fwd[i].to(device))
-                        flow_imgs_back_list.append(flow_imgs_back[i].to(device))
+                if config['flow_type'] == 'device': ## dense flow of the un-jittered images, computed on the device
+                    data['flow'] = batch_flow(data['imgs']['color_left'])
+                if config['flow_type'] in ['classical', 'cached', 'device']:
+                    flow_imgs_fwd_list, flow_imgs_back_list = list(data['flow']['fwd'].unbind(1)), list(data['flow']['back'].unbind(1))
                     flow_imgs = [flow_imgs_fwd_list, flow_imgs_back_list]
                 else:
                     flow_imgs = [[None for i in range(0,len(source_img_list))] for i in range(0,2)] #annoying but necessary
                     flow_imgs_fwd_list = [None for i in range(0,len(source_img_list))]
                     flow_imgs_back_list = [None for i in range(0,len(source_img_list))]
 
-                intrinsics = intrinsics.type(torch.FloatTensor).to(device)[:,0,:,:] #only need one matrix since it's constant across the training sample
+                intrinsics = data['intrinsics']['color_left'] #only need one matrix since it's constant across the training sample
                 disparity = depth_model(target_img)
                 disp = disparity[0]
                 _,depth = disp_to_depth(disp, config['min_depth'], config['max_depth'])
@@ -1,7 +1,10 @@
 import torch
 import sys
 sys.path.insert(0,'..')
-from data.kitti_loader import KittiLoaderPytorch
+from data.kitti_loader import KittiLoaderPytorch, img_resolutions
+from data.frame_cache import SharedFrameCache
+from data.motion_sampler import MotionSampler
+from data.loader_pool import LoaderPool
 from train_mono import Trainer
 from validate import test_depth_and_reconstruction, test_trajectory
 from utils.learning_helpers import *
@@ -23,11 +26,13 @@ parser = argparse.ArgumentParser(description='training arguments.')
 '''System Options'''
 parser.add_argument('--estimator', type=str, default='libviso2') #libviso2 or orbslam
 parser.add_argument('--estimator_type', type=str, default='mono') #mono or stereo
-parser.add_argument('--flow_type', type=str, default='classical', help='classical, or none')
+parser.add_argument('--flow_type', type=str, default='classical', help='classical, cached (precomputed with data/create_flow_cache.py), device (Lucas-Kanade on the training device, see data/compare_flow.py), or none')
 parser.add_argument('--load_stereo', action='store_true', default=False)
 parser.add_argument('--stereo_baseline', type=float, default=0.52)
 parser.add_argument('--num_scales', type=int, default=3)
 parser.add_argument('--img_resolution', type=str, default='med') # low (128x445) med (192 x640) or high (256 x 832) 
+parser.add_argument('--source_resolution', type=str, default=None, help='stored copy to decode frames from (e.g. full or high), rescaled to --img_resolution on load (default: the --img_resolution copy)')
+parser.add_argument('--resolution_schedule', nargs='+', type=str, default=None, help='progressive resolution as epoch:resolution pairs, e.g. 0:low 6:med 12:high (frames are decoded from --source_resolution, or the last resolution of the schedule)')
 parser.add_argument('--img_per_sample', type=int, default=3) #1 target image, and rest are source images 
 parser.add_argument('--pose_output_type', type=str, default='translation') # 'translation' or 'pose' (6-dof)
 parser.add_argument('--dpc', action='store_true', default=False) # apply dpc to rotations if true, otherwise learn full pose change - only works if pose_output_type is pose
@@ -39,6 +44,17 @@ parser.add_argument('--train_seq', nargs='+', type=str, default=['00'])
 parser.add_argument('--val_seq', nargs='+',type=str, default=['00'])
 parser.add_argument('--test_seq', nargs='+', type=str, default=['00'])
 parser.add_argument('--augment_motion', action='store_true', default=False)
+parser.add_argument('--frame_strides', nargs='+', type=int, default=[1,2], help='frame strides drawn for each training window with --augment_motion')
+parser.add_argument('--frame_stride_weights', nargs='+', type=float, default=None, help='relative probability of each frame stride (default: uniform)')
+parser.add_argument('--motion_sampling', action='store_true', default=False, help='draw training windows by camera motion (see data/motion_sampler.py)')
+parser.add_argument('--static_weight', type=float, default=0, help='sampling weight of near-static training windows relative to moving ones (0 skips them)')
+parser.add_argument('--epoch_fraction', type=float, default=1.0, help='fraction of the (non-skipped) training windows drawn each epoch with --motion_sampling')
+parser.add_argument('--num_workers', type=int, default=8, help='loader worker processes, shared by the train, val and test splits')
+parser.add_argument('--prefetch_factor', type=int, default=2, help='batches loaded in advance by each loader worker')
+parser.add_argument('--frame_store', action='store_true', default=False, help='read frames from the packed arrays written by data/create_frame_store.py')
+parser.add_argument('--archive_cache_mb', type=float, default=0, help='per-process cache of recently read archive members, when the frame paths are zip/tar members (data/archive_reader.py)')
+parser.add_argument('--frame_cache_gb', type=float, default=0, help='size of the decoded-frame cache shared by all loader workers (0 disables it)')
+parser.add_argument('--batch_augment', action='store_true', default=False, help='loader workers emit uint8 images and float16 flow; jitter and flip run on the training device')
 parser.add_argument('--wd', type=float, default=0)
 parser.add_argument('--lr', type=float, default=9e-4)
 parser.add_argument('--num_epochs', type=int, default=20)
@@ -90,19 +106,45 @@ for k in args.__dict__:
     config[k] = args.__dict__[k]
 print(config)
 print(args.train_seq, args.test_seq, args.val_seq)
-args.data_dir = '{}/{}_res'.format(args.data_dir, config['img_resolution'])
-config['data_dir'] = '{}/{}_res'.format(config['data_dir'], config['img_resolution'])
-dsets = {x: KittiLoaderPytorch(config, [args.train_seq, args.val_seq, args.test_seq], mode=x, transform_img=get_data_transforms(config)[x], \
-                               augment=config['augment_motion'], skip=config['skip']) for x in ['train', 'val']}
-dset_loaders = {x: torch.utils.data.DataLoader(dsets[x], batch_size=config['minibatch'], shuffle=True, num_workers=8) for x in ['train', 'val']}
+resolution_schedule = None
+if config['resolution_schedule'] is not None: ## {first epoch: resolution}
+    resolution_schedule = dict(sorted((int(e), r) for e, r in (s.split(':') for s in config['resolution_schedule'])))
+    config['img_resolution'] = resolution_schedule[min(resolution_schedule)] #the datasets are built at the first resolution
+    if config['source_resolution'] is None:
+        config['source_resolution'] = resolution_schedule[max(resolution_schedule)]
+source_resolution = config['source_resolution'] or config['img_resolution']
+if source_resolution != config['img_resolution'] or resolution_schedule is not None:
+    config['img_size'] = img_resolutions[config['img_resolution']] #frames (and intrinsics) are rescaled from the stored copy
+args.data_dir = '{}/{}_res'.format(args.data_dir, source_resolution)
+config['data_dir'] = '{}/{}_res'.format(config['data_dir'], source_resolution)
+config['stereo_views'] = losses.stereo_views(config) #right-camera images to load with --load_stereo
+def split_dset(mode, sampled):
+    """Dataset of a split, with windows sampled like the training windows (motion augmentation and skip) if sampled"""
+    return KittiLoaderPytorch(config, [args.train_seq, args.val_seq, args.test_seq], mode=mode, transform_img=get_data_transforms(config)[mode], \
+                              augment=config['augment_motion'] and sampled, skip=config['skip'] if sampled else None)
 
-val_dset = KittiLoaderPytorch(config, [args.train_seq, args.val_seq, args.test_seq], mode='val', transform_img=get_data_transforms(config)['val'])
-val_dset_loaders = torch.utils.data.DataLoader(val_dset, batch_size=config['minibatch'], shuffle=False, num_workers=8)
+    ## the val loss is computed on shuffled val windows sampled like the training windows, the val and test evaluations on
+    ## every window, in order.  Both val splits share one dataset unless augmentation or skip changes its windows
+dsets = {'train': split_dset('train', True), 'val': split_dset('val', False), 'test': split_dset('test', False)}
+dsets['val_loss'] = split_dset('val', True) if config['augment_motion'] or (config['skip'] or 1) != 1 else dsets['val']
+samplers = {'train': torch.utils.data.RandomSampler(dsets['train']), 'val_loss': torch.utils.data.RandomSampler(dsets['val_loss'])}
+if config['motion_sampling']:
+    samplers['train'] = MotionSampler(dsets['train'], epoch_fraction=config['epoch_fraction'], static_weight=config['static_weight'])
 
-test_dset = KittiLoaderPytorch(config, [args.train_seq, args.val_seq, args.test_seq], mode='test', transform_img=get_data_transforms(config)['test'])
-test_dset_loaders = torch.utils.data.DataLoader(test_dset, batch_size=config['minibatch'], shuffle=False, num_workers=8)
+frame_cache = None
+if config['frame_cache_gb'] > 0: ## one decoded-frame cache, shared by the workers of all splits
+    frame_cache = SharedFrameCache(config['frame_cache_gb']*2**30, dsets['test'].frame_shape())
+    for d in dsets.values():
+        d.frame_cache = frame_cache
 
-eval_dsets = {'val': val_dset_loaders, 'test':test_dset_loaders}
+    ## one set of persistent workers serves every split (started on the first epoch)
+loader_pool = LoaderPool(dsets, config['minibatch'], samplers=samplers, num_workers=config['num_workers'], prefetch_factor=config['prefetch_factor'])
+dset_loaders = {'train': loader_pool['train'], 'val': loader_pool['val_loss']}
+eval_dsets = {'val': loader_pool['val'], 'test': loader_pool['test']}
+
+def scheduled_resolution(epoch):
+    """Resolution of the last --resolution_schedule entry that starts at or before epoch"""
+    return resolution_schedule[max([e for e in resolution_schedule if e <= epoch] or [min(resolution_schedule)])]
 
 def main():
     results = {}
@@ -172,9 +214,18 @@ def main():
 
         optimizer = exp_lr_scheduler(optimizer, epoch, lr_decay_epoch=config['lr_decay_epoch']) ## reduce learning rate as training progresses  
         print("Epoch {}".format(epoch))
+        if resolution_schedule is not None and scheduled_resolution(epoch) != config['img_resolution']:
+            config['img_resolution'] = scheduled_resolution(epoch)
+            config['img_size'] = img_resolutions[config['img_resolution']]
+            print('Image resolution: {} {}'.format(config['img_resolution'], config['img_size']))
+            for d in dsets.values():
+                d.set_img_size(config['img_size'])
+            loader_pool.restart() #the persistent workers hold copies of the datasets
         train_losses = trainer.forward(dset_loaders['train'], epoch, 'train')
         with torch.no_grad():
             val_losses = trainer.forward(dset_loaders['val'], epoch, 'val')    
+        if frame_cache is not None:
+            print('frame cache: {}'.format(frame_cache.stats()))
 #        
         if epoch == 0 or (epoch == 1 and (config['load_pretrained_pose'] == True) ):
             val_writer = SummaryWriter(comment="tw-val-{}-test_seq-{}_val".format(args.val_seq[0], args.test_seq[0]))
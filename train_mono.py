@@ -5,6 +5,8 @@ import torch
 from utils.learning_helpers import *
 from utils.lie_algebra import se3_log_exp
 from models.stn import *
+from data.kitti_loader import batch_to_device
+from utils.dense_flow import batch_flow
 
 def apply_dpc(corr, vo_lie_alg, dpc, mode, epoch=25):
     vo = vo_lie_alg.clone()
@@ -29,6 +31,7 @@ class Trainer():
         self.depth_model = models[0]
         self.pose_model = models[1]
         self.optimizer = optimizer
+        self.batch_transforms = get_batch_transforms(config) if config.get('batch_augment', False) else None #uint8 batches are augmented on the device
         self.loss = loss
         self.mode = self.config['pose_output_type']
         self.dpc = self.config['dpc']
@@ -49,32 +52,27 @@ class Trainer():
         running_loss = None         
             # Iterate over data.
         for batch_num, data in enumerate(dset):
-            target_img, source_imgs, lie_alg, intrinsics, flow_imgs = data
-            target_img_aug = target_img['color_aug_left'].to(dev)
-            lie_alg = lie_alg['color_aug']
-
-            source_img_list = []
-            source_img_aug_list = []
-            gt_lie_alg_list = []
-            vo_lie_alg_list = []
-            for i, im, in enumerate(source_imgs['color_aug_left']):
-                source_img_aug_list.append(im.to(dev))
-                source_img_list.append(source_imgs['color_left'][i].to(dev))
-                gt_lie_alg_list.append(lie_alg[i][0].type(torch.FloatTensor).to(dev))
-                vo_lie_alg_list.append(lie_alg[i][1].type(torch.FloatTensor).to(dev))
+            data = batch_to_device(data, dev)
+            if self.batch_transforms is not None:
+                data = self.batch_transforms[phase](data)
+            imgs, imgs_aug = data['imgs']['color_left'], data['imgs']['color_aug_left'] #[B,S,3,H,W], target image first
+            target_img = {c: im[:,0] for c, im in data['imgs'].items()}
+            target_img_aug = imgs_aug[:,0]
+
+            source_img_list = list(imgs[:,1:].unbind(1))
+            source_img_aug_list = list(imgs_aug[:,1:].unbind(1))
+            gt_lie_alg_list = list(data['lie_alg']['gt'].unbind(1))
+            vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
     
-            if self.config['flow_type'] == 'classical':
-                flow_imgs_fwd, flow_imgs_back = flow_imgs
-                flow_imgs_fwd_list, flow_imgs_back_list = [], []
-                for i in range(0, len(flow_imgs_fwd)):
-                    flow_imgs_fwd_list.append(flow_imgs_fwd[i].to(dev))
-                    flow_imgs_back_list.append(flow_imgs_back[i].to(dev))
-                flow_imgs = [flow_imgs_fwd_list, flow_imgs_back_list]
+            if self.config['flow_type'] == 'device': ## dense flow of the un-jittered images, computed on the device
+                data['flow'] = batch_flow(data['imgs']['color_left'])
+            if self.config['flow_type'] in ['classical', 'cached', 'device']:
+                flow_imgs = [list(data['flow']['fwd'].unbind(1)), list(data['flow']['back'].unbind(1))]
             else:
                 flow_imgs = [[None for i in range(0,len(source_img_list))] for i in range(0,2)] #annoying but necessary
 
-            intrinsics_aug = intrinsics['color_aug_left'].type(torch.FloatTensor).to(dev)[:,0,:,:] #only need one matrix since it's constant across the training sample
-            intrinsics = intrinsics['color_left'].type(torch.FloatTensor).to(dev)[:,0,:,:]
+            intrinsics_aug = data['intrinsics']['color_left'] #only need one matrix since it's constant across the training sample
+            intrinsics = data['intrinsics']['color_left']
 
             pose = []
 
@@ -4,6 +4,7 @@ import sys
 sys.path.insert(0,'..')
 from utils.learning_helpers import *
 from utils.learning_helpers import disp_to_depth
+from data.kitti_loader import batch_to_device
 
 class Plain_Trainer():
     def __init__(self, config, device, models, optimizer):
@@ -12,6 +13,7 @@ class Plain_Trainer():
         self.depth_model = models[0]
         self.plane_model = models[1]
         self.optimizer = optimizer
+        self.batch_transforms = get_batch_transforms(config) if config.get('batch_augment', False) else None #uint8 batches are augmented on the device
         
     def forward(self, dset, epoch, phase):
         dev = self.device
@@ -29,24 +31,20 @@ class Plain_Trainer():
         running_loss = 0.0           
             # Iterate over data.
         for data in dset:
-            target_img, source_imgs, lie_alg, intrinsics, _ = data
-            target_img_aug = target_img['color_aug_left'].to(dev)
-            lie_alg = lie_alg['color_aug']
+            data = batch_to_device(data, dev)
+            if self.batch_transforms is not None:
+                data = self.batch_transforms[phase](data)
+            imgs, imgs_aug = data['imgs']['color_left'], data['imgs']['color_aug_left'] #[B,S,3,H,W], target image first
+            target_img_aug = imgs_aug[:,0]
 
-            source_img_list = []
-            source_img_aug_list = []
-            gt_lie_alg_list = []
-            vo_lie_alg_list = []
-            dt_list = []
-            for i, im, in enumerate(source_imgs['color_aug_left']):
-                source_img_aug_list.append(im.to(dev))
-                source_img_list.append(source_imgs['color_left'][i].to(dev))
-                gt_lie_alg_list.append(lie_alg[i][0].type(torch.FloatTensor).to(dev))
-                vo_lie_alg_list.append(lie_alg[i][1].type(torch.FloatTensor).to(dev))
-                dt_list.append(lie_alg[i][3].type(torch.FloatTensor).to(dev).expand_as(vo_lie_alg_list[-1][:,0:3]))
+            source_img_list = list(imgs[:,1:].unbind(1))
+            source_img_aug_list = list(imgs_aug[:,1:].unbind(1))
+            gt_lie_alg_list = list(data['lie_alg']['gt'].unbind(1))
+            vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
+            dt_list = [dt.expand_as(vo[:,0:3]) for dt, vo in zip(data['lie_alg']['dt'].unbind(1), vo_lie_alg_list)]
 
-            intrinsics_aug = intrinsics['color_aug_left'].type(torch.FloatTensor).to(dev)[:,0,:,:] #only need one matrix since it's constant across the training sample
-            intrinsics = intrinsics['color_left'].type(torch.FloatTensor).to(dev)[:,0,:,:]
+            intrinsics_aug = data['intrinsics']['color_left'] #only need one matrix since it's constant across the training sample
+            intrinsics = data['intrinsics']['color_left']
 
             
             disparity = self.depth_model(target_img_aug, epoch=epoch)
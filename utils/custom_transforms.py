@@ -5,9 +5,12 @@ import random
 import torch.utils.data
 # from scipy.misc import imresize
 import torchvision.transforms.functional as F
+from PIL import Image
 
 def get_data_transforms(config):
                 ## specify transforms for data augmentation.  Only transform the training data and keep test and val data as-is
+    if config.get('batch_augment', False): ## workers only convert to uint8 tensors, augmentation is applied on the device (get_batch_transforms)
+        return {x: Compose([PILtoNumpy(), ArrayToTensor(uint8=True)]) for x in ['train', 'val', 'test']}
 
     data_transforms = {
         'train': Compose([
@@ -29,6 +32,15 @@ def get_data_transforms(config):
     }
     return data_transforms
 
+def get_batch_transforms(config):
+                ## device-side counterpart of get_data_transforms, for loaders built with --batch_augment
+    batch_transforms = {
+        'train': BatchAugment(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1, flip_prob=0.5),
+        'val': BatchAugment(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+        'test': BatchAugment(),
+    }
+    return batch_transforms
+
 class tofloatTensor(object): #transform that converts a numpy array to a FloatTensor
     def __init__(self):
         self.x=0
@@ -59,7 +71,10 @@ class Normalize(object):
         return images, intrinsics
 
 class ArrayToTensor(object):
-    """Converts a list of numpy.ndarray (H x W x C) along with a intrinsics matrix to a list of torch.FloatTensor of shape (C x H x W) with a intrinsics tensor."""
+    """Converts a list of numpy.ndarray (H x W x C) along with a intrinsics matrix to a list of torch.FloatTensor of shape (C x H x W) with a intrinsics tensor.
+    With uint8=True the images stay uint8 (C x H x W) tensors, to be converted on the training device by BatchAugment."""
+    def __init__(self, uint8=False):
+        self.uint8 = uint8
     def __call__(self, original, transformed):
         tensors = []
         tensors_transformed = []
@@ -70,16 +85,21 @@ class ArrayToTensor(object):
             else:
                 im = np.transpose(im, (2, 0, 1))
                 im_transformed = np.transpose(im_transformed, (2, 0, 1))
-            tensors.append(torch.from_numpy(im).float()/255)
-            tensors_transformed.append(torch.from_numpy(im_transformed).float()/255)
+            if self.uint8:
+                tensors.append(torch.from_numpy(im))
+                tensors_transformed.append(torch.from_numpy(im_transformed))
+            else:
+                tensors.append(torch.from_numpy(im).float()/255)
+                tensors_transformed.append(torch.from_numpy(im_transformed).float()/255)
         return (tensors, original[1], original[2]), (tensors_transformed, transformed[1], transformed[2])
     
 class PILtoNumpy(object):
+    """Converts PIL images to numpy arrays.  Images that already are arrays (e.g. from the packed frame store) are passed through without a copy."""
     def __call__(self, original, transformed):
         np_imgs, np_imgs_transformed = [], []
         for im, im_transformed in zip(original[0], transformed[0]):
-            np_imgs.append(np.array(im))
-            np_imgs_transformed.append(np.array(im_transformed))
+            np_imgs.append(im if isinstance(im, np.ndarray) else np.array(im))
+            np_imgs_transformed.append(im_transformed if isinstance(im_transformed, np.ndarray) else np.array(im_transformed))
 
         return (np_imgs, original[1], original[2]), (np_imgs_transformed, transformed[1], transformed[2])
     
@@ -95,8 +115,9 @@ class RandomJitter(object):
         saturation_factor = random.uniform(max(0, 1 - self.saturation), 1 + self.saturation)
         hue_factor = random.uniform(-self.hue, self.hue)
         if random.random() > 0.5:
+            imgs = [Image.fromarray(im) if isinstance(im, np.ndarray) else im for im in transformed[0]]
             output_imgs = [F.adjust_hue(F.adjust_saturation(F.adjust_contrast(F.adjust_brightness(im, \
-                brightness_factor), contrast_factor), saturation_factor), hue_factor) for im in transformed[0]]
+                brightness_factor), contrast_factor), saturation_factor), hue_factor) for im in imgs]
         else:
             output_imgs = transformed[0]
         return original, (output_imgs, transformed[1], transformed[2])    
@@ -152,6 +173,103 @@ class RandomHorizontalFlip(object):
         else:
             return original, transformed
 
+class BatchAugment(object):
+    """Device-side RandomJitter and RandomHorizontalFlip for collated batches of uint8 images and float16 flow (--batch_augment),
+    applied after the batch has been moved to the device (data.kitti_loader.batch_to_device).
+    Each sample gets its own flip and jitter factors (shared by all of its images), like the per-sample worker transforms,
+    and the 'color_aug' images are added so the batch has the same layout as one built with get_data_transforms."""
+    def __init__(self, brightness=0, contrast=0, saturation=0, hue=0, flip_prob=None):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.flip_prob = flip_prob
+
+    def __call__(self, batch):
+        cams = [c for c in ['color_left', 'color_right'] if c in batch['imgs']]
+        num_slots = [batch['imgs'][c].shape[1] for c in cams] #the right camera may only have some of the views
+        imgs = torch.cat([batch['imgs'][c] for c in cams], dim=1).float()/255 #[B, all views, C, H, W]
+        intrinsics = {c: batch['intrinsics'][c].clone() for c in cams}
+        lie_alg = dict(batch['lie_alg'])
+        device, batch_size = imgs.device, imgs.shape[0]
+
+        if self.flip_prob is not None:
+            flip = torch.rand(batch_size, device=device) <= self.flip_prob
+            imgs = torch.where(flip.view(-1,1,1,1,1), imgs.flip(-1), imgs)
+            w = imgs.shape[-1]
+            for c in cams:
+                intrinsics[c][:,0,2] = torch.where(flip, w - intrinsics[c][:,0,2], intrinsics[c][:,0,2])
+            sign = torch.ones((batch_size,1,6), device=device)
+            sign[flip,:,4:6] = -1 #yaw and roll
+            lie_alg['gt'], lie_alg['vo'] = lie_alg['gt']*sign, lie_alg['vo']*sign
+
+        imgs_aug = imgs
+        if self.brightness or self.contrast or self.saturation or self.hue:
+            imgs_aug = self.jitter(imgs, device)
+
+        out = dict(batch, imgs={}, intrinsics=intrinsics, lie_alg=lie_alg)
+        first = 0
+        for c, n in zip(cams, num_slots):
+            out['imgs'][c] = imgs[:,first:first+n]
+            out['imgs'][c.replace('color', 'color_aug')] = imgs_aug[:,first:first+n]
+            first += n
+        if 'flow' in batch:
+            out['flow'] = {k: f.float() for k, f in batch['flow'].items()}
+        return out
+
+    def jitter(self, imgs, device):
+        """Brightness, contrast, saturation and hue adjustment (in that order, as RandomJitter), applied to half of the samples"""
+        batch_size = imgs.shape[0]
+        def uniform(low, high):
+            return torch.empty((batch_size,1,1,1,1), device=device).uniform_(low, high)
+        brightness_factor = uniform(max(0, 1 - self.brightness), 1 + self.brightness)
+        contrast_factor = uniform(max(0, 1 - self.contrast), 1 + self.contrast)
+        saturation_factor = uniform(max(0, 1 - self.saturation), 1 + self.saturation)
+        hue_factor = uniform(-self.hue, self.hue)
+
+        out = blend(imgs, torch.zeros_like(imgs), brightness_factor)
+        out = blend(out, rgb_to_gray(out).mean(dim=(-3,-2,-1), keepdim=True), contrast_factor)
+        out = blend(out, rgb_to_gray(out), saturation_factor)
+        if self.hue:
+            hsv = rgb_to_hsv(out)
+            hsv[...,0,:,:] = (hsv[...,0,:,:] + hue_factor[...,0,:,:]) % 1.0
+            out = hsv_to_rgb(hsv)
+        apply = torch.rand((batch_size,1,1,1,1), device=device) > 0.5
+        return torch.where(apply, out, imgs)
+
+def blend(img1, img2, ratio):
+    return (ratio*img1 + (1.0 - ratio)*img2).clamp(0, 1)
+
+def rgb_to_gray(imgs):
+    """(..., 3, H, W) float images to (..., 1, H, W), with the same weights as PIL's 'L' conversion"""
+    return (0.299*imgs[...,0,:,:] + 0.587*imgs[...,1,:,:] + 0.114*imgs[...,2,:,:]).unsqueeze(-3)
+
+def rgb_to_hsv(imgs):
+    r, g, b = imgs.unbind(dim=-3)
+    maxc, minc = imgs.max(dim=-3)[0], imgs.min(dim=-3)[0]
+    equal = maxc == minc
+    cr = maxc - minc
+    ones = torch.ones_like(maxc)
+    s = cr / torch.where(equal, ones, maxc)
+    cr_divisor = torch.where(equal, ones, cr)
+    rc, gc, bc = (maxc - r) / cr_divisor, (maxc - g) / cr_divisor, (maxc - b) / cr_divisor
+    h = (maxc == r) * (bc - gc) + ((maxc == g) & (maxc != r)) * (2.0 + rc - bc) + ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod(h / 6.0 + 1.0, 1.0)
+    return torch.stack((h, s, maxc), dim=-3)
+
+def hsv_to_rgb(imgs):
+    h, s, v = imgs.unbind(dim=-3)
+    i = torch.floor(h * 6.0)
+    f = h * 6.0 - i
+    i = i.long() % 6
+    p = (v * (1.0 - s)).clamp(0, 1)
+    q = (v * (1.0 - s * f)).clamp(0, 1)
+    t = (v * (1.0 - s * (1.0 - f))).clamp(0, 1)
+    r = torch.stack((v, q, p, p, t, v), dim=-3).gather(-3, i.unsqueeze(-3))
+    g = torch.stack((t, v, v, q, p, p), dim=-3).gather(-3, i.unsqueeze(-3))
+    b = torch.stack((p, p, t, v, v, q), dim=-3).gather(-3, i.unsqueeze(-3))
+    return torch.cat((r, g, b), dim=-3)
+
 class RandomScaleCrop(object):
     """Randomly zooms images up to 15% and crop them to keep same size as before.
         TODO: check that target doesn't actually need to change based on the scaling/cropping"""
@@ -0,0 +1,74 @@
+import torch
+import torch.nn.functional as F
+from utils.custom_transforms import rgb_to_gray
+
+'''
+Dense optical flow computed with batched torch ops on the training device (--flow_type device), as a cheaper
+alternative to the Farneback flow that the loader workers compute on the CPU (--flow_type classical).
+data/compare_flow.py compares the two (throughput and accuracy).
+'''
+
+def image_gradients(img):
+    """Central-difference x and y gradients of [B,1,H,W] images (replicated borders)"""
+    padded = F.pad(img, (1,1,1,1), mode='replicate')
+    grad_x = 0.5*(padded[:,:,1:-1,2:] - padded[:,:,1:-1,:-2])
+    grad_y = 0.5*(padded[:,:,2:,1:-1] - padded[:,:,:-2,1:-1])
+    return grad_x, grad_y
+
+def warp(img, flow):
+    """Samples img at p + flow(p) (bilinear, border padding), i.e. warps img back to the frame the flow starts from"""
+    b, _, h, w = img.shape
+    y, x = torch.meshgrid(torch.arange(h, device=img.device, dtype=img.dtype), torch.arange(w, device=img.device, dtype=img.dtype), indexing='ij')
+    grid_x = 2*(x + flow[:,0])/max(w-1, 1) - 1
+    grid_y = 2*(y + flow[:,1])/max(h-1, 1) - 1
+    return F.grid_sample(img, torch.stack((grid_x, grid_y), dim=3), mode='bilinear', padding_mode='border', align_corners=True)
+
+def lucas_kanade_flow(img_1, img_2, num_levels=4, window=15, iterations=3, reg=1.0, smooth=5):
+    """Coarse-to-fine dense (windowed) Lucas-Kanade flow from img_1 to img_2.
+
+    Args:
+        img_1, img_2: [B,1,H,W] grayscale images in [0,255]
+        num_levels: pyramid levels (each halves the resolution; levels smaller than 8 pixels are not used)
+        window: side of the box window the flow constraints are summed over
+        iterations: warp-and-solve steps per level
+        reg: Tikhonov regularization of the 2x2 systems, which keeps the flow of textureless regions near the coarser estimate
+        smooth: side of the box filter applied to the flow after every step (without it, the iterations can diverge)
+    Returns:
+        [B,2,H,W] (x, y) flow in pixels, img_2(p + flow(p)) ~ img_1(p) (the Farneback convention)
+    """
+    pyramid = [(img_1, img_2)]
+    while len(pyramid) < num_levels and min(pyramid[-1][0].shape[2:]) >= 16:
+        pyramid.append(tuple(F.avg_pool2d(img, 2, ceil_mode=True) for img in pyramid[-1]))
+
+    flow = None
+    for level_1, level_2 in reversed(pyramid):
+        if flow is None:
+            flow = torch.zeros_like(level_1).repeat(1,2,1,1)
+        else: ## upsample the coarser estimate
+            scale = torch.tensor([level_1.shape[3]/flow.shape[3], level_1.shape[2]/flow.shape[2]], device=flow.device, dtype=flow.dtype)
+            flow = F.interpolate(flow, size=level_1.shape[2:], mode='bilinear', align_corners=False)*scale.view(1,2,1,1)
+        grad_x1, grad_y1 = image_gradients(level_1)
+        for _ in range(0,iterations):
+            warped = warp(level_2, flow)
+            grad_x2, grad_y2 = image_gradients(warped)
+            grad_x, grad_y = 0.5*(grad_x1 + grad_x2), 0.5*(grad_y1 + grad_y2)
+            diff = warped - level_1
+            a11, a12, a22, b1, b2 = F.avg_pool2d(torch.cat((grad_x*grad_x, grad_x*grad_y, grad_y*grad_y, grad_x*diff, grad_y*diff), 1), \
+                window, stride=1, padding=window//2, count_include_pad=False).unbind(1)
+            a11, a22 = a11 + reg, a22 + reg
+            det = a11*a22 - a12*a12
+            flow = flow - torch.stack(((a22*b1 - a12*b2)/det, (a11*b2 - a12*b1)/det), dim=1)
+            flow = F.avg_pool2d(flow, smooth, stride=1, padding=smooth//2, count_include_pad=False)
+    return flow
+
+def batch_flow(imgs, **kwargs):
+    """Flow between the target and every source image of a batch ([B,S,3,H,W] in [0,1], target first), in the layout the
+    loader produces: {'fwd': source to target flow, 'back': target to source flow}, each [B,S-1,2,H,W]"""
+    gray = 255*rgb_to_gray(imgs)
+    sources = gray[:,1:]
+    target = gray[:,0:1].expand_as(sources)
+    b, s = sources.shape[0:2]
+    from_imgs = torch.cat((sources, target), 1).flatten(0,1)
+    to_imgs = torch.cat((target, sources), 1).flatten(0,1)
+    flow = lucas_kanade_flow(from_imgs, to_imgs, **kwargs).view(b, 2*s, 2, imgs.shape[3], imgs.shape[4])
+    return {'fwd': flow[:,0:s], 'back': flow[:,s:]}
@@ -8,7 +8,7 @@ import pickle
 
 import sys
 sys.path.insert(0,'..')
-from data.kitti_loader import KittiLoaderPytorch
+from data.kitti_loader import KittiLoaderPytorch, collate_samples
 import models.depth_and_egomotion as models
 from utils.custom_transforms import *
 
@@ -120,8 +120,10 @@ def data_and_model_loader(config, pretrained_depth_path, pretrained_pose_path, s
     else:
         seq = [seq]
     device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    test_dset = KittiLoaderPytorch(config, [seq, seq, seq], mode='test', transform_img=get_data_transforms(config)['test'])
-    test_dset_loaders = torch.utils.data.DataLoader(test_dset, batch_size=config['minibatch'], shuffle=False, num_workers=6)
+    eval_config = dict(config, batch_augment=False) #the evaluation scripts use the float samples as they come out of the loader
+    test_dset = KittiLoaderPytorch(eval_config, [seq, seq, seq], mode='test', transform_img=get_data_transforms(eval_config)['test'])
+    test_dset_loaders = torch.utils.data.DataLoader(test_dset, batch_size=config['minibatch'], shuffle=False, num_workers=6, \
+        collate_fn=collate_samples, pin_memory=torch.cuda.is_available())
     eval_dsets = {'test': test_dset_loaders}
     
     if load_depth:
@@ -0,0 +1,165 @@
+import numpy as np
+
+### Batched numpy counterparts of the liegroups.numpy SO3/SE3 operations (same conventions: xi = [rho, phi]).
+### Every function takes a stack of N elements, so preprocessing and dataset construction avoid per-pose Python objects.
+
+def so3_wedge(phi):
+    #Returns Nx3x3 array with each 1x3 row vector in phi wedge'd
+    phi = np.asarray(phi).reshape((-1,3))
+    Phi = np.zeros((phi.shape[0], 3, 3), dtype=phi.dtype)
+
+    Phi[:, 0, 1] = -phi[:, 2]
+    Phi[:, 1, 0] = phi[:, 2]
+    Phi[:, 0, 2] = phi[:, 1]
+    Phi[:, 2, 0] = -phi[:, 1]
+    Phi[:, 1, 2] = -phi[:, 0]
+    Phi[:, 2, 1] = phi[:, 0]
+    return Phi
+
+def so3_vee(Phi):
+    #Returns Nx3 array with each 3x3 lie algebra element converted to a 1x3 coordinate vector
+    Phi = np.asarray(Phi).reshape((-1,3,3))
+    return np.stack((Phi[:, 2, 1], Phi[:, 0, 2], Phi[:, 1, 0]), axis=1)
+
+def batch_outer_prod(vecs):
+    #Input: NxD vectors
+    #Output: NxDxD outer products
+    return vecs[:, :, None]*vecs[:, None, :]
+
+def so3_normalize(R):
+    #Projects each Nx3x3 matrix onto SO(3) with an SVD (as SO3.normalize does)
+    U, _, V = np.linalg.svd(R)
+    S = np.tile(np.eye(3), (R.shape[0], 1, 1))
+    S[:, 2, 2] = np.linalg.det(U)*np.linalg.det(V)
+    return U @ S @ V
+
+def so3_log(R):
+    #input: R Nx3x3
+    #output: log(R) Nx3
+    R = np.asarray(R).reshape((-1,3,3))
+    # The cosine of the rotation angle is related to the trace of C, clipped to avoid nan's from rounding errors
+    cos_angles = np.clip(0.5*np.trace(R, axis1=1, axis2=2) - 0.5, -1., 1.)
+    angles = np.arccos(cos_angles)
+    small = np.isclose(angles, 0.)
+
+    # If angle is close to zero, use first-order Taylor expansion
+    phi = so3_vee(R - np.eye(3))
+    sin_angles = np.sin(angles[~small])
+    phi[~small] = so3_vee((0.5*angles[~small]/sin_angles).reshape((-1,1,1))*(R[~small] - R[~small].transpose(0,2,1)))
+    return phi
+
+def so3_exp(phi):
+    #input: phi Nx3
+    #output: exp(phi) Nx3x3
+    phi = np.asarray(phi).reshape((-1,3))
+    angles = np.linalg.norm(phi, axis=1)
+    small = np.isclose(angles, 0.)
+
+    # If angle is close to zero, use first-order Taylor expansion
+    R = np.eye(3) + so3_wedge(phi)
+    axes = phi[~small]/angles[~small].reshape((-1,1))
+    s = np.sin(angles[~small]).reshape((-1,1,1))
+    c = np.cos(angles[~small]).reshape((-1,1,1))
+    R[~small] = c*np.eye(3) + (1. - c)*batch_outer_prod(axes) + s*so3_wedge(axes)
+    return R
+
+def so3_left_jacobian(phi):
+    phi = np.asarray(phi).reshape((-1,3))
+    angles = np.linalg.norm(phi, axis=1)
+    small = np.isclose(angles, 0.)
+
+    J = np.eye(3) + 0.5*so3_wedge(phi)
+    angle = angles[~small].reshape((-1,1,1))
+    axes = phi[~small]/angles[~small].reshape((-1,1))
+    s = np.sin(angle)
+    c = np.cos(angle)
+    J[~small] = (s/angle)*np.eye(3) + (1. - s/angle)*batch_outer_prod(axes) + ((1. - c)/angle)*so3_wedge(axes)
+    return J
+
+def so3_inv_left_jacobian(phi):
+    phi = np.asarray(phi).reshape((-1,3))
+    angles = np.linalg.norm(phi, axis=1)
+    small = np.isclose(angles, 0.)
+
+    J_inv = np.eye(3) - 0.5*so3_wedge(phi)
+    half_angle = 0.5*angles[~small].reshape((-1,1,1))
+    axes = phi[~small]/angles[~small].reshape((-1,1))
+    half_cot = half_angle/np.tan(half_angle)
+    J_inv[~small] = half_cot*np.eye(3) + (1. - half_cot)*batch_outer_prod(axes) - half_angle*so3_wedge(axes)
+    return J_inv
+
+def rpy_to_so3(rpy):
+    #input: rpy Nx3 (roll, pitch, yaw)
+    #output: R = Rz(yaw) Ry(pitch) Rx(roll), Nx3x3 (as SO3.from_rpy)
+    rpy = np.asarray(rpy).reshape((-1,3))
+    cr, sr = np.cos(rpy[:,0]), np.sin(rpy[:,0])
+    cp, sp = np.cos(rpy[:,1]), np.sin(rpy[:,1])
+    cy, sy = np.cos(rpy[:,2]), np.sin(rpy[:,2])
+
+    R = np.empty((rpy.shape[0], 3, 3))
+    R[:, 0, 0] = cy*cp
+    R[:, 0, 1] = cy*sp*sr - sy*cr
+    R[:, 0, 2] = cy*sp*cr + sy*sr
+    R[:, 1, 0] = sy*cp
+    R[:, 1, 1] = sy*sp*sr + cy*cr
+    R[:, 1, 2] = sy*sp*cr - cy*sr
+    R[:, 2, 0] = -sp
+    R[:, 2, 1] = cp*sr
+    R[:, 2, 2] = cp*cr
+    return R
+
+def quaternion_to_so3(quat, ordering='wxyz'):
+    #input: quat Nx4 (wxyz or xyzw ordering, normalized to unit length)
+    #output: R Nx3x3 (as SO3.from_quaternion)
+    quat = np.asarray(quat, dtype=np.float64).reshape((-1,4))
+    if ordering == 'xyzw':
+        quat = quat[:, [3, 0, 1, 2]]
+    quat = quat/np.linalg.norm(quat, axis=1, keepdims=True)
+    w, x, y, z = quat.T
+
+    R = np.empty((quat.shape[0], 3, 3))
+    R[:, 0, 0] = 1 - 2*(y*y + z*z)
+    R[:, 0, 1] = 2*(x*y - w*z)
+    R[:, 0, 2] = 2*(x*z + w*y)
+    R[:, 1, 0] = 2*(x*y + w*z)
+    R[:, 1, 1] = 1 - 2*(x*x + z*z)
+    R[:, 1, 2] = 2*(y*z - w*x)
+    R[:, 2, 0] = 2*(x*z - w*y)
+    R[:, 2, 1] = 2*(y*z + w*x)
+    R[:, 2, 2] = 1 - 2*(x*x + y*y)
+    return R
+
+def se3_normalize(T):
+    #Nx4x4 transforms with their rotations projected onto SO(3) (as SE3.from_matrix(T, normalize=True))
+    T = np.array(T, dtype=np.float64).reshape((-1,4,4))
+    T[:, 0:3, 0:3] = so3_normalize(T[:, 0:3, 0:3])
+    T[:, 3, :] = np.array([0., 0., 0., 1.])
+    return T
+
+def se3_inv(T):
+    T = np.asarray(T).reshape((-1,4,4))
+    T_inv = np.zeros_like(T)
+    R_inv = T[:, 0:3, 0:3].transpose(0,2,1)
+    T_inv[:, 0:3, 0:3] = R_inv
+    T_inv[:, 0:3, 3] = -(R_inv @ T[:, 0:3, 3:4])[:, :, 0]
+    T_inv[:, 3, 3] = 1
+    return T_inv
+
+def se3_log(T):
+    #input: T Nx4x4
+    #output: log(T) Nx6
+    T = np.asarray(T).reshape((-1,4,4))
+    phi = so3_log(T[:, 0:3, 0:3])
+    rho = (so3_inv_left_jacobian(phi) @ T[:, 0:3, 3:4])[:, :, 0]
+    return np.concatenate((rho, phi), axis=1)
+
+def se3_exp(xi):
+    #input: xi Nx6
+    #output: exp(xi) Nx4x4
+    xi = np.asarray(xi).reshape((-1,6))
+    rho, phi = xi[:, 0:3], xi[:, 3:6]
+    T = np.zeros((xi.shape[0], 4, 4))
+    T[:, 0:3, 0:3] = so3_exp(phi)
+    T[:, 0:3, 3] = (so3_left_jacobian(phi) @ rho[:, :, None])[:, :, 0]
+    T[:, 3, 3] = 1
+    return T
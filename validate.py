@@ -4,6 +4,8 @@ from train_mono import solve_pose, compute_pose
 import numpy as np
 from liegroups import SE3
 from models.stn import *
+from data.kitti_loader import collate_samples, batch_to_device
+from utils.dense_flow import batch_flow
 from pyslam.metrics import TrajectoryMetrics
 import csv
 
@@ -22,28 +24,20 @@ def test_depth_and_reconstruction(device, models,  dset, config, epoch=0, source
     img_idx=np.arange(0,dset_length,int(dset_length/5 -1))
 
     for i in img_idx:
-        target_img, source_imgs, lie_alg, intrinsics, flow_imgs = dset.dataset.__getitem__(i)
-        target_img, source_imgs, intrinsics = target_img['color_aug_left'], source_imgs['color_aug_left'], intrinsics['color_aug_left']
-        target_img = target_img.to(device).unsqueeze(0)
-        lie_alg = lie_alg['color_aug']
-
-        gt_lie_alg_list = []
-        vo_lie_alg_list = []
-        source_img_list = []
-
-        for j, im in enumerate(source_imgs):              
-            source_img_list.append(im.to(device).unsqueeze(0))
-            gt_lie_alg_list.append(torch.FloatTensor(lie_alg[j][0]).to(device).unsqueeze(0) )
-            vo_lie_alg_list.append(torch.FloatTensor(lie_alg[j][1]).to(device).unsqueeze(0) )
-    
-        intrinsics = torch.FloatTensor(intrinsics).to(device)[0,:,:].unsqueeze(0)
+        data = batch_to_device(collate_samples([dset.dataset.__getitem__(i)]), device)
+        if config.get('batch_augment', False):
+            data = get_batch_transforms(config)[dset.dataset.mode](data)
+        imgs = data['imgs']['color_aug_left'] #[1,S,3,H,W], target image first
+        target_img = imgs[:,0]
+        source_img_list = list(imgs[:,1:].unbind(1))
+        gt_lie_alg_list = list(data['lie_alg']['gt'].unbind(1))
+        vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
+        intrinsics = data['intrinsics']['color_left']
         
-        if config['flow_type'] == 'classical':
-            flow_imgs_fwd, flow_imgs_back = flow_imgs
-            flow_imgs_fwd_list, flow_imgs_back_list = [], []
-            for i in range(0, len(flow_imgs_fwd)):
-                flow_imgs_fwd_list.append(flow_imgs_fwd[i].to(device).unsqueeze(0))
-                flow_imgs_back_list.append(flow_imgs_back[i].to(device).unsqueeze(0))
+        if config['flow_type'] == 'device': ## dense flow of the un-jittered images, computed on the device
+            data['flow'] = batch_flow(data['imgs']['color_left'])
+        if config['flow_type'] in ['classical', 'cached', 'device']:
+            flow_imgs_fwd_list, flow_imgs_back_list = list(data['flow']['fwd'].unbind(1)), list(data['flow']['back'].unbind(1))
             flow_imgs = [flow_imgs_fwd_list, flow_imgs_back_list]
         else:
             flow_imgs = [[None for i in range(0,len(source_img_list))] for i in range(0,2)] #annoying but necessary  
@@ -141,29 +135,24 @@ def test_trajectory(config, device, models, dset, epoch):
     full_corr_lie_alg_stacked, gt_lie_alg_stacked, vo_lie_alg_stacked, corrections_stacked, gt_corrections_stacked= \
             np.empty((0,6)), np.empty((0,6)), np.empty((0,6)), np.empty((0,6)), np.empty((0,6)),
 
+    batch_transform = get_batch_transforms(config)['test'] if config.get('batch_augment', False) else None
     for data in dset:
-        target_img, source_imgs, lie_alg, intrinsics, flow_imgs = data
-        lie_alg = lie_alg['color']
-        gt_lie_alg, vo_lie_alg, gt_correction, _ = lie_alg[0]
-        target_img = target_img['color_left'].to(device)
-        source_img_list = []
-        gt_lie_alg_list = []
-        vo_lie_alg_list = []
-
-        for i, im, in enumerate(source_imgs['color_aug_left']):
-            source_img_list.append(source_imgs['color_left'][i].to(device))
-            gt_lie_alg_list.append(lie_alg[i][0].type(torch.FloatTensor).to(device))
-            vo_lie_alg_list.append(lie_alg[i][1].type(torch.FloatTensor).to(device))
-
-        intrinsics = intrinsics['color_left'].type(torch.FloatTensor).to(device)[:,0,:,:]
-
-        if config['flow_type'] == 'classical':
-            flow_imgs_fwd, flow_imgs_back = flow_imgs
-            flow_imgs_fwd_list, flow_imgs_back_list = [], []
-            for i in range(0, len(flow_imgs_fwd)):
-                flow_imgs_fwd_list.append(flow_imgs_fwd[i].to(device))
-                flow_imgs_back_list.append(flow_imgs_back[i].to(device))
-            flow_imgs = [flow_imgs_fwd_list, flow_imgs_back_list]
+        data = batch_to_device(data, device)
+        if batch_transform is not None:
+            data = batch_transform(data)
+        imgs = data['imgs']['color_left'] #[B,S,3,H,W], target image first
+        gt_lie_alg, vo_lie_alg, gt_correction = data['lie_alg']['gt'][:,0], data['lie_alg']['vo'][:,0], data['lie_alg']['gt_correction'][:,0]
+        target_img = imgs[:,0]
+        source_img_list = list(imgs[:,1:].unbind(1))
+        gt_lie_alg_list = list(data['lie_alg']['gt'].unbind(1))
+        vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
+
+        intrinsics = data['intrinsics']['color_left']
+
+        if config['flow_type'] == 'device': ## dense flow of the un-jittered images, computed on the device
+            data['flow'] = batch_flow(data['imgs']['color_left'])
+        if config['flow_type'] in ['classical', 'cached', 'device']:
+            flow_imgs = [list(data['flow']['fwd'].unbind(1)), list(data['flow']['back'].unbind(1))]
         else:
             flow_imgs = [[None for i in range(0,len(source_img_list))] for i in range(0,2)] #annoying but necessary
 
@@ -202,19 +191,15 @@ def get_plane_masks(device, models, dset, config, epoch=0, source_img_idx=0): #[
     img_idx=np.arange(0,dset_length,int(dset_length/5 -1))
 
     for i in img_idx:
-        target_img, source_imgs, lie_alg, intrinsics, _ = dset.dataset.__getitem__(i)
-        target_img, source_imgs, intrinsics = target_img['color_aug_left'], source_imgs['color_aug_left'], intrinsics['color_aug_left']
-        target_img = target_img.to(device).unsqueeze(0)
-        lie_alg = lie_alg['color_aug']
-
-        gt_lie_alg_list = []
-        vo_lie_alg_list = []
-        source_img_list = []
-        for j, im in enumerate(source_imgs):              
-            source_img_list.append(im.to(device).unsqueeze(0))
-            gt_lie_alg_list.append(torch.FloatTensor(lie_alg[j][0]).to(device).unsqueeze(0) )
-            vo_lie_alg_list.append(torch.FloatTensor(lie_alg[j][1]).to(device).unsqueeze(0) )
-        intrinsics = torch.FloatTensor(intrinsics).to(device)[0,:,:].unsqueeze(0)
+        data = batch_to_device(collate_samples([dset.dataset.__getitem__(i)]), device)
+        if config.get('batch_augment', False):
+            data = get_batch_transforms(config)[dset.dataset.mode](data)
+        imgs = data['imgs']['color_aug_left'] #[1,S,3,H,W], target image first
+        target_img = imgs[:,0]
+        source_img_list = list(imgs[:,1:].unbind(1))
+        gt_lie_alg_list = list(data['lie_alg']['gt'].unbind(1))
+        vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
+        intrinsics = data['intrinsics']['color_left']
                
         exp_mask = plane_model(target_img)
 
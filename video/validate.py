@@ -5,6 +5,8 @@ sys.path.insert(0,'..')
 from utils.learning_helpers import *
 from train_mono import apply_dpc, solve_pose
 from models.stn import *
+from data.kitti_loader import batch_to_device
+from utils.dense_flow import batch_flow
 from vis import UnNormalize_img_array
 
 def test_depth_and_reconstruction(device, models, data, config):
@@ -13,37 +15,26 @@ def test_depth_and_reconstruction(device, models, data, config):
     mode = config['pose_output_type']
     depth_model, pose_model = models[0], models[1]
     
-    target_img, source_imgs, lie_alg, intrinsics, flow_imgs = data
-    # flow_imgs_fwd, flow_imgs_back = flow_imgs[0], flow_imgs[1]
-
-    lie_alg = lie_alg['color']
-    target_img, source_imgs, intrinsics = target_img['color_left'], source_imgs['color_left'], intrinsics['color_left']
-    target_img = target_img.to(device)
+    data = batch_to_device(data, device)
+    imgs = data['imgs']['color_left'] #[B,S,3,H,W], target image first
+    target_img = imgs[:,0]
 
     source_disp_array = torch.zeros(0)  
     depth_masks = torch.zeros(0)  
     valid_masks = torch.zeros(0)
     diff_imgs = torch.zeros(0)
-    source_img_list = []
-    gt_lie_alg_list = []
-    vo_lie_alg_list = []
-
-    for i, im, in enumerate(source_imgs):
-        source_img_list.append(im.to(device))
-        gt_lie_alg_list.append(lie_alg[i][0].type(torch.FloatTensor).to(device))
-        vo_lie_alg_list.append(lie_alg[i][1].type(torch.FloatTensor).to(device))
+    source_img_list = list(imgs[:,1:].unbind(1))
+    gt_lie_alg_list = list(data['lie_alg']['gt'].unbind(1))
+    vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
         
-        if config['flow_type'] == 'classical':
-            flow_imgs_fwd, flow_imgs_back = flow_imgs
-            flow_imgs_fwd_list, flow_imgs_back_list = [], []
-            for i in range(0, len(flow_imgs_fwd)):
-                flow_imgs_fwd_list.append(flow_imgs_fwd[i].to(device))
-                flow_imgs_back_list.append(flow_imgs_back[i].to(device))
-            flow_imgs = [flow_imgs_fwd_list, flow_imgs_back_list]
-        else:
-            flow_imgs = [[None for i in range(0,len(source_img_list))] for i in range(0,2)] #annoying but necessary
+    if config['flow_type'] == 'device': ## dense flow of the un-jittered images, computed on the device
+        data['flow'] = batch_flow(data['imgs']['color_left'])
+    if config['flow_type'] in ['classical', 'cached', 'device']:
+        flow_imgs = [list(data['flow']['fwd'].unbind(1)), list(data['flow']['back'].unbind(1))]
+    else:
+        flow_imgs = [[None for i in range(0,len(source_img_list))] for i in range(0,2)] #annoying but necessary
 
-    intrinsics = intrinsics.type(torch.FloatTensor).to(device)[:,0,:,:]
+    intrinsics = data['intrinsics']['color_left']
     disparity = depth_model(target_img, epoch=50)
     disparities = [disparity]
     
@@ -62,25 +53,18 @@ def get_plane_masks(device, plane_model, data, config):
     plane_model = plane_model.train(False).eval()
     plane_array = torch.zeros(0)
     
-    target_img, source_imgs, lie_alg, intrinsics, flow_imgs = data
-
-    lie_alg = lie_alg['color']
-    target_img, source_imgs, intrinsics = target_img['color_left'], source_imgs['color_left'], intrinsics['color_left']
-    target_img = target_img.to(device)
+    data = batch_to_device(data, device)
+    imgs = data['imgs']['color_left'] #[B,S,3,H,W], target image first
+    target_img = imgs[:,0]
 
     source_disp_array = torch.zeros(0)  
     depth_masks = torch.zeros(0)  
     valid_masks = torch.zeros(0)
-    source_img_list = []
-    gt_lie_alg_list = []
-    vo_lie_alg_list = []
-
-    for i, im, in enumerate(source_imgs):
-        source_img_list.append(im.to(device))
-        gt_lie_alg_list.append(lie_alg[i][0].type(torch.FloatTensor).to(device))
-        vo_lie_alg_list.append(lie_alg[i][1].type(torch.FloatTensor).to(device))
+    source_img_list = list(imgs[:,1:].unbind(1))
+    gt_lie_alg_list = list(data['lie_alg']['gt'].unbind(1))
+    vo_lie_alg_list = list(data['lie_alg']['vo'].unbind(1))
 
-    intrinsics = intrinsics.type(torch.FloatTensor).to(device)[:,0,:,:]
+    intrinsics = data['intrinsics']['color_left']
     plane = plane_model(target_img)
 
     plane = plane[0]